@@ -0,0 +1,130 @@
+"""
+Routing of new leave requests to advisors.
+
+The policy is chosen with ADVISOR_ROUTING_POLICY:
+
+- ``section``: advisors of the student's section, narrowed to the student's
+  department when any of them share it (default)
+- ``department``: advisors of the student's department
+- ``round_robin``: one advisor, rotating through all advisors
+- ``least_loaded``: the advisor with the fewest pending requests
+- ``all``: every advisor (the original behaviour)
+
+``section`` and ``department`` fall back to ``least_loaded`` when no advisor
+matches. Advisor lookups come from an in-memory directory that is rebuilt
+after user changes or ADVISOR_DIRECTORY_TTL seconds, whichever comes first.
+"""
+import itertools
+import os
+import threading
+import time
+from typing import Dict, List
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from logging_config import logger
+from models import LeaveRequest, User, request_advisors
+
+ROUTING_POLICIES = ("section", "department", "round_robin", "least_loaded", "all")
+ADVISOR_ROUTING_POLICY = os.getenv("ADVISOR_ROUTING_POLICY", "section")
+ADVISOR_DIRECTORY_TTL = float(os.getenv("ADVISOR_DIRECTORY_TTL", "60"))
+
+if ADVISOR_ROUTING_POLICY not in ROUTING_POLICIES:
+    logger.warning(
+        f"Unknown ADVISOR_ROUTING_POLICY '{ADVISOR_ROUTING_POLICY}', using 'section'. "
+        f"Valid policies: {', '.join(ROUTING_POLICIES)}"
+    )
+    ADVISOR_ROUTING_POLICY = "section"
+
+
+class AdvisorDirectory:
+    """Precomputed advisor id lists, keyed by section and department"""
+
+    def __init__(self, ttl: float = ADVISOR_DIRECTORY_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self.all_ids: List[str] = []
+        self.by_section: Dict[str, List[str]] = {}
+        self.by_department: Dict[str, List[str]] = {}
+        self.department_of: Dict[str, str] = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def refresh_if_stale(self, db: Session) -> "AdvisorDirectory":
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self
+            rows = db.query(User.id, User.section, User.department).filter(
+                User.role == "advisor"
+            ).order_by(User.id).all()
+
+            self.all_ids = [row.id for row in rows]
+            self.by_section, self.by_department, self.department_of = {}, {}, {}
+            for row in rows:
+                if row.section:
+                    self.by_section.setdefault(row.section, []).append(row.id)
+                if row.department:
+                    self.by_department.setdefault(row.department, []).append(row.id)
+                    self.department_of[row.id] = row.department
+            self._loaded_at = time.monotonic()
+            return self
+
+
+def pending_counts(db: Session, advisor_ids: List[str] = None) -> Dict[str, int]:
+    """Number of pending requests assigned to each advisor, zero included"""
+    query = db.query(
+        request_advisors.c.advisor_id, func.count()
+    ).join(
+        LeaveRequest, LeaveRequest.id == request_advisors.c.request_id
+    ).filter(LeaveRequest.status == "pending")
+    if advisor_ids is not None:
+        query = query.filter(request_advisors.c.advisor_id.in_(advisor_ids))
+    counts = dict(query.group_by(request_advisors.c.advisor_id).all())
+
+    if advisor_ids is None:
+        advisor_ids = advisor_directory.refresh_if_stale(db).all_ids
+    return {advisor_id: counts.get(advisor_id, 0) for advisor_id in advisor_ids}
+
+
+class AdvisorRouter:
+    def __init__(self, policy: str = ADVISOR_ROUTING_POLICY, directory: AdvisorDirectory = None):
+        self.policy = policy
+        self.directory = directory or advisor_directory
+        self._round_robin = itertools.count()
+
+    def route(self, db: Session, student: User) -> List[str]:
+        """Return the ids of the advisors a new request from ``student`` should go to"""
+        directory = self.directory.refresh_if_stale(db)
+        if not directory.all_ids:
+            return []
+
+        if self.policy == "all":
+            return list(directory.all_ids)
+        if self.policy == "round_robin":
+            return [directory.all_ids[next(self._round_robin) % len(directory.all_ids)]]
+
+        candidates = []
+        if self.policy == "section" and student.section:
+            candidates = directory.by_section.get(student.section, [])
+            if student.department:
+                same_department = [
+                    advisor_id for advisor_id in candidates
+                    if directory.department_of.get(advisor_id) == student.department
+                ]
+                candidates = same_department or candidates
+        elif self.policy == "department" and student.department:
+            candidates = directory.by_department.get(student.department, [])
+        if candidates:
+            return list(candidates)
+
+        # least_loaded, or nobody matched the student's section/department
+        counts = pending_counts(db, directory.all_ids)
+        return [min(directory.all_ids, key=lambda advisor_id: counts[advisor_id])]
+
+
+advisor_directory = AdvisorDirectory()
+advisor_router = AdvisorRouter()
@@ -0,0 +1,196 @@
+"""
+Background archiving of leave requests.
+
+Request handlers never touch the filesystem: they call ``enqueue`` to add an
+ArchiveOutbox row inside their own transaction, so a snapshot is stored if and
+only if the change it describes is committed. A worker thread drains the
+outbox in batches and appends them as gzip-compressed NDJSON to append-only
+segment files. Failed batches stay in the outbox and are retried with
+exponential backoff.
+
+Delivery is at-least-once: if the process dies between writing a batch and
+deleting its outbox rows, the batch is written again on restart. Readers can
+drop duplicates by ``outbox_id``.
+"""
+import gzip
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from logging_config import logger
+from models import ArchiveOutbox, ArchivedLeaveRequest, LeaveRequest
+
+ARCHIVE_SEGMENT_DIR = os.getenv(
+    "ARCHIVE_SEGMENT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive", "segments")
+)
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_FLUSH_INTERVAL = float(os.getenv("ARCHIVE_FLUSH_INTERVAL", "2"))
+ARCHIVE_SEGMENT_MAX_BYTES = int(os.getenv("ARCHIVE_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+ARCHIVE_MAX_BACKOFF = 300  # seconds
+ARCHIVE_LEASE_SECONDS = 60
+
+
+def serialize_request(req: LeaveRequest) -> dict:
+    """Snapshot a leave request as JSON-compatible data, referencing its image by URL"""
+    has_image = req.image_path if isinstance(req, ArchivedLeaveRequest) else req.image_data
+    return {
+        "id": req.id,
+        "student_id": req.student_id,
+        "start_date": req.start_date.isoformat() if req.start_date else None,
+        "end_date": req.end_date.isoformat() if req.end_date else None,
+        "reason": req.reason,
+        "status": req.status,
+        "approved_by": req.approved_by,
+        "image_url": f"/requests/{req.id}/image" if has_image else None,
+        "created_at": req.created_at.isoformat() if req.created_at else None,
+    }
+
+
+def enqueue(db: Session, req: LeaveRequest, event: str) -> None:
+    """Queue a snapshot of ``req`` for archiving as part of the caller's transaction"""
+    payload = serialize_request(req)
+    payload["event"] = event
+    db.add(ArchiveOutbox(
+        request_id=req.id,
+        event=event,
+        payload=json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
+    ))
+
+
+class ArchiveWorker:
+    """Drains the archive outbox into compressed NDJSON segment files"""
+
+    def __init__(self, segment_dir: str = ARCHIVE_SEGMENT_DIR):
+        self.segment_dir = segment_dir
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._segment_path = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="archive-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the worker after a final drain of whatever is already due"""
+        if not self._thread:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def notify(self):
+        """Wake the worker early; cheap enough to call from a request handler"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(ARCHIVE_FLUSH_INTERVAL)
+            self._wake.clear()
+            self.drain()
+        self.drain()
+
+    def drain(self) -> int:
+        """Archive every due outbox row, returning how many were written"""
+        total = 0
+        while True:
+            try:
+                written = self._drain_batch()
+            except Exception as e:
+                logger.error(f"Archive worker failed to drain outbox: {e}", exc_info=True)
+                return total
+            total += written
+            if written < ARCHIVE_BATCH_SIZE:
+                return total
+
+    def _drain_batch(self) -> int:
+        db = SessionLocal()
+        try:
+            rows = self._claim(db)
+            if not rows:
+                return 0
+
+            try:
+                self._append(rows)
+            except Exception as e:
+                logger.warning(f"Archiving {len(rows)} leave request snapshots failed, will retry: {e}")
+                now = datetime.utcnow()
+                for row in rows:
+                    row.attempts += 1
+                    row.lease = None
+                    row.last_error = str(e)[:500]
+                    row.next_attempt_at = now + timedelta(seconds=min(2 ** row.attempts, ARCHIVE_MAX_BACKOFF))
+                db.commit()
+                return 0
+
+            db.query(ArchiveOutbox).filter(
+                ArchiveOutbox.id.in_([row.id for row in rows])
+            ).delete(synchronize_session=False)
+            db.commit()
+            return len(rows)
+        finally:
+            db.close()
+
+    def _claim(self, db: Session):
+        """Lease a batch of due rows so concurrent workers never write the same row"""
+        token = str(uuid.uuid4())
+        now = datetime.utcnow()
+        due_ids = db.query(ArchiveOutbox.id).filter(
+            ArchiveOutbox.next_attempt_at <= now
+        ).order_by(ArchiveOutbox.id).limit(ARCHIVE_BATCH_SIZE).scalar_subquery()
+
+        claimed = db.query(ArchiveOutbox).filter(
+            ArchiveOutbox.id.in_(due_ids),
+            ArchiveOutbox.next_attempt_at <= now
+        ).update({
+            ArchiveOutbox.lease: token,
+            ArchiveOutbox.next_attempt_at: now + timedelta(seconds=ARCHIVE_LEASE_SECONDS),
+        }, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return []
+        return db.query(ArchiveOutbox).filter(
+            ArchiveOutbox.lease == token
+        ).order_by(ArchiveOutbox.id).all()
+
+    def _append(self, rows):
+        archived_at = datetime.utcnow().isoformat() + 'Z'
+        lines = []
+        for row in rows:
+            record = json.loads(row.payload)
+            record["outbox_id"] = row.id
+            record["archived_at"] = archived_at
+            lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+        # Each batch is a complete gzip member; concatenated members form a valid gzip file
+        data = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+        with open(self._current_segment(), "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _current_segment(self) -> str:
+        if self._segment_path and os.path.exists(self._segment_path) \
+                and os.path.getsize(self._segment_path) < ARCHIVE_SEGMENT_MAX_BYTES:
+            return self._segment_path
+
+        os.makedirs(self.segment_dir, exist_ok=True)
+        # One file per process so multiple workers never interleave appends
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        self._segment_path = os.path.join(
+            self.segment_dir, f"leave-requests-{stamp}-{os.getpid()}.ndjson.gz"
+        )
+        return self._segment_path
+
+
+archive_worker = ArchiveWorker()
@@ -6,8 +6,10 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 from models import User
 from database import SessionLocal
+from metrics import time_password_hash
 import schemas
 from typing import List, Callable
+from functools import lru_cache
 import os
 
 # Import rate limiter
@@ -29,10 +31,15 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Dummy hash used to mitigate timing attacks when a user is not found.
-# We compute one hash once at import time and reuse it for verification
-# when the user record is missing. The actual string hashed here is
-# irrelevant; the goal is to perform a full password-verify operation.
-DUMMY_HASH = pwd_context.hash("dummy-password-for-timing-mitigation")
+# We compute one hash on first use and reuse it for verification when the
+# user record is missing. The actual string hashed here is irrelevant; the
+# goal is to perform a full password-verify operation. Not at import time:
+# a bcrypt hash costs ~0.3s of every start (prefork.py computes it once in
+# the master, before forking).
+@lru_cache(maxsize=None)
+def dummy_hash() -> str:
+    return pwd_context.hash("dummy-password-for-timing-mitigation")
+
 security = HTTPBearer()
 
 router = APIRouter()
@@ -45,20 +52,22 @@ def get_db():
         db.close()
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    with time_password_hash("verify"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    with time_password_hash("hash"):
+        return pwd_context.hash(password)
 
 def authenticate_user(db: Session, username: str, password: str):
     """Authenticate user while avoiding timing leaks.
 
     Always run the password verification step using either the real
-    user's hashed password or a module-level DUMMY_HASH so the timing
+    user's hashed password or the module-level dummy_hash() so the timing
     of the operation doesn't reveal whether the user exists.
     """
     user = db.query(User).filter(User.username == username).first()
-    candidate_hash = user.hashed_password if user else DUMMY_HASH
+    candidate_hash = user.hashed_password if user else dummy_hash()
     verified = verify_password(password, candidate_hash)
     if not (user and verified):
         return None
@@ -72,8 +81,12 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+    return user_from_token(credentials.credentials, db)
+
+def user_from_token(token: str, db: Session) -> User:
+    """The user a bearer token belongs to; 401 if the token or the user is invalid"""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
@@ -96,14 +109,18 @@ def get_current_user_with_roles(allowed_roles: List[str]) -> Callable:
             pass
     """
     def role_checker(current_user: User = Depends(get_current_user)) -> User:
-        if current_user.role not in allowed_roles:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"Access denied. Required roles: {', '.join(allowed_roles)}. Your role: {current_user.role}"
-            )
+        check_role(current_user, allowed_roles)
         return current_user
     return role_checker
 
+def check_role(user: User, allowed_roles: List[str]) -> None:
+    """403 unless the user has one of the allowed roles"""
+    if user.role not in allowed_roles:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Access denied. Required roles: {', '.join(allowed_roles)}. Your role: {user.role}"
+        )
+
 # Alias for backwards compatibility
 require_roles = get_current_user_with_roles
 
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Compression ratio and CPU cost per content coding and level.
+
+Uses the GET /requests/ payload from the list benchmark's seed data, reports
+ratio and CPU time for each level compression.py may choose, then fetches
+the endpoint through CompressionMiddleware with each Accept-Encoding and
+prints /admin/compression. Run from the backend directory:
+
+    python benchmarks/bench_compression.py [iterations]
+"""
+import sys
+import time
+
+from bench_list_endpoints import main, seed  # noqa: E402 (sets up the database)
+from fastapi.testclient import TestClient  # noqa: E402
+
+import compression  # noqa: E402
+
+
+def cpu_ms(encoding, data, level, iterations):
+    started = time.thread_time()
+    for _ in range(iterations):
+        out = compression.compress(encoding, data, level)
+    return (time.thread_time() - started) * 1000 / iterations, len(out)
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    headers = seed()
+    with TestClient(main.app) as client:
+        body = client.get("/requests/", headers={**headers, "Accept-Encoding": "identity"}).content
+        print(f"/requests/ payload: {len(body) / 1024:.1f} KiB\n")
+
+        for encoding in compression.available_encodings():
+            levels = sorted({level for _, level in compression.LEVELS[encoding]})
+            chosen = compression.level_for(encoding, len(body))
+            for level in levels:
+                ms, size = cpu_ms(encoding, body, level, iterations)
+                marker = "  <- chosen for this size" if level == chosen else ""
+                print(f"{encoding:<5} level {level:>2}   ratio {len(body) / size:6.2f}   "
+                      f"cpu {ms:7.2f} ms   {size / 1024:7.1f} KiB{marker}")
+
+        print()
+        for encoding in compression.available_encodings():
+            for _ in range(iterations):
+                response = client.get("/requests/", headers={**headers, "Accept-Encoding": encoding})
+                assert response.headers["content-encoding"] == encoding
+        admin_headers = {**headers, "Accept-Encoding": "identity"}
+        for encoding, stats in client.get("/admin/compression", headers=admin_headers).json().items():
+            print(f"{encoding:<5} responses {stats['responses']:>4}   offloaded {stats['offloaded']:>4}   "
+                  f"ratio {stats['ratio']:6.2f}   cpu {stats['cpu_seconds'] * 1000 / stats['responses']:7.2f} ms/response")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Latency of the large list endpoints, measured in-process with TestClient.
+
+Seeds a throwaway SQLite database, then times GET /attendance/?limit=500
+and GET /requests/ (every request). Run from the backend directory:
+
+    python benchmarks/bench_list_endpoints.py [iterations]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from auth import create_access_token, get_password_hash  # noqa: E402
+from database import Base, SessionLocal, engine  # noqa: E402
+from models import AttendanceRecord, LeaveRequest, User, request_advisors  # noqa: E402
+
+STUDENTS = 200
+ATTENDANCE_DAYS = 30
+LEAVE_REQUESTS = 2000
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    password = get_password_hash("benchmark")
+    admin = User(id=str(uuid.uuid4()), username="admin", hashed_password=password, role="admin")
+    advisors = [User(id=str(uuid.uuid4()), username=f"advisor{i}", hashed_password=password, role="advisor")
+                for i in range(3)]
+    students = [User(id=str(uuid.uuid4()), username=f"student{i}", hashed_password=password, role="student",
+                     name=f"Student {i}", roll_no=f"R{i:05d}") for i in range(STUDENTS)]
+    db.add_all([admin, *advisors, *students])
+    db.flush()
+
+    start = date(2026, 1, 1)
+    db.bulk_insert_mappings(AttendanceRecord, [
+        {"id": str(uuid.uuid4()), "student_id": student.id, "date": start + timedelta(days=day),
+         "status": "Present" if (day + i) % 7 else "Absent", "marked_by": admin.id}
+        for i, student in enumerate(students) for day in range(ATTENDANCE_DAYS)
+    ])
+    leaves = [
+        {"id": str(uuid.uuid4()), "student_id": students[i % STUDENTS].id,
+         "start_date": start + timedelta(days=i % 300), "end_date": start + timedelta(days=i % 300 + 1),
+         "reason": f"Medical leave number {i}", "status": ("pending", "approved", "rejected")[i % 3]}
+        for i in range(LEAVE_REQUESTS)
+    ]
+    db.bulk_insert_mappings(LeaveRequest, leaves)
+    db.execute(request_advisors.insert(), [
+        {"request_id": leave["id"], "advisor_id": advisors[i % 3].id} for i, leave in enumerate(leaves)
+    ])
+    db.commit()
+    db.close()
+    return {"Authorization": "Bearer " + create_access_token({"sub": "admin", "role": "admin"})}
+
+
+def bench(client, path, headers, iterations):
+    client.get(path, headers=headers)  # warm up
+    timings, size = [], 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = client.get(path, headers={**headers, "Accept-Encoding": "identity"})
+        timings.append((time.perf_counter() - started) * 1000)
+        size = len(response.content)
+        assert response.status_code == 200, response.text
+    timings.sort()
+    print(f"{path:<28} median {statistics.median(timings):7.2f} ms   "
+          f"p95 {timings[int(len(timings) * 0.95) - 1]:7.2f} ms   {size / 1024:7.1f} KiB")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    headers = seed()
+    with TestClient(main.app) as client:
+        bench(client, "/attendance/?limit=500", headers, iterations)
+        bench(client, "/requests/", headers, iterations)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Requests per second on GET / through different middleware stacks.
+
+Calls the ASGI apps directly (no server, no HTTP parsing) so the numbers
+show only the framework and middleware cost:
+
+- bare: the route with no middleware
+- base_http: the former @app.middleware("http") timing and error logging
+  functions (BaseHTTPMiddleware), plus CORS and compression as in main.py
+- pure_asgi: the same stack with middleware.py
+- main.app: the application as configured
+
+Run from the backend directory:
+
+    python benchmarks/bench_middleware.py [requests]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.middleware.cors import CORSMiddleware  # noqa: E402
+from fastapi.responses import ORJSONResponse  # noqa: E402
+
+import main  # noqa: E402
+from compression import CompressionMiddleware  # noqa: E402
+from logging_config import logger  # noqa: E402
+from middleware import ErrorLoggingMiddleware, TimingMiddleware  # noqa: E402
+
+SCOPE = {
+    "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+    "scheme": "http", "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+    "headers": [(b"host", b"localhost"), (b"accept-encoding", b"gzip, br"), (b"origin", b"http://localhost")],
+    "client": ("127.0.0.1", 50000), "server": ("localhost", 8000),
+}
+
+
+def build_app(kind):
+    app = FastAPI(default_response_class=ORJSONResponse)
+
+    @app.get("/")
+    def read_root():
+        return {"message": "College Attendance Marker API is running", "version": "1.0.0"}
+
+    if kind == "bare":
+        return app
+
+    if kind == "base_http":
+        @app.middleware("http")
+        async def add_process_time_header(request: Request, call_next):
+            start_time = time.time()
+            response = await call_next(request)
+            process_time = time.time() - start_time
+            response.headers["X-Process-Time"] = str(process_time)
+            if process_time > 1.0:
+                logger.warning(f"Slow request: {request.method} {request.url.path} took {process_time:.2f}s")
+            return response
+
+        @app.middleware("http")
+        async def log_errors(request: Request, call_next):
+            try:
+                return await call_next(request)
+            except Exception as e:
+                logger.error(f"Unhandled error in {request.method} {request.url.path}: {e}", exc_info=True)
+                raise
+    else:
+        app.add_middleware(TimingMiddleware)
+        app.add_middleware(ErrorLoggingMiddleware)
+
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True,
+                       allow_methods=["*"], allow_headers=["*"], max_age=3600)
+    app.add_middleware(CompressionMiddleware)
+    return app
+
+
+async def run(app, requests):
+    request = {"type": "http.request", "body": b"", "more_body": False}
+    never = asyncio.Event()
+
+    def make_receive():
+        # Like a server: the body once, then wait for a disconnect that never comes
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return request
+            await never.wait()
+
+        return receive
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message
+
+    for _ in range(200):  # warm up
+        await app(dict(SCOPE), make_receive(), send)
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(SCOPE), make_receive(), send)
+    return requests / (time.perf_counter() - started)
+
+
+async def bench(requests):
+    results = {}
+    for name, app in (("bare", build_app("bare")), ("base_http", build_app("base_http")),
+                      ("pure_asgi", build_app("pure_asgi")), ("main.app", main.app)):
+        results[name] = await run(app, requests)
+        print(f"{name:<10} {results[name]:9.0f} req/s")
+    print(f"\npure_asgi vs base_http: {results['pure_asgi'] / results['base_http']:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Cold start: time from launching the server process to the first successful
+request.
+
+Each run starts ``uvicorn main:app`` in a new process and polls GET /health
+until it answers 200. Runs alternate between a fresh database (schema
+created at startup) and the database the previous run left behind (the
+usual restart).
+
+Run from the backend directory:
+
+    python benchmarks/bench_startup.py [runs]
+"""
+import http.client
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMEOUT = 60
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def healthy(port: int) -> bool:
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+        conn.request("GET", "/health")
+        ok = conn.getresponse().status == 200
+        conn.close()
+        return ok
+    except OSError:
+        return False
+
+
+def time_to_first_request(database_dir: str) -> float:
+    port = free_port()
+    env = dict(
+        os.environ,
+        SECRET_KEY=os.environ.get("SECRET_KEY", "benchmark-secret"),
+        DATABASE_URL=f"sqlite:///{database_dir}/bench.db",
+    )
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while not healthy(port):
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with {process.returncode}")
+            if time.perf_counter() - started > TIMEOUT:
+                raise RuntimeError("Server did not answer in time")
+            time.sleep(0.005)
+        return time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    fresh, existing = [], []
+    database_dir = tempfile.mkdtemp()
+    try:
+        for _ in range(runs):
+            shutil.rmtree(database_dir)
+            os.makedirs(database_dir)
+            fresh.append(time_to_first_request(database_dir))
+            existing.append(time_to_first_request(database_dir))
+    finally:
+        shutil.rmtree(database_dir, ignore_errors=True)
+
+    print(f"{'database':<12}{'median':>10}{'min':>10}{'max':>10}")
+    for label, samples in (("new", fresh), ("existing", existing)):
+        print(f"{label:<12}{statistics.median(samples):>9.3f}s{min(samples):>9.3f}s{max(samples):>9.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+CompressionMiddleware replaces Starlette's GZipMiddleware. It picks zstd,
+brotli or gzip (in that order of preference among the codings the client
+accepts with the highest q-value). zstd and brotli come from the
+``zstandard`` and ``brotli`` packages in requirements.txt; without them only
+gzip is offered. The level depends on the body size: small bodies get a high
+level because it costs microseconds, large ones a low level. Bodies of COMPRESSION_OFFLOAD_BYTES or more are compressed in a worker
+thread so the event loop keeps serving other requests.
+
+Responses are left alone when they are smaller than COMPRESSION_MIN_BYTES,
+already have a Content-Encoding, or have a media type that does not compress
+(images, archives, fonts) or must not be buffered (server-sent events).
+Streaming bodies of unknown length are compressed chunk by chunk with a
+fixed medium level, flushing after each chunk so nothing is held back.
+
+Ratios and CPU time per coding are kept in ``compression_stats``.
+"""
+import gzip
+import os
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # Optional: brotli is not offered without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # Optional: zstd is not offered without it
+    zstandard = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "500"))
+COMPRESSION_OFFLOAD_BYTES = int(os.getenv("COMPRESSION_OFFLOAD_BYTES", str(64 * 1024)))
+# Chunked bodies with a Content-Length up to this size are compressed as a whole
+COMPRESSION_BUFFER_BYTES = int(os.getenv("COMPRESSION_BUFFER_BYTES", str(8 * 1024 * 1024)))
+
+SKIP_MEDIA_PREFIXES = ("image/", "audio/", "video/", "font/")
+SKIP_MEDIA_TYPES = {
+    "application/zip", "application/gzip", "application/x-gzip", "application/zstd",
+    "application/octet-stream", "application/pdf", "text/event-stream",
+}
+
+# (largest body size, level) per coding; the last entry covers everything bigger
+LEVELS = {
+    "zstd": ((16 * 1024, 9), (256 * 1024, 6), (2 * 1024 * 1024, 3), (None, 1)),
+    "br": ((16 * 1024, 6), (256 * 1024, 5), (2 * 1024 * 1024, 4), (None, 2)),
+    "gzip": ((16 * 1024, 6), (256 * 1024, 6), (2 * 1024 * 1024, 5), (None, 3)),
+}
+STREAM_LEVELS = {"zstd": 3, "br": 4, "gzip": 5}
+
+
+def available_encodings():
+    """Codings this process can produce, most preferred first"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+
+def accepted_encodings(accept_encoding: str):
+    """Codings with a non-zero q-value; ``*`` stands for every coding we produce"""
+    qualities = parse_accept_encoding(accept_encoding)
+    encodings = {name for name, quality in qualities.items() if quality > 0}
+    if "*" in encodings:
+        encodings.update(encoding for encoding in available_encodings() if encoding not in qualities)
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    qualities = parse_accept_encoding(accept_encoding)
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def level_for(encoding: str, size: int) -> int:
+    for limit, level in LEVELS[encoding]:
+        if limit is None or size <= limit:
+            return level
+
+
+def compress(encoding: str, data: bytes, level: int) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class StreamCompressor:
+    """Incremental compressor for bodies of unknown length"""
+
+    def __init__(self, encoding: str):
+        level = STREAM_LEVELS[encoding]
+        if encoding == "zstd":
+            obj = zstandard.ZstdCompressor(level=level).compressobj()
+            self._compress = obj.compress
+            self._flush = lambda: obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+            self._finish = lambda: obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+        elif encoding == "br":
+            obj = brotli.Compressor(quality=level)
+            self._compress = obj.process
+            self._flush = obj.flush
+            self._finish = obj.finish
+        else:
+            obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._compress = obj.compress
+            self._flush = lambda: obj.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = obj.flush
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        out = self._compress(data) if data else b""
+        return out + (self._finish() if final else self._flush())
+
+
+class CompressionStats:
+    """Bytes in/out and CPU seconds per coding, for ratios and cost"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, encoding: str, bytes_in: int, bytes_out: int, cpu_seconds: float, offloaded: bool):
+        with self._lock:
+            totals = self._totals.setdefault(encoding, {
+                "responses": 0, "offloaded": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0,
+            })
+            totals["responses"] += 1
+            totals["offloaded"] += int(offloaded)
+            totals["bytes_in"] += bytes_in
+            totals["bytes_out"] += bytes_out
+            totals["cpu_seconds"] += cpu_seconds
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            result = {}
+            for encoding, totals in self._totals.items():
+                result[encoding] = dict(
+                    totals,
+                    cpu_seconds=round(totals["cpu_seconds"], 6),
+                    ratio=round(totals["bytes_in"] / totals["bytes_out"], 3) if totals["bytes_out"] else None,
+                )
+            return result
+
+
+compression_stats = CompressionStats()
+
+
+def _timed_compress(encoding: str, data: bytes, level: int):
+    # thread_time: CPU of this thread only, correct inside the worker pool too
+    started = time.thread_time()
+    out = compress(encoding, data, level)
+    return out, time.thread_time() - started
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES,
+                 offload_size: int = COMPRESSION_OFFLOAD_BYTES, buffer_size: int = COMPRESSION_BUFFER_BYTES,
+                 stats: CompressionStats = compression_stats):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.buffer_size = buffer_size
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressionResponder(self, encoding, send).run(scope, receive)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.mode = None  # "pass", "buffer" or "stream", decided by the first body message
+        self.buffer = []
+        self.streamer = None
+        self.stream_in = 0
+        self.stream_out = 0
+        self.stream_cpu = 0.0
+
+    async def run(self, scope, receive):
+        await self.middleware.app(scope, receive, self.send_wrapper)
+
+    @staticmethod
+    def _compressible(headers: Headers) -> bool:
+        if "content-encoding" in headers:
+            return False
+        media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return not (media_type.startswith(SKIP_MEDIA_PREFIXES) or media_type in SKIP_MEDIA_TYPES)
+
+    async def send_wrapper(self, message):
+        if message["type"] == "http.response.start":
+            # Hold the headers until the first body message shows what follows
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            # e.g. http.response.pathsend: nothing to compress
+            if self.start_message is not None:
+                await self.send(self.start_message)
+                self.start_message = None
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.mode is None:
+            headers = Headers(raw=self.start_message["headers"])
+            content_length = headers.get("content-length")
+            if not self._compressible(headers):
+                self.mode = "pass"
+                await self.send(self.start_message)
+            elif not more_body:
+                await self._send_whole(body)
+                return
+            elif content_length is not None and int(content_length) <= self.middleware.buffer_size:
+                # A known-size body sent in chunks (e.g. through BaseHTTPMiddleware):
+                # collect it so it gets the size-based level and the thread offload
+                self.mode = "buffer"
+            else:
+                self.mode = "stream"
+                self.streamer = StreamCompressor(self.encoding)
+                out_headers = self._encoded_headers()
+                del out_headers["Content-Length"]
+                await self.send(self.start_message)
+
+        if self.mode == "pass":
+            await self.send(message)
+        elif self.mode == "buffer":
+            self.buffer.append(body)
+            if not more_body:
+                await self._send_whole(b"".join(self.buffer))
+        else:
+            await self._send_chunk(body, more_body)
+
+    def _encoded_headers(self) -> MutableHeaders:
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        # CachedStaticFiles already sets it on files with precompressed variants
+        if "accept-encoding" not in headers.get("vary", "").lower():
+            headers.add_vary_header("Accept-Encoding")
+        return headers
+
+    async def _send_whole(self, body: bytes):
+        if len(body) < self.middleware.minimum_size:
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+        level = level_for(self.encoding, len(body))
+        offloaded = len(body) >= self.middleware.offload_size
+        if offloaded:
+            compressed, cpu = await anyio.to_thread.run_sync(_timed_compress, self.encoding, body, level)
+        else:
+            compressed, cpu = _timed_compress(self.encoding, body, level)
+        self.middleware.stats.record(self.encoding, len(body), len(compressed), cpu, offloaded)
+        self._encoded_headers()["Content-Length"] = str(len(compressed))
+        await self.send(self.start_message)
+        await self.send({"type": "http.response.body", "body": compressed})
+
+    async def _send_chunk(self, body: bytes, more_body: bool):
+        started = time.thread_time()
+        chunk = self.streamer.compress(body, final=not more_body)
+        self.stream_cpu += time.thread_time() - started
+        self.stream_in += len(body)
+        self.stream_out += len(chunk)
+        if not more_body:
+            self.middleware.stats.record(self.encoding, self.stream_in, self.stream_out, self.stream_cpu, False)
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
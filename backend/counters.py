@@ -0,0 +1,28 @@
+"""
+Monotonic counters kept in sync_versions, bumped inside the caller's transaction.
+
+The upsert locks the counter row until commit, so two transactions never get
+the same value and values become visible in the order they were handed out.
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import upsert_insert
+from models import SyncVersion
+
+
+def next_value(session: Session, name: str) -> int:
+    """Increment counter ``name`` (creating it at 1) and return the new value"""
+    table = SyncVersion.__table__
+    stmt = upsert_insert(table).values(name=name, value=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SyncVersion.name],
+        set_={"value": table.c.value + 1}
+    )
+    conn = session.connection()
+    if conn.dialect.insert_returning:
+        return conn.execute(stmt.returning(table.c.value)).scalar_one()
+    # SQLite before 3.35 has no RETURNING. The upsert holds the write lock
+    # until commit, so no other writer can bump the counter before this read
+    conn.execute(stmt)
+    return conn.execute(select(table.c.value).where(table.c.name == name)).scalar_one()
@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine, event, pool
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 
@@ -13,15 +14,23 @@ DATABASE_URL = os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL)
 
 if DATABASE_URL.startswith("sqlite"):
     # SQLite-specific optimizations for production
+    # In-memory databases exist per connection, so they must share one;
+    # file databases get a connection per thread so background workers
+    # never interleave their transactions with request handlers.
+    in_memory = ":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/") == "sqlite:"
     engine = create_engine(
         DATABASE_URL,
         connect_args={
             "check_same_thread": False,
             "timeout": 30,  # 30 second timeout for locked database
         },
-        poolclass=pool.StaticPool,  # Better for SQLite with multiple threads
         pool_pre_ping=True,  # Verify connections before using
-        echo=False  # Set to True for SQL debugging
+        echo=False,  # Set to True for SQL debugging
+        **({"poolclass": pool.StaticPool} if in_memory else {
+            "poolclass": pool.QueuePool,
+            "pool_size": 5,
+            "max_overflow": 35,  # Enough for every thread in the default 40-thread pool
+        })
     )
     
     # Enable WAL mode for better concurrent access
@@ -48,6 +57,12 @@ else:
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+def upsert_insert(table):
+    """Return a dialect-specific INSERT for ``table`` that supports ``on_conflict_do_update``."""
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
 # Dependency to get a DB session
 def get_db():
     db = SessionLocal()
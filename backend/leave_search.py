@@ -0,0 +1,111 @@
+"""
+Full-text search over leave request reasons.
+
+SQLite uses an FTS5 index stored outside the table (content='leave_requests'),
+kept in sync by triggers on leave_requests. PostgreSQL uses a GIN index on
+to_tsvector('english', reason), which the database maintains on its own.
+
+The SQLite index is keyed by leave_requests.rowid. VACUUM can renumber those
+rows, so call ``ensure_search_index(engine, rebuild=True)`` after a VACUUM.
+"""
+import re
+from typing import Optional
+
+from sqlalchemy import column, func, literal_column, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Query, Session
+
+from logging_config import logger
+from models import LeaveRequest
+
+FTS_TABLE = "leave_requests_fts"
+
+_SQLITE_TRIGGERS = {
+    "leave_requests_fts_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS leave_requests_fts_ai AFTER INSERT ON leave_requests BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, reason) VALUES (new.rowid, new.reason);
+        END""",
+    "leave_requests_fts_ad": f"""
+        CREATE TRIGGER IF NOT EXISTS leave_requests_fts_ad AFTER DELETE ON leave_requests BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, reason) VALUES ('delete', old.rowid, old.reason);
+        END""",
+    "leave_requests_fts_au": f"""
+        CREATE TRIGGER IF NOT EXISTS leave_requests_fts_au AFTER UPDATE OF reason ON leave_requests BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, reason) VALUES ('delete', old.rowid, old.reason);
+            INSERT INTO {FTS_TABLE}(rowid, reason) VALUES (new.rowid, new.reason);
+        END""",
+}
+
+# Set by ensure_search_index; False means we fall back to LIKE matching
+fts_available = False
+
+
+def ensure_search_index(engine: Engine, rebuild: bool = False) -> bool:
+    """Create the full-text index and its triggers if missing. Safe to call on every startup."""
+    global fts_available
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == "postgresql":
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS idx_leave_request_reason_fts "
+                    "ON leave_requests USING GIN (to_tsvector('english', reason))"
+                ))
+            elif engine.dialect.name == "sqlite":
+                existing = {row[0] for row in conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'leave_requests_fts_%'"
+                ))}
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    "reason, content='leave_requests', content_rowid='rowid', tokenize='porter unicode61')"
+                ))
+                for ddl in _SQLITE_TRIGGERS.values():
+                    conn.execute(text(ddl))
+                # Rows written while the triggers were missing are not indexed yet
+                if rebuild or existing != set(_SQLITE_TRIGGERS):
+                    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                    logger.info("Rebuilt leave request full-text index")
+            else:
+                return False
+        fts_available = True
+    except Exception as e:
+        fts_available = False
+        logger.warning(f"Full-text search unavailable, falling back to LIKE matching: {e}")
+    return fts_available
+
+
+def search_terms(q: str):
+    """Split user input into words; a trailing * marks a prefix search"""
+    return re.findall(r"\w+\*?", q)
+
+
+def search_query(db: Session, q: str) -> Optional[Query]:
+    """Return a query of (LeaveRequest, rank) rows matching every term in ``q``, best match first"""
+    terms = search_terms(q)
+    if not terms:
+        return None
+
+    if fts_available and db.bind.dialect.name == "sqlite":
+        # Quote each term so user input can never be parsed as FTS5 syntax
+        match = " ".join(
+            f'"{term.rstrip("*")}"' + ("*" if term.endswith("*") else "") for term in terms
+        )
+        fts = table(FTS_TABLE, column("rowid"))
+        # bm25() is lower-is-better; negate it so rank means the same as ts_rank
+        rank = (-func.bm25(literal_column(FTS_TABLE))).label("rank")
+        return db.query(LeaveRequest, rank).join(
+            fts, fts.c.rowid == literal_column("leave_requests.rowid")
+        ).filter(
+            text(f"{FTS_TABLE} MATCH :match").bindparams(match=match)
+        ).order_by(rank.desc())
+
+    if fts_available and db.bind.dialect.name == "postgresql":
+        vector = func.to_tsvector("english", LeaveRequest.reason)
+        tsquery = func.plainto_tsquery("english", " ".join(term.rstrip("*") for term in terms))
+        rank = func.ts_rank(vector, tsquery).label("rank")
+        return db.query(LeaveRequest, rank).filter(vector.op("@@")(tsquery)).order_by(rank.desc())
+
+    rank = literal_column("0.0").label("rank")
+    query = db.query(LeaveRequest, rank)
+    for term in terms:
+        query = query.filter(LeaveRequest.reason.ilike(f"%{term.rstrip('*')}%"))
+    return query.order_by(LeaveRequest.created_at.desc())
@@ -1,31 +1,194 @@
+"""
+Logging setup.
+
+Loggers never write to a stream or file themselves. The root logger (and
+uvicorn's own loggers) hold a QueueHandler that puts records on a bounded
+in-memory queue; a QueueListener thread formats them, writes them to stdout
+and the rotating files and checks for rotation. Tracebacks (``exc_info``) are
+formatted on that thread too. If the queue is full the record is dropped and
+counted rather than blocking the request, and the count is reported with
+the next record that fits.
+
+Around fork() (the workers of prefork.py) the listeners are flushed and
+stopped, so none is caught mid-write holding a stream's lock, then started
+again in the parent and, with new queues, in the child, since threads do not
+survive fork().
+
+LOG_FORMAT=json writes one JSON object per line instead of the text format.
+
+Log calls are rate limited per call site: after LOG_RATE_LIMIT records from
+the same line within LOG_RATE_WINDOW seconds, further ones are dropped until
+the window ends, and the next one that gets through says how many were
+suppressed. ERROR and above are never rate limited.
+"""
+import atexit
+import json
 import logging
-import sys
-from logging.handlers import RotatingFileHandler
 import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "50"))
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "10"))
+
+# Loggers uvicorn configures with their own stream handlers before the app is imported
+UVICORN_LOGGERS = ("uvicorn.error", "uvicorn.access")
+
+# LogRecord attributes that are not ``extra`` fields
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# (queue handler, the listener it feeds)
+_listeners = []
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any ``extra`` fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "func": record.funcName,
+            "line": record.lineno,
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop records from a call site beyond ``limit`` per ``window`` seconds"""
+
+    def __init__(self, limit: int = LOG_RATE_LIMIT, window: float = LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        # (pathname, lineno) -> [window start, records in window, suppressed]
+        self._sites = {}
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno >= logging.ERROR:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+            elif site[1] < self.limit:
+                site[1] += 1
+                return True
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full and leaves formatting to the listener"""
+
+    def __init__(self, log_queue, merge_args: bool = True):
+        super().__init__(log_queue)
+        self.merge_args = merge_args
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Tracebacks stay as exc_info and are formatted by the listener thread
+        record = logging.makeLogRecord(record.__dict__)
+        if self.merge_args:
+            # So later changes to the arguments do not alter the message
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.dropped and self.merge_args:
+            dropped, self.dropped = self.dropped, 0
+            record.msg = f"{record.msg} ({dropped} log records dropped: queue full)"
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _queue_to(handlers, rate_limit=True, merge_args=True) -> NonBlockingQueueHandler:
+    """A queue handler feeding ``handlers`` from a new listener thread"""
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    queue_handler = NonBlockingQueueHandler(log_queue, merge_args)
+    if rate_limit:
+        queue_handler.addFilter(RateLimitFilter())
+    _listeners.append((queue_handler, listener))
+    return queue_handler
+
+
+def stop_logging():
+    """Flush every queued record and stop the listener threads"""
+    while _listeners:
+        _listeners.pop()[1].stop()
+
+
+def _stop_listeners_before_fork():
+    for _, listener in _listeners:
+        listener.stop()
+
+
+def _start_listeners_in_parent():
+    for _, listener in _listeners:
+        listener.start()
+
+
+def _start_listeners_in_child():
+    for queue_handler, listener in _listeners:
+        queue_handler.queue = listener.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler.dropped = 0
+        listener.start()
+
 
 def setup_logging():
     """Configure logging for the application"""
-    
+    stop_logging()
+
     # Create logs directory if it doesn't exist
     log_dir = os.path.join(os.path.dirname(__file__), 'logs')
     os.makedirs(log_dir, exist_ok=True)
-    
+
     # Configure root logger
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    
+
     # Remove existing handlers
     logger.handlers.clear()
-    
+
+    if LOG_FORMAT == "json":
+        console_formatter = file_formatter = JsonFormatter()
+    else:
+        console_formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+        file_formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s'
+        )
+
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
-    console_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
     console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
-    
+
     # File handler with rotation
     file_handler = RotatingFileHandler(
         os.path.join(log_dir, 'app.log'),
@@ -33,12 +196,8 @@ def setup_logging():
         backupCount=5
     )
     file_handler.setLevel(logging.INFO)
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s'
-    )
     file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
-    
+
     # Error file handler
     error_handler = RotatingFileHandler(
         os.path.join(log_dir, 'error.log'),
@@ -47,9 +206,26 @@ def setup_logging():
     )
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(file_formatter)
-    logger.addHandler(error_handler)
-    
+
+    # All writing happens on the listener thread
+    logger.addHandler(_queue_to([console_handler, file_handler, error_handler]))
+
+    # uvicorn's access log runs on every request: move its handlers behind a queue as well.
+    # Its formatters read record.args, so those are passed through unmerged.
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        if uvicorn_logger.handlers:
+            handlers = list(uvicorn_logger.handlers)
+            uvicorn_logger.handlers.clear()
+            uvicorn_logger.addHandler(_queue_to(handlers, rate_limit=False, merge_args=False))
+
     return logger
 
 # Create logger instance
 logger = setup_logging()
+atexit.register(stop_logging)
+os.register_at_fork(
+    before=_stop_listeners_before_fork,
+    after_in_parent=_start_listeners_in_parent,
+    after_in_child=_start_listeners_in_child,
+)
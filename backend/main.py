@@ -1,12 +1,13 @@
+# First, so the startup profile covers every other import
+from startup_profile import startup
 from dotenv import load_dotenv
 
 # Load environment variables FIRST, before any other imports
 load_dotenv()
 
-from fastapi import FastAPI, Depends, Request, UploadFile, File, HTTPException, status
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Depends, Request, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -16,15 +17,27 @@ from routes.users import router as users_router
 from routes.attendance_routes.marking import router as attendance_marking_router
 from routes.attendance_routes.retrieval import router as attendance_retrieval_router
 from routes.attendance_routes.holidays import router as attendance_holidays_router
-from routes.request_routes.main import router as request_routes_router
-from database import engine, Base, get_db
+from routes.request_routes.main import router as request_routes_router, stream_router as request_stream_router
+from routes.admin import router as admin_router
+from database import engine, Base, get_db, SessionLocal
+from archiver import archive_worker
+from request_events import event_hub
+from leave_search import ensure_search_index
+from schema_version import ensure_schema
+from user_search import user_index
+from profile_pictures import PICTURES_DIR, PICTURES_URL, start_orphan_sweep
+from static_files import CachedStaticFiles
+from compression import CompressionMiddleware
+from middleware import ErrorLoggingMiddleware, TimingMiddleware
+import metrics
+import profiling
+from slow_queries import slow_query_log
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from auth import get_current_user
-from models import User
+import hmac
 import os
-import shutil
 from logging_config import logger
-import time
 from contextlib import asynccontextmanager
 
 # Initialize rate limiter
@@ -36,50 +49,65 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("🚀 Starting College Attendance Marker API...")
 
-    # Ensure tables exist
-    Base.metadata.create_all(bind=engine)
-    logger.info("✅ Database tables verified")
+    # Ensure tables exist; skipped when the models match the stored schema fingerprint
+    with startup.phase("schema"):
+        if ensure_schema(engine, Base.metadata):
+            logger.info("✅ Database tables verified")
+        else:
+            logger.info("✅ Database schema unchanged")
+
+    # Full-text index over leave request reasons (FTS5 / tsvector)
+    with startup.phase("search_index"):
+        ensure_search_index(engine)
+
+    # In-memory prefix index behind /users/search
+    with startup.phase("user_index"):
+        db = SessionLocal()
+        try:
+            user_index.rebuild(db)
+        finally:
+            db.close()
+
+    # Background writer for leave request archive segments
+    with startup.phase("archive_worker"):
+        archive_worker.start()
+
+    # Tails request_events for /requests/stream subscribers of this worker
+    with startup.phase("request_events"):
+        event_hub.start()
+
+    # Remove profile pictures no user references any more
+    with startup.phase("orphan_sweep"):
+        start_orphan_sweep()
+
+    startup.lifespan_done()
     
     yield
     
     # Shutdown
     logger.info("👋 Shutting down College Attendance Marker API...")
+    event_hub.stop()
+    archive_worker.stop()
+    metrics.mark_process_dead()
 
 app = FastAPI(
     title="College Attendance Marker API", 
     version="1.0.0",
     docs_url="/docs" if os.getenv("ENVIRONMENT") != "production" else None,
     redoc_url="/redoc" if os.getenv("ENVIRONMENT") != "production" else None,
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson serializes the dicts FastAPI produces several times faster than json
+    default_response_class=ORJSONResponse
 )
 
 # Add rate limiting
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# Add request timing middleware
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    
-    # Log slow requests
-    if process_time > 1.0:  # Log requests taking more than 1 second
-        logger.warning(f"Slow request: {request.method} {request.url.path} took {process_time:.2f}s")
-    
-    return response
-
-# Add error logging middleware
-@app.middleware("http")
-async def log_errors(request: Request, call_next):
-    try:
-        response = await call_next(request)
-        return response
-    except Exception as e:
-        logger.error(f"Unhandled error in {request.method} {request.url.path}: {str(e)}", exc_info=True)
-        raise
+# Request timing (X-Process-Time, slow request warnings) and unhandled error logging,
+# as pure ASGI middleware rather than @app.middleware("http")
+app.add_middleware(TimingMiddleware)
+app.add_middleware(ErrorLoggingMiddleware)
 
 # Add CORS middleware for Flutter app
 # Security: Configure allowed origins based on environment
@@ -100,10 +128,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
     max_age=3600,  # Cache preflight requests for 1 hour
+    # Readable by the web app: /requests/history pages
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Add GZip compression for faster response times (only compress responses > 500 bytes)
-app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=6)
+# Negotiate zstd/brotli/gzip; level by size, large bodies compressed off the event loop
+app.add_middleware(CompressionMiddleware)
+
+# Request counts, latency and in-flight gauges for /metrics. Added after compression so it wraps
+# it and compression time is included; ProfilingMiddleware and TrustedHostMiddleware (added
+# later) wrap it in turn, so requests TrustedHost rejects are not counted
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine)
+
+# Admin-triggered (X-Profile: 1 / ?__profile=1) and PROFILE_SAMPLE_ROUTES request profiling
+app.add_middleware(profiling.ProfilingMiddleware)
+profiling.instrument_engine(engine)
+
+# Statements over SLOW_QUERY_MS, with their plans, for /admin/slow-queries
+slow_query_log.instrument(engine)
 
 # Add Trusted Host middleware for production
 if os.getenv("ENVIRONMENT") == "production":
@@ -115,68 +158,24 @@ app.include_router(auth.router, prefix="/auth", tags=["authentication"])
 
 # Protected routers: require authenticated user by default
 app.include_router(users_router, dependencies=[Depends(get_current_user)])
+# /requests/stream authenticates itself without holding a DB session open
+app.include_router(request_stream_router)
 app.include_router(request_routes_router, dependencies=[Depends(get_current_user)])
 app.include_router(attendance_marking_router, dependencies=[Depends(get_current_user)])
 app.include_router(attendance_retrieval_router, dependencies=[Depends(get_current_user)])
 app.include_router(attendance_holidays_router, dependencies=[Depends(get_current_user)])
+app.include_router(admin_router)
 
 # Serve static files (e.g., uploaded profile pictures)
 static_dir = os.path.join(os.path.dirname(__file__), 'static')
-uploads_dir = os.path.join(static_dir, 'uploads')
-os.makedirs(uploads_dir, exist_ok=True)
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
-
-@app.post("/users/me/upload-profile-picture", status_code=200, tags=["users"])
-async def upload_profile_picture(
-    file: UploadFile = File(...),
-    db = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
-    # Validate file size (max 5MB)
-    MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
-    file_content = await file.read()
-    if len(file_content) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail="File size exceeds 5MB limit"
-        )
-    
-    # Validate file type
-    ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
-    file_extension = os.path.splitext(file.filename)[1].lower()
-    if file_extension not in ALLOWED_EXTENSIONS:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
-        )
-    
-    # Sanitize filename and create a unique path
-    # Using user ID ensures that each user has a unique, predictable image name
-    filename = f"user_{current_user.id}{file_extension}"
-    file_path = os.path.join(uploads_dir, filename)
-
-    # Save the file
-    try:
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
-        logger.info(f"Profile picture uploaded for user {current_user.id}: {filename}")
-    except Exception as e:
-        logger.error(f"Failed to save profile picture for user {current_user.id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Could not save file")
-
-    # Update the user's profile picture URL in the database
-    # The URL should be the relative path that the client can request
-    file_url = f"/static/uploads/{filename}"
-    
-    user_to_update = db.query(User).filter(User.id == current_user.id).first()
-    if not user_to_update:
-        raise HTTPException(status_code=404, detail="User not found")
-        
-    user_to_update.profile_picture_url = file_url
-    db.commit()
-
-    return {"profile_picture_url": file_url}
-
+os.makedirs(PICTURES_DIR, exist_ok=True)
+# Content-hashed profile pictures; mounted before /static so it takes precedence
+app.mount(
+    PICTURES_URL,
+    CachedStaticFiles(directory=PICTURES_DIR, cache_control="public, max-age=31536000, immutable"),
+    name="profile_pictures"
+)
+app.mount("/static", CachedStaticFiles(directory=static_dir), name="static")
 
 @app.get("/")
 def read_root():
@@ -187,7 +186,7 @@ def health_check(db: Session = Depends(get_db)):
     """Health check endpoint for monitoring"""
     try:
         # Check database connection
-        db.execute("SELECT 1")
+        db.execute(text("SELECT 1"))
         return {
             "status": "healthy",
             "database": "connected",
@@ -199,3 +198,26 @@ def health_check(db: Session = Depends(get_db)):
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Service unavailable"
         )
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Metrics expose route names, traffic and error rates: production serves them only with a token
+METRICS_ENABLED = bool(METRICS_TOKEN) or os.getenv("ENVIRONMENT") != "production"
+if not METRICS_ENABLED:
+    logger.warning("⚠️ WARNING: /metrics is disabled. Set METRICS_TOKEN to scrape it in production.")
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(request: Request):
+    """Prometheus scrape endpoint; needs ``Authorization: Bearer $METRICS_TOKEN`` when that is set.
+
+    Without a token it is open in development and 404 in production.
+    """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+startup.imported()
@@ -0,0 +1,158 @@
+"""
+Prometheus metrics, served at /metrics in the text exposition format.
+
+Covers HTTP requests per route and status (count and latency histogram),
+requests in flight, the worker threadpool that runs sync endpoints, the
+SQLAlchemy connection pool, cache hits and misses, coalesced computations
+and bcrypt time.
+
+With several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by all of them (before the app is imported; it is read when
+prometheus_client loads). Every worker then writes its values to files there
+and /metrics sums them, whichever worker answers the scrape. Clear the
+directory whenever the server starts.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+import anyio.to_thread
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route template and status",
+    ["method", "route", "status"],
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time until the last response byte was sent",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being handled", multiprocess_mode="livesum",
+)
+THREADPOOL_BUSY = Gauge(
+    "threadpool_busy_threads", "Worker threads running sync endpoints and dependencies",
+    multiprocess_mode="livesum",
+)
+THREADPOOL_SIZE = Gauge(
+    "threadpool_size_threads", "Worker thread limit", multiprocess_mode="livesum",
+)
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Connections checked out of the SQLAlchemy pool")
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "Connections currently checked out", multiprocess_mode="livesum",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections", "Connections open beyond pool_size (negative while the pool is filling)",
+    multiprocess_mode="livesum",
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit or miss)", ["cache", "result"],
+)
+SINGLE_FLIGHT_CALLS = Counter(
+    "single_flight_calls_total",
+    "Coalesced computations by flight and outcome (executed, or shared: a duplicate execution saved)",
+    ["flight", "outcome"],
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds", "bcrypt time by operation (hash or verify)", ["operation"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0),
+)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_flight(flight: str, shared: bool) -> None:
+    SINGLE_FLIGHT_CALLS.labels(flight, "shared" if shared else "executed").inc()
+
+
+@contextmanager
+def time_password_hash(operation: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PASSWORD_HASH_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine) -> None:
+    """Track checkouts and overflow of ``engine``'s connection pool"""
+    overflow = getattr(engine.pool, "overflow", None)
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_conn, connection_record, connection_proxy):
+        DB_POOL_CHECKOUTS.inc()
+        DB_POOL_CHECKED_OUT.inc()
+        if overflow is not None:
+            DB_POOL_OVERFLOW.set(overflow())
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_conn, connection_record):
+        DB_POOL_CHECKED_OUT.dec()
+        if overflow is not None:
+            DB_POOL_OVERFLOW.set(overflow())
+
+
+def route_label(scope) -> str:
+    """Route template for the label, so path parameters do not explode cardinality"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:
+        # A mount such as /static
+        return f"{scope.get('root_path', '')}/{{path}}"
+    return "<unmatched>"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+        HTTP_IN_PROGRESS.inc()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            route = route_label(scope)
+            HTTP_REQUESTS.labels(scope["method"], route, str(status_code)).inc()
+            HTTP_LATENCY.labels(scope["method"], route).observe(time.perf_counter() - started)
+            limiter = anyio.to_thread.current_default_thread_limiter()
+            THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+            THREADPOOL_SIZE.set(limiter.total_tokens)
+
+
+def render():
+    """The exposition text and its content type, summed over workers in multiprocess mode"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """Drop this worker's live gauges from the shared directory on shutdown"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,71 @@
+"""
+Cross-cutting request handling as pure ASGI middleware.
+
+These replace the former ``@app.middleware("http")`` functions. Those ran on
+Starlette's BaseHTTPMiddleware, which starts an extra task and a memory
+stream per request, re-chunks every response body and rejects any message
+other than ``http.response.body`` (so pathsend could not pass). Wrapping
+``send`` directly avoids all of that.
+"""
+import os
+import time
+
+from logging_config import logger
+from startup_profile import startup
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+
+RESPONSE_END = ("http.response.body", "http.response.pathsend")
+
+
+class TimingMiddleware:
+    """Adds X-Process-Time (seconds until the headers were ready) and logs slow requests.
+
+    Slow requests are judged by the time until the last body message was
+    sent, so slow streaming responses are caught too.
+    """
+
+    def __init__(self, app, slow_seconds: float = SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.slow_seconds = slow_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                elapsed = time.perf_counter() - started
+                # Append instead of MutableHeaders: no scan of the existing headers
+                message["headers"] = [*message.get("headers", ()), (b"x-process-time", b"%.6f" % elapsed)]
+            elif message_type in RESPONSE_END and not message.get("more_body", False):
+                elapsed = time.perf_counter() - started
+                if elapsed > self.slow_seconds:
+                    logger.warning(f"Slow request: {scope['method']} {scope['path']} took {elapsed:.2f}s")
+                await send(message)
+                startup.response_sent()
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class ErrorLoggingMiddleware:
+    """Logs unhandled exceptions with the request line, then re-raises them"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        except Exception as e:
+            logger.error(f"Unhandled error in {scope['method']} {scope['path']}: {e}", exc_info=True)
+            raise
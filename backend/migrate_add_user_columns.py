@@ -17,6 +17,7 @@ def migrate_database():
             ('employee_id', 'VARCHAR(20)'),
             ('phone', 'VARCHAR(15)'),
             ('email', 'VARCHAR(100)'),
+            ('version', 'INTEGER NOT NULL DEFAULT 0'),
         ]
 
         # Get existing columns
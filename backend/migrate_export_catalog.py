@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Move flat leave request exports into sharded directories and backfill
+the export_catalog table from their contents.
+
+static/leave_requests/<id>.json -> static/leave_requests/<id[:2]>/<id>.json
+
+The catalog rows are committed before any file moves. If the script stops
+part way through moving, the files left in place are still flat, so running
+it again catalogues them again (rows are merged) and finishes the moves.
+"""
+import json
+import os
+import sys
+from datetime import date, datetime
+
+from database import engine, Base, SessionLocal
+from models import ExportCatalog
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'leave_requests')
+
+
+def migrate_exports():
+    Base.metadata.create_all(bind=engine, tables=[ExportCatalog.__table__])
+    db = SessionLocal()
+    moves = []
+    try:
+        for fname in sorted(os.listdir(ARCHIVE_DIR)):
+            src = os.path.join(ARCHIVE_DIR, fname)
+            if not fname.endswith('.json') or not os.path.isfile(src):
+                continue
+            request_id = fname[:-5]
+            shard = request_id[:2]
+
+            with open(src, encoding='utf-8') as f:
+                data = json.load(f)
+
+            exported_at = data.get("exported_at")
+            db.merge(ExportCatalog(
+                request_id=request_id,
+                student_id=data["student_id"],
+                status=data["status"],
+                start_date=date.fromisoformat(data["start_date"]),
+                end_date=date.fromisoformat(data["end_date"]),
+                url=f"/static/leave_requests/{shard}/{fname}",
+                exported_at=datetime.fromisoformat(exported_at.rstrip('Z')) if exported_at else datetime.utcnow(),
+            ))
+
+            moves.append((src, shard, fname))
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Migration failed: {e}")
+        return False
+    finally:
+        db.close()
+
+    moved = 0
+    try:
+        for src, shard, fname in moves:
+            os.makedirs(os.path.join(ARCHIVE_DIR, shard), exist_ok=True)
+            os.replace(src, os.path.join(ARCHIVE_DIR, shard, fname))
+            moved += 1
+    except OSError as e:
+        print(f"❌ Moved {moved} of {len(moves)} exports, then failed: {e}")
+        print("   The catalog is committed; run the migration again to move the rest")
+        return False
+    print(f"✅ Moved and catalogued {moved} exports")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if migrate_exports() else 1)
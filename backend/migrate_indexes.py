@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Create any index declared in models.py that is missing from the database.
+create_all() only adds indexes for tables it creates, so run this after
+pulling model changes that add indexes to existing tables.
+"""
+import sys
+
+from sqlalchemy import inspect
+
+from database import engine, Base
+import models  # noqa: F401 - registers every table on Base.metadata
+
+
+def migrate_indexes():
+    try:
+        inspector = inspect(engine)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                # create_all() builds missing tables together with their indexes
+                continue
+            for index in sorted(table.indexes, key=lambda ix: ix.name):
+                index.create(bind=engine, checkfirst=True)
+                print(f"✓ {table.name}.{index.name}")
+        print("\n✅ Indexes are up to date")
+        return True
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    sys.exit(0 if migrate_indexes() else 1)
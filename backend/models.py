@@ -3,6 +3,7 @@ from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 import uuid
+from datetime import datetime
 
 # Association table for many-to-many relationship between requests and advisors
 request_advisors = Table(
@@ -46,6 +47,9 @@ class User(Base):
     phone = Column(String(15), nullable=True)
     email = Column(String(100), nullable=True)
 
+    # Directory version of the last change to name/username, see user_sync.py
+    version = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+
     # Relationships
     submitted_requests = relationship("LeaveRequest", foreign_keys="LeaveRequest.student_id", back_populates="student")
 
@@ -55,6 +59,8 @@ class LeaveRequest(Base):
         Index('idx_leave_request_student', 'student_id'),
         Index('idx_leave_request_status', 'status'),
         Index('idx_leave_request_dates', 'start_date', 'end_date'),
+        Index('idx_leave_request_student_dates', 'student_id', 'start_date', 'end_date'),
+        Index('idx_leave_request_status_created', 'status', 'created_at', 'id'),
     )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()), index=True)
@@ -73,6 +79,31 @@ class LeaveRequest(Base):
     approving_advisor = relationship("User", foreign_keys=[approved_by])
     assigned_advisors = relationship("User", secondary=request_advisors, backref="assigned_requests")
 
+class ArchivedLeaveRequest(Base):
+    """Closed leave requests moved out of leave_requests by retention.py"""
+    __tablename__ = "leave_requests_archive"
+    __table_args__ = (
+        Index('idx_leave_archive_student_dates', 'student_id', 'start_date', 'end_date'),
+        Index('idx_leave_archive_archived', 'archived_at'),
+    )
+
+    # Same id as the original leave_requests row, so old links keep resolving
+    id = Column(String, primary_key=True)
+    student_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    reason = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False)
+    approved_by = Column(String, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    advisor_ids = Column(Text, nullable=True)  # Comma-separated ids of the assigned advisors
+    image_path = Column(String(512), nullable=True)  # Image file in cold storage, relative to RETENTION_IMAGE_DIR
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def advisor_id_list(self):
+        return self.advisor_ids.split(",") if self.advisor_ids else []
+
 class AttendanceRecord(Base):
     __tablename__ = "attendance_records"
     __table_args__ = (
@@ -89,3 +120,68 @@ class AttendanceRecord(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     student = relationship("User", foreign_keys=[student_id])
     marker = relationship("User", foreign_keys=[marked_by])
+
+class ExportCatalog(Base):
+    """Index of per-request export files written under static/leave_requests"""
+    __tablename__ = "export_catalog"
+    __table_args__ = (
+        Index('idx_export_catalog_student', 'student_id', 'exported_at'),
+        Index('idx_export_catalog_status', 'status', 'exported_at'),
+        Index('idx_export_catalog_dates', 'start_date', 'end_date'),
+    )
+
+    # Not a foreign key: exports outlive the hot leave_requests row
+    request_id = Column(String, primary_key=True)
+    student_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String(16), nullable=False)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    url = Column(String(512), nullable=False)
+    exported_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class ArchiveOutbox(Base):
+    """Leave request snapshots waiting to be appended to the archive segments"""
+    __tablename__ = "archive_outbox"
+    __table_args__ = (
+        Index('idx_archive_outbox_due', 'next_attempt_at'),
+        Index('idx_archive_outbox_lease', 'lease'),
+        # Never reuse ids: segment readers deduplicate on outbox_id
+        {'sqlite_autoincrement': True},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    request_id = Column(String, nullable=False)
+    event = Column(String(16), nullable=False)  # created, approved, rejected
+    payload = Column(Text, nullable=False)  # Compact JSON snapshot, image kept by reference
+    attempts = Column(Integer, nullable=False, default=0)
+    lease = Column(String(36), nullable=True)  # Set while a worker is writing this row
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RequestEventRecord(Base):
+    """Leave request events for /requests/stream, tailed by every worker"""
+    __tablename__ = "request_events"
+
+    # Taken from the "request_events" sync_versions counter inside the writing
+    # transaction, so ids commit in order and double as SSE event ids
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    type = Column(String(16), nullable=False)  # created, approved, rejected
+    payload = Column(Text, nullable=False)  # JSON, sent as the SSE data line
+    targets = Column(Text, nullable=False)  # JSON list of assigned advisor ids
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class UserTombstone(Base):
+    """Deleted users, kept so /users/lookup?since= can report deletions"""
+    __tablename__ = "user_tombstones"
+
+    user_id = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class SyncVersion(Base):
+    """Monotonic change counters, one row per synced collection"""
+    __tablename__ = "sync_versions"
+
+    name = Column(String(32), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,557 @@
+"""
+Pre-fork production server, started by ``python run_server.py --workers N``
+(or ``auto``, the default with ENVIRONMENT=production).
+
+- The master imports the app once (``main`` with its routes, serializers and
+  the bcrypt dummy hash) and binds the socket, then forks the workers, which
+  inherit both. Each worker runs uvicorn on the shared socket with its own
+  lifespan (schema check, background threads).
+- ``auto`` is one worker per usable CPU, honouring CPU affinity and a
+  cgroup CPU quota. Workers are async and run sync routes on their own
+  threadpool, and SQLite has one writer at a time, so more processes than
+  cores only adds contention.
+- Startup health gating: a worker counts as up once its lifespan has run and
+  GET /health answers 200 through the whole middleware stack. The first
+  worker starts alone (its lifespan may create the schema), the others once
+  it is up. The master exits if they are not all up within STARTUP_TIMEOUT. A
+  replacement that does not come up is killed and the worker it was meant to
+  replace is kept.
+- Recycling: after MAX_REQUESTS requests (plus a random share of up to
+  MAX_REQUESTS_JITTER, so workers do not all recycle together) a worker asks
+  to be replaced. It keeps serving until its replacement is up, then drains.
+- SIGHUP: zero-downtime rolling restart with the code on disk. The master
+  checks that ``main`` imports in a subprocess, re-executes itself in place
+  (same PID, same socket), preloads the new code and replaces the old
+  workers one at a time: start a new one, wait until it is up, drain an old
+  one.
+- SIGTERM / SIGINT: graceful stop. Workers finish their requests and are
+  killed after GRACEFUL_TIMEOUT.
+- A worker that dies is replaced; after CRASH_LIMIT workers in a row die
+  before coming up, the master gives up.
+
+State that lives in a worker is not shared: the in-memory /admin reports
+(compression, single-flight, slow queries, startup) and the memory response
+cache each describe only the worker that answers. Leave request events go
+through the request_events table, which every worker tails, so
+/requests/stream sees changes made through any worker, including across a
+rolling restart.
+
+PROMETHEUS_MULTIPROC_DIR must be set before prometheus_client is imported,
+so it is prepared before the app is loaded: a temporary directory when it is
+unset (removed on exit), emptied otherwise. A re-executed master keeps it
+as is, since the old workers are still writing to it.
+"""
+import asyncio
+import math
+import os
+import random
+import selectors
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+WEB_CONCURRENCY = os.getenv("WEB_CONCURRENCY", "auto")
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "0"))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+STARTUP_TIMEOUT = float(os.getenv("STARTUP_TIMEOUT", "60"))
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+HEALTH_PATH = "/health"
+HEALTH_TIMEOUT = 10
+# Seconds a stopping worker waits, no longer accepting, before closing idle connections
+ACCEPTED_GRACE = 0.5
+CRASH_LIMIT = 5
+
+# Handed from a master to the process it re-executes into
+LISTEN_FD_ENV = "PREFORK_LISTEN_FD"
+OLD_WORKERS_ENV = "PREFORK_OLD_WORKERS"
+OWNED_METRICS_DIR_ENV = "PREFORK_OWNED_METRICS_DIR"
+
+# Worker -> master messages
+READY = b"R"
+RECYCLE = b"M"
+
+
+def _cgroup_cpu_limit() -> Optional[int]:
+    """CPUs allowed by a cgroup v2 (cpu.max) or v1 (cfs quota) limit, if any"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return math.ceil(int(quota) / int(period))
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return math.ceil(quota / period)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def usable_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit:
+        cpus = min(cpus, limit)
+    return max(cpus, 1)
+
+
+def worker_count(value: str = WEB_CONCURRENCY) -> int:
+    """``auto`` or a number; at least 1"""
+    if str(value).lower() == "auto":
+        return usable_cpus()
+    return max(int(value), 1)
+
+
+def prepare_metrics_dir() -> None:
+    """Set up PROMETHEUS_MULTIPROC_DIR before anything imports prometheus_client"""
+    if os.getenv(LISTEN_FD_ENV):
+        # Re-executed master: the old workers still write there
+        return
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        path = tempfile.mkdtemp(prefix="attendance-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+        os.environ[OWNED_METRICS_DIR_ENV] = path
+        return
+    os.makedirs(path, exist_ok=True)
+    for entry in os.scandir(path):
+        if entry.is_file() and entry.name.endswith(".db"):
+            os.unlink(entry.path)
+
+
+async def health_check(app) -> bool:
+    """GET /health through the full app, as a client would see it"""
+    # TrustedHostMiddleware (production) only lets configured hosts through
+    host = os.getenv("TRUSTED_HOSTS", "localhost").split(",")[0].strip().replace("*", "health")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": HEALTH_PATH, "raw_path": HEALTH_PATH.encode(), "root_path": "",
+        "query_string": b"", "headers": [(b"host", host.encode())],
+        "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 0),
+    }
+    status = None
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    from logging_config import logger
+    try:
+        await asyncio.wait_for(app(scope, receive, send), HEALTH_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Worker {os.getpid()} health check failed: {e}", exc_info=True)
+        return False
+    if status != 200:
+        logger.error(f"Worker {os.getpid()} health check answered {status}")
+    return status == 200
+
+
+class WorkerServer(uvicorn.Server):
+    """uvicorn in a worker: reports to the master when it is up and when it wants to be recycled"""
+
+    def __init__(self, config: uvicorn.Config, notify_fd: int, max_requests: int):
+        super().__init__(config)
+        self.notify_fd = notify_fd
+        self.max_requests = max_requests
+        self.healthy = False
+        self.recycle_requested = False
+
+    def notify(self, message: bytes) -> bool:
+        try:
+            os.write(self.notify_fd, message)
+            return True
+        except OSError:
+            # The master re-executed itself and no longer reads this pipe
+            return False
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if self.should_exit:
+            return
+        self.healthy = await health_check(self.config.loaded_app)
+        if self.healthy:
+            self.notify(READY)
+        else:
+            self.should_exit = True
+
+    async def shutdown(self, sockets=None):
+        # uvicorn closes connections that have not sent a request yet. With a shared socket
+        # those may be ones accepted a moment ago, whose request is still on its way.
+        for server in self.servers:
+            server.close()
+        await asyncio.sleep(ACCEPTED_GRACE)
+        await super().shutdown(sockets=sockets)
+
+    async def on_tick(self, counter: int) -> bool:
+        if (self.max_requests and not self.recycle_requested
+                and self.server_state.total_requests >= self.max_requests):
+            self.recycle_requested = True
+            if not self.notify(RECYCLE):
+                # Nobody to start a replacement: stop, like a plain request limit
+                self.should_exit = True
+        return await super().on_tick(counter)
+
+
+class Worker:
+    def __init__(self, pid: int, fd: Optional[int]):
+        self.pid = pid
+        # Read end of the worker's pipe; None for workers inherited from before a re-exec
+        self.fd = fd
+        self.started_at = time.monotonic()
+        self.ready = fd is None
+        self.retiring = False
+        self.kill_at = None
+
+
+class Master:
+    def __init__(self, config: uvicorn.Config, workers: int, max_requests: int = MAX_REQUESTS,
+                 max_requests_jitter: int = MAX_REQUESTS_JITTER):
+        self.config = config
+        self.target = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.workers: Dict[int, Worker] = {}
+        self.crashes = 0
+        self.stopping = False
+        # Workers that asked to be recycled, replaced from the main loop
+        self._recycle: List[Worker] = []
+        self.sock = None
+        self._signals: List[int] = []
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r = self._wakeup_w = None
+        # Imported once the app has configured logging (see serve)
+        from logging_config import logger
+        self.logger = logger
+
+    # --- Workers ------------------------------------------------------------
+
+    def spawn(self) -> Worker:
+        read_fd, write_fd = os.pipe()
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self._run_worker(write_fd, max_requests)
+        os.close(write_fd)
+        worker = self.workers[pid] = Worker(pid, read_fd)
+        self._selector.register(read_fd, selectors.EVENT_READ, worker)
+        self.logger.info(f"Started worker {pid}")
+        return worker
+
+    def _run_worker(self, notify_fd: int, max_requests: int) -> None:
+        code = 1
+        try:
+            signal.set_wakeup_fd(-1)
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            # SIGHUP is for the master; a terminal hangup reaches the whole group
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            self._selector.close()
+            for fd in (self._wakeup_r, self._wakeup_w, *(w.fd for w in self.workers.values() if w.fd is not None)):
+                os.close(fd)
+            # Pooled connections belong to the master; open new ones here
+            from database import engine
+            engine.dispose(close=False)
+
+            server = WorkerServer(self.config, notify_fd, max_requests)
+            server.run(sockets=[self.sock])
+            code = 0 if server.healthy else 1
+        except BaseException:
+            self.logger.error(f"Worker {os.getpid()} failed", exc_info=True)
+        finally:
+            from logging_config import stop_logging
+            stop_logging()
+            os._exit(code)
+
+    def wait_ready(self, worker: Worker, deadline: float) -> bool:
+        """Block until ``worker`` reports it is up; False if it dies or ``deadline`` passes"""
+        while not worker.ready:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or worker.fd is None:
+                return False
+            for key, _ in self._selector.select(remaining):
+                if key.data is None:
+                    self._drain_wakeup()
+                elif key.data.fd is not None:
+                    self._read(key.data)
+            if worker.pid not in self.workers or worker.fd is None:
+                return False
+        return True
+
+    def _read(self, worker: Worker) -> None:
+        try:
+            data = os.read(worker.fd, 64)
+        except OSError:
+            data = b""
+        if not data:
+            # Worker exiting; it is reaped on SIGCHLD
+            self._close(worker)
+            return
+        if READY in data:
+            worker.ready = True
+            self.crashes = 0
+            self.logger.info(f"Worker {worker.pid} is up")
+        if RECYCLE in data:
+            self._recycle.append(worker)
+
+    def _close(self, worker: Worker) -> None:
+        if worker.fd is not None:
+            self._selector.unregister(worker.fd)
+            os.close(worker.fd)
+            worker.fd = None
+
+    def retire(self, worker: Worker) -> None:
+        """Let ``worker`` finish its requests and exit"""
+        worker.retiring = True
+        worker.kill_at = time.monotonic() + GRACEFUL_TIMEOUT
+        self._kill(worker.pid, signal.SIGTERM)
+
+    def replace(self, old: Worker) -> bool:
+        """Start a worker to take over from ``old``; retire ``old`` once the new one is up"""
+        new = self.spawn()
+        if self.wait_ready(new, time.monotonic() + STARTUP_TIMEOUT):
+            self.retire(old)
+            return True
+        self.logger.error(f"Replacement worker {new.pid} did not come up; keeping worker {old.pid}")
+        self._kill(new.pid, signal.SIGKILL)
+        return False
+
+    def _kill(self, pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def reap(self) -> None:
+        from prometheus_client import multiprocess
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            # Live gauges of a worker that did not shut down cleanly
+            multiprocess.mark_process_dead(pid)
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            self._close(worker)
+            if worker.retiring or self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if worker.ready:
+                self.logger.warning(f"Worker {pid} exited unexpectedly ({code})")
+            else:
+                self.crashes += 1
+                self.logger.error(f"Worker {pid} exited before coming up ({code}), {self.crashes} in a row")
+
+    # --- Master -------------------------------------------------------------
+
+    def _install_signals(self) -> None:
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        os.set_blocking(self._wakeup_r, False)
+        signal.set_wakeup_fd(self._wakeup_w)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+
+    def _drain_wakeup(self) -> None:
+        # Only wakes up select(); the handlers queue the signals themselves
+        try:
+            while os.read(self._wakeup_r, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _listen(self) -> socket.socket:
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if fd is not None:
+            sock = socket.socket(fileno=int(fd))
+            self.logger.info(f"Re-executed master {os.getpid()} took over {sock.getsockname()}")
+            return sock
+        return self.config.bind_socket()
+
+    def run(self) -> int:
+        self.sock = self._listen()
+        self._install_signals()
+        old_pids = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, "").split(",") if pid]
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        if old_pids:
+            # Rolling restart: the old workers keep serving until each has a replacement
+            old = [self.workers.setdefault(pid, Worker(pid, None)) for pid in old_pids]
+            for index in range(max(len(old), self.target)):
+                if index < self.target:
+                    new = self.spawn()
+                    if not self.wait_ready(new, time.monotonic() + STARTUP_TIMEOUT):
+                        self.logger.error(f"Worker {new.pid} running the new code did not come up; "
+                                          "keeping the remaining old workers")
+                        self._kill(new.pid, signal.SIGKILL)
+                        break
+                if index < len(old):
+                    self.retire(old[index])
+        else:
+            # The first worker's lifespan creates the schema on a new database; the others
+            # start once it is up so they never race it
+            first = self.spawn()
+            started = [first] if not self.wait_ready(first, deadline) else [
+                first, *(self.spawn() for _ in range(self.target - 1))
+            ]
+            if len(started) < self.target or not all(self.wait_ready(worker, deadline) for worker in started):
+                self.logger.error(f"Workers did not all come up (startup timeout {STARTUP_TIMEOUT:.0f}s)")
+                self.stop()
+                return 1
+        self.logger.info(f"Master {os.getpid()} serving with {self.target} workers")
+        return self.loop()
+
+    def loop(self) -> int:
+        while True:
+            for key, _ in self._selector.select(1.0):
+                if key.data is None:
+                    self._drain_wakeup()
+                elif key.data.fd is not None:
+                    self._read(key.data)
+
+            signals, self._signals = self._signals, []
+            if signal.SIGTERM in signals or signal.SIGINT in signals:
+                self.stop()
+                return 0
+            self.reap()
+            if signal.SIGHUP in signals:
+                self.reexec()
+
+            recycle, self._recycle = self._recycle, []
+            for worker in recycle:
+                if worker.pid in self.workers and not worker.retiring:
+                    self.logger.info(f"Worker {worker.pid} reached its request limit; replacing it")
+                    self.replace(worker)
+
+            now = time.monotonic()
+            for worker in list(self.workers.values()):
+                if worker.retiring and now >= worker.kill_at:
+                    self.logger.warning(f"Worker {worker.pid} still busy after {GRACEFUL_TIMEOUT:.0f}s; killing it")
+                    self._kill(worker.pid, signal.SIGKILL)
+                elif not worker.ready and now - worker.started_at > STARTUP_TIMEOUT:
+                    self.logger.error(f"Worker {worker.pid} did not come up within {STARTUP_TIMEOUT:.0f}s")
+                    self._kill(worker.pid, signal.SIGKILL)
+                    worker.started_at = now
+
+            if self.crashes >= CRASH_LIMIT:
+                self.logger.error(f"{self.crashes} workers in a row died before coming up; stopping")
+                self.stop()
+                return 1
+            serving = sum(1 for worker in self.workers.values() if not worker.retiring)
+            for _ in range(self.target - serving):
+                self.spawn()
+
+    def reexec(self) -> None:
+        """Replace this process with a fresh master running the code on disk"""
+        self.logger.info("SIGHUP: checking the new code before a rolling restart")
+        try:
+            subprocess.run([sys.executable, "-c", "import main"], cwd=BACKEND_DIR, check=True,
+                           timeout=STARTUP_TIMEOUT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"Not restarting: the new code does not import:\n{e.stderr.decode(errors='replace')}")
+            return
+        except subprocess.TimeoutExpired:
+            self.logger.error("Not restarting: importing the new code timed out")
+            return
+
+        # Workers already draining are not handed over; wait for them here
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while any(worker.retiring for worker in self.workers.values()) and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        for worker in list(self.workers.values()):
+            if worker.retiring:
+                self._kill(worker.pid, signal.SIGKILL)
+        while any(worker.retiring for worker in self.workers.values()):
+            time.sleep(0.05)
+            self.reap()
+
+        self.sock.set_inheritable(True)
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[OLD_WORKERS_ENV] = ",".join(str(pid) for pid in self.workers)
+        self.logger.info(f"Re-executing master {os.getpid()}; {len(self.workers)} workers keep serving meanwhile")
+        from logging_config import stop_logging
+        stop_logging()
+        signal.set_wakeup_fd(-1)
+        # sys.orig_argv keeps interpreter options; it is new in Python 3.10
+        argv = sys.orig_argv[1:] if hasattr(sys, "orig_argv") else sys.argv
+        os.execv(sys.executable, [sys.executable, *argv])
+
+    def stop(self) -> None:
+        """Graceful stop: SIGTERM every worker, SIGKILL what is left after GRACEFUL_TIMEOUT"""
+        self.stopping = True
+        self.logger.info(f"Stopping {len(self.workers)} workers")
+        for worker in self.workers.values():
+            self._kill(worker.pid, signal.SIGTERM)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while self.workers and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        for worker in list(self.workers.values()):
+            self.logger.warning(f"Worker {worker.pid} did not stop within {GRACEFUL_TIMEOUT:.0f}s; killing it")
+            self._kill(worker.pid, signal.SIGKILL)
+        while self.workers:
+            time.sleep(0.05)
+            self.reap()
+        if self.sock is not None:
+            self.sock.close()
+        owned = os.environ.get(OWNED_METRICS_DIR_ENV)
+        if owned:
+            shutil.rmtree(owned, ignore_errors=True)
+
+
+def serve(host: str, port: int, workers: int, log_level: str = "info", max_requests: int = MAX_REQUESTS,
+          max_requests_jitter: int = MAX_REQUESTS_JITTER) -> int:
+    """Preload the app, fork ``workers`` workers and supervise them; returns the exit code"""
+    prepare_metrics_dir()
+    try:
+        # Created first: it sets up uvicorn's log handlers, which logging_config then queues
+        config = uvicorn.Config("main:app", host=host, port=port, log_level=log_level, access_log=True)
+        started = time.perf_counter()
+        config.load()
+        from auth import dummy_hash
+        dummy_hash()
+        from logging_config import logger
+        logger.info(f"Preloaded the app in {time.perf_counter() - started:.2f}s")
+        # Nothing should be connected yet, but connections must never cross the fork
+        from database import engine
+        engine.dispose()
+        return Master(config, workers, max_requests, max_requests_jitter).run()
+    except BaseException:
+        # e.g. the port is taken; Master.stop cleans up otherwise
+        owned = os.environ.get(OWNED_METRICS_DIR_ENV)
+        if owned:
+            shutil.rmtree(owned, ignore_errors=True)
+        raise
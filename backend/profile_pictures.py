@@ -0,0 +1,242 @@
+"""
+Profile picture upload pipeline.
+
+Uploads are streamed to a spooled temp file with the size limit enforced
+chunk by chunk, decoded with Pillow, oriented by EXIF, downscaled to fit
+PROFILE_PICTURE_MAX_DIM and re-encoded as progressive JPEG. The result is
+named by its SHA-256, so a URL always names the same bytes and can be cached
+forever (see the /static/uploads/profile mount in main.py).
+
+Content-addressed files may be shared by several users, so a picture is only
+deleted once no user references it: the previous picture right after an
+upload (including pictures from the old user_<id>.<ext> naming), and every
+unreferenced file under uploads/profile in a sweep at startup. Storing a
+picture and committing the reference, and checking for references and
+deleting, each run under one lock (a flock on uploads/profile/.lock, so it
+holds across workers): an upload of a picture that is being deleted either
+finds it gone and writes it again, or is seen as a reference and keeps it.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile, status
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from logging_config import logger
+from models import User
+
+try:
+    import fcntl
+except ImportError:  # Windows: the lock only covers threads of this process
+    fcntl = None
+
+PROFILE_PICTURE_MAX_BYTES = int(os.getenv("PROFILE_PICTURE_MAX_BYTES", str(5 * 1024 * 1024)))
+PROFILE_PICTURE_MAX_DIM = int(os.getenv("PROFILE_PICTURE_MAX_DIM", "512"))
+PROFILE_PICTURE_QUALITY = 85
+ALLOWED_FORMATS = ("JPEG", "PNG", "GIF", "WEBP")
+CHUNK_SIZE = 64 * 1024
+# Files younger than this are never swept: their upload may not be committed yet
+ORPHAN_GRACE_SECONDS = 3600
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "uploads")
+PICTURES_DIR = os.path.join(UPLOADS_DIR, "profile")
+PICTURES_URL = "/static/uploads/profile"
+LOCK_PATH = os.path.join(PICTURES_DIR, ".lock")
+
+_thread_lock = threading.Lock()
+
+# Refuse to decode images larger than this many pixels (decompression bombs)
+Image.MAX_IMAGE_PIXELS = 40_000_000
+
+
+@contextmanager
+def _pictures_lock():
+    """Exclusive across threads and worker processes sharing PICTURES_DIR"""
+    if fcntl is None:
+        with _thread_lock:
+            yield
+        return
+    os.makedirs(PICTURES_DIR, exist_ok=True)
+    # Every holder opens the file itself, so threads exclude each other too
+    with open(LOCK_PATH, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _spool_upload(upload: UploadFile):
+    """Copy the upload into a spooled temp file, failing as soon as it exceeds the limit"""
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    size = 0
+    while True:
+        chunk = upload.file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > PROFILE_PICTURE_MAX_BYTES:
+            spool.close()
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File size exceeds {PROFILE_PICTURE_MAX_BYTES // (1024 * 1024)}MB limit"
+            )
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def process_image(source) -> bytes:
+    """Decode, orient, downscale and re-encode an image as JPEG"""
+    try:
+        with Image.open(source, formats=ALLOWED_FORMATS) as image:
+            # Let the JPEG decoder skip detail we would throw away anyway
+            image.draft("RGB", (PROFILE_PICTURE_MAX_DIM, PROFILE_PICTURE_MAX_DIM))
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            else:
+                image = image.convert("RGB")
+            image.thumbnail((PROFILE_PICTURE_MAX_DIM, PROFILE_PICTURE_MAX_DIM), Image.LANCZOS)
+
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=PROFILE_PICTURE_QUALITY, optimize=True, progressive=True)
+            return out.getvalue()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid image. Allowed: {', '.join(fmt.lower() for fmt in ALLOWED_FORMATS)}"
+        )
+
+
+def _store(data: bytes) -> str:
+    """Write processed bytes under their content hash and return the public URL"""
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    filename = f"{digest}.jpg"
+    path = os.path.join(PICTURES_DIR, filename)
+    if os.path.exists(path):
+        # Same picture uploaded again; refresh its age so the sweep leaves it alone
+        os.utime(path)
+    else:
+        os.makedirs(PICTURES_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return f"{PICTURES_URL}/{filename}"
+
+
+def save_profile_picture(db: Session, user: User, upload: UploadFile) -> Optional[str]:
+    """Process ``upload``, point ``user`` at it and commit.
+
+    Returns the user's previous picture URL so the caller can hand it to
+    ``delete_if_orphaned`` once the response is sent.
+    """
+    spool = _spool_upload(upload)
+    try:
+        data = process_image(spool)
+    finally:
+        spool.close()
+
+    previous = user.profile_picture_url
+    # Until the commit, the file is not referenced yet: keep deletes out
+    with _pictures_lock():
+        try:
+            url = _store(data)
+        except OSError as e:
+            logger.error(f"Failed to save profile picture for user {user.id}: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Could not save file")
+        user.profile_picture_url = url
+        db.commit()
+    db.refresh(user)
+    logger.info(f"Profile picture uploaded for user {user.id}: {url}")
+    return previous if previous != url else None
+
+
+def _path_for_url(url: str) -> Optional[str]:
+    prefix = "/static/uploads/"
+    if not url or not url.startswith(prefix):
+        return None
+    path = os.path.normpath(os.path.join(UPLOADS_DIR, url[len(prefix):]))
+    # Never follow a URL out of the uploads directory
+    if not path.startswith(UPLOADS_DIR + os.sep):
+        return None
+    return path
+
+
+def delete_if_orphaned(url: Optional[str]) -> None:
+    """Delete the file behind ``url`` if no user references it any more"""
+    path = _path_for_url(url)
+    if not path:
+        return
+    with _pictures_lock():
+        db = SessionLocal()
+        try:
+            if db.query(User.id).filter(User.profile_picture_url == url).first():
+                return
+        finally:
+            db.close()
+        try:
+            os.remove(path)
+            logger.info(f"Removed orphaned profile picture {url}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove orphaned profile picture {url}: {e}")
+
+
+def sweep_orphans() -> int:
+    """Delete every processed picture no user references, returning how many were removed"""
+    db = SessionLocal()
+    try:
+        referenced = {
+            path for (url,) in db.query(User.profile_picture_url).filter(User.profile_picture_url.isnot(None))
+            if (path := _path_for_url(url))
+        }
+    finally:
+        db.close()
+
+    removed = 0
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    for root, _dirs, files in os.walk(PICTURES_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            if path in referenced or path == LOCK_PATH:
+                continue
+            try:
+                # A picture referenced since the query above was stored again
+                # (touched) under the lock, so the age check catches it
+                with _pictures_lock():
+                    if os.path.getmtime(path) > cutoff:
+                        continue
+                    os.remove(path)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Could not sweep {path}: {e}")
+    if removed:
+        logger.info(f"Removed {removed} orphaned profile pictures")
+    return removed
+
+
+def start_orphan_sweep() -> threading.Thread:
+    """Run ``sweep_orphans`` on a daemon thread so startup does not wait for it"""
+    def run():
+        try:
+            sweep_orphans()
+        except Exception as e:
+            logger.error(f"Profile picture sweep failed: {e}", exc_info=True)
+
+    thread = threading.Thread(target=run, name="profile-picture-sweep", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,342 @@
+"""
+On-demand and sampled request profiling.
+
+An admin can profile a single request by sending ``X-Profile: 1`` or adding
+``?__profile=1``. The response carries an ``X-Profile-Id`` header and the
+report is stored under PROFILE_DIR, where GET /admin/profiles/{id} serves it.
+The trigger is ignored for anyone who is not an admin.
+
+PROFILE_SAMPLE_ROUTES profiles every Nth request to the given route templates
+without any trigger, e.g. ``/attendance/roster=50,/requests/{request_id}=200``.
+
+Sync endpoints run in threadpool threads, which cProfile (per thread) would
+not see. The report is therefore built by a sampling profiler that records
+the stacks of the event loop thread and the AnyIO worker threads every
+PROFILE_INTERVAL_MS. Stacks idling in select() or waiting for work are
+dropped. Under concurrent load, other requests running on worker threads at
+the same time show up in the samples too. SQL time is exact: statements are
+timed per request through a context variable that follows the request into
+the threadpool.
+"""
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import anyio.to_thread
+from jose import JWTError, jwt
+from sqlalchemy import event
+from starlette.datastructures import Headers, QueryParams
+
+from database import SessionLocal
+from logging_config import logger
+from models import User
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(BACKEND_DIR, "profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+PROFILE_SAMPLE_ROUTES = os.getenv("PROFILE_SAMPLE_ROUTES", "")
+PROFILE_TOP_FUNCTIONS = 30
+PROFILE_TOP_STATEMENTS = 10
+
+WORKER_THREAD_NAME = "AnyIO worker thread"
+# (file name, function) of leaf frames that mean a thread is idle
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get")}
+
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+def _frame_key(code) -> tuple:
+    # co_qualname (Class.method) is new in Python 3.11
+    return code.co_filename, code.co_firstlineno, getattr(code, "co_qualname", code.co_name)
+
+
+class StackSampler(threading.Thread):
+    """Samples the stacks of the given thread and the AnyIO worker threads"""
+
+    def __init__(self, loop_thread_id: int, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.ticks = 0
+        self.samples = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self._stop_event = threading.Event()
+
+    def _thread_ids(self) -> set:
+        return {self.loop_thread_id} | {
+            thread.ident for thread in threading.enumerate() if thread.name == WORKER_THREAD_NAME
+        }
+
+    def run(self):
+        thread_ids = self._thread_ids()
+        while not self._stop_event.wait(self.interval):
+            self.ticks += 1
+            if self.ticks % 50 == 0:
+                # The threadpool grows on demand
+                thread_ids = self._thread_ids()
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                leaf = frame.f_code
+                if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_FRAMES:
+                    continue
+                self.samples += 1
+                self.self_counts[_frame_key(leaf)] += 1
+                seen = set()
+                while frame is not None:
+                    key = _frame_key(frame.f_code)
+                    if key not in seen:
+                        seen.add(key)
+                        self.total_counts[key] += 1
+                    frame = frame.f_back
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfile:
+    def __init__(self, scope, trigger: str):
+        self.id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.trigger = trigger
+        self.started_at = datetime.now(timezone.utc)
+        self.status = None
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements: Dict[str, List[float]] = {}
+        self._started = time.perf_counter()
+        self.duration = None
+        self.sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+        self.sampler.start()
+
+    def record_statement(self, statement: str, seconds: float):
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        entry = self.statements.setdefault(statement, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+        self.sampler.stop()
+
+    def report(self, route: str) -> dict:
+        sampler = self.sampler
+        # Each sample stands for one tick of one thread's time
+        sample_ms = self.duration * 1000 / sampler.ticks if sampler.ticks else 0.0
+
+        def describe(key, count):
+            filename, line, name = key
+            return {
+                "function": name,
+                "location": f"{os.path.relpath(filename, BACKEND_DIR) if filename.startswith(BACKEND_DIR) else filename}:{line}",
+                "self_ms": round(sampler.self_counts.get(key, 0) * sample_ms, 2),
+                "total_ms": round(sampler.total_counts.get(key, 0) * sample_ms, 2),
+                "samples": count,
+            }
+
+        statements = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "id": self.id,
+            "trigger": self.trigger,
+            "method": self.method,
+            "path": self.path,
+            "route": route,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 2),
+            "sql": {
+                "queries": self.sql_count,
+                "time_ms": round(self.sql_seconds * 1000, 2),
+                "share": round(self.sql_seconds / self.duration, 3) if self.duration else None,
+                "statements": [
+                    {"statement": statement[:500], "count": count, "time_ms": round(seconds * 1000, 2)}
+                    for statement, (count, seconds) in statements[:PROFILE_TOP_STATEMENTS]
+                ],
+            },
+            "sampling": {"interval_ms": PROFILE_INTERVAL_MS, "ticks": sampler.ticks, "samples": sampler.samples},
+            "top_functions_by_self": [
+                describe(key, count) for key, count in sampler.self_counts.most_common(PROFILE_TOP_FUNCTIONS)
+            ],
+            "top_functions_by_total": [
+                describe(key, count) for key, count in sampler.total_counts.most_common(PROFILE_TOP_FUNCTIONS)
+            ],
+        }
+
+
+def instrument_engine(engine) -> None:
+    """Time every statement executed on behalf of a profiled request"""
+
+    # The profile and start time live on the statement's execution context: a failed
+    # statement leaves nothing on the connection, and the time goes to the profile
+    # that was active when the statement started
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _current_profile.get()
+        if profile is not None and context is not None:
+            context._profile_query = (profile, time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_profile_query", None)
+        if started is not None:
+            profile, start = started
+            profile.record_statement(statement, time.perf_counter() - start)
+
+
+def _template_pattern(template: str):
+    parts = re.split(r"\{[^}]+\}", template)
+    return re.compile("[^/]+".join(re.escape(part) for part in parts) + r"\Z")
+
+
+def parse_sample_routes(spec: str) -> list:
+    """``/a=50,/b/{id}=10`` -> [(template, compiled pattern, every)]"""
+    routes = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        template, _, every = item.rpartition("=")
+        if not template or not every.isdigit() or int(every) == 0:
+            logger.warning(f"Ignoring PROFILE_SAMPLE_ROUTES entry {item!r}: expected <route>=<N>")
+            continue
+        routes.append((template, _template_pattern(template), int(every)))
+    return routes
+
+
+def _is_admin(authorization: str) -> bool:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    # Imported here: auth reads SECRET_KEY at import time
+    from auth import ALGORITHM, SECRET_KEY
+    try:
+        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return False
+    if not username:
+        return False
+    db = SessionLocal()
+    try:
+        # The role comes from the database, like require_admin; the token's claim is not trusted
+        return db.query(User.id).filter(User.username == username, User.role == "admin").first() is not None
+    finally:
+        db.close()
+
+
+def _write_report(profile: RequestProfile, route: str) -> None:
+    report = profile.report(route)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{report['id']}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(
+        f"Profiled {report['method']} {report['path']} ({report['trigger']}): "
+        f"{report['duration_ms']}ms, SQL {report['sql']['time_ms']}ms in {report['sql']['queries']} queries -> {path}"
+    )
+
+
+_PROFILE_ID = re.compile(r"[0-9]{8}T[0-9]{6}-[0-9a-f]{8}\Z")
+
+
+def list_reports(limit: int) -> list:
+    """Summaries of the newest stored reports"""
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".json")]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    summaries = []
+    for entry in entries[:limit]:
+        try:
+            with open(entry.path) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summaries.append({
+            key: report.get(key) for key in ("id", "trigger", "method", "path", "route", "status", "duration_ms")
+        } | {"sql_ms": report.get("sql", {}).get("time_ms")})
+    return summaries
+
+
+def load_report(profile_id: str) -> Optional[dict]:
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, sample_routes: str = PROFILE_SAMPLE_ROUTES):
+        self.app = app
+        self.sample_routes = parse_sample_routes(sample_routes)
+        self._counters = {template: 0 for template, _, _ in self.sample_routes}
+        self._lock = threading.Lock()
+
+    def _sampled(self, path: str) -> bool:
+        for template, pattern, every in self.sample_routes:
+            if pattern.match(path):
+                with self._lock:
+                    self._counters[template] += 1
+                    return self._counters[template] % every == 0
+        return False
+
+    async def _trigger(self, scope) -> Optional[str]:
+        headers = Headers(scope=scope)
+        requested = headers.get("x-profile") == "1" or (
+            b"__profile" in scope["query_string"] and QueryParams(scope["query_string"]).get("__profile") == "1"
+        )
+        if requested and await anyio.to_thread.run_sync(_is_admin, headers.get("authorization", "")):
+            return "on_demand"
+        if self.sample_routes and self._sampled(scope["path"]):
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trigger = await self._trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope, trigger)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = [*message.get("headers", ()), (b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            profile.finish()
+            route = scope["route"].path if "route" in scope else scope["path"]
+            try:
+                await anyio.to_thread.run_sync(_write_report, profile, route)
+            except Exception as e:
+                logger.error(f"Could not store profile {profile.id}: {e}", exc_info=True)
@@ -0,0 +1,256 @@
+"""
+Fan-out of leave request events to advisor dashboards, across workers.
+
+Route handlers call ``enqueue`` before committing a change, which adds a row
+to request_events in the same transaction; event ids come from the
+"request_events" counter in sync_versions, so they are committed in order.
+After the commit the handler calls ``event_hub.notify()``.
+
+Every worker runs an ``event_hub`` thread that tails the table while it has
+streams attached: it reads rows past the last id it has seen, every
+REQUEST_EVENT_POLL_INTERVAL seconds or as soon as its own worker notifies it,
+and hands each one to the subscribed streams that should see it. Advisors get
+events for requests assigned to them, admins get everything. A change made
+through any worker therefore reaches the dashboards of every worker, at most
+one poll interval late.
+
+The row id is the SSE event id. A client resuming with Last-Event-ID gets
+the rows it missed straight from the table; if they have already been pruned
+(only the newest REQUEST_EVENT_HISTORY rows are kept) or the id is unknown,
+it gets a single ``reset`` event telling it to reload /requests/pending.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from counters import next_value
+from database import SessionLocal
+from logging_config import logger
+from models import RequestEventRecord
+
+EVENT_HISTORY_SIZE = int(os.getenv("REQUEST_EVENT_HISTORY", "1000"))
+EVENT_POLL_INTERVAL = float(os.getenv("REQUEST_EVENT_POLL_INTERVAL", "0.5"))
+EVENT_PRUNE_INTERVAL = 60.0
+EVENT_BATCH_SIZE = 500
+SUBSCRIBER_QUEUE_SIZE = 256
+EVENTS_COUNTER = "request_events"
+
+
+def enqueue(db: Session, event_type: str, payload: dict, advisor_ids: Iterable[str]) -> int:
+    """Record an event as part of the caller's transaction, returning its id"""
+    event_id = next_value(db, EVENTS_COUNTER)
+    db.add(RequestEventRecord(
+        id=event_id,
+        type=event_type,
+        payload=json.dumps(payload, default=str, separators=(",", ":")),
+        targets=json.dumps(sorted(advisor_ids)),
+    ))
+    return event_id
+
+
+class RequestEvent:
+    __slots__ = ("id", "type", "targets", "encoded")
+
+    def __init__(self, event_id: int, event_type: str, data: str, targets: frozenset):
+        self.id = event_id
+        self.type = event_type
+        self.targets = targets
+        self.encoded = f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n".encode("utf-8")
+
+    @classmethod
+    def from_row(cls, row: RequestEventRecord) -> "RequestEvent":
+        return cls(row.id, row.type, row.payload, frozenset(json.loads(row.targets)))
+
+    @classmethod
+    def reset(cls, event_id: int) -> "RequestEvent":
+        return cls(event_id, "reset", "{}", frozenset())
+
+
+class Subscription:
+    def __init__(self, user_id: str, see_all: bool, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.see_all = see_all
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.backlog: List[RequestEvent] = []
+        # Id of the newest event this stream has been given or has skipped
+        self.cursor = 0
+
+    def wants(self, event: RequestEvent) -> bool:
+        return self.see_all or self.user_id in event.targets
+
+    def _deliver(self, event: RequestEvent):
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow consumer: drop its backlog and make it resync from scratch
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RequestEvent.reset(event.id))
+
+
+class RequestEventHub:
+    def __init__(self, session_factory=SessionLocal, poll_interval: float = EVENT_POLL_INTERVAL,
+                 history_size: int = EVENT_HISTORY_SIZE):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.history_size = history_size
+        # _lock guards the subscriber set; _poll_lock keeps reading the table and
+        # registering a stream apart, so no event falls between the two
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._subscribers = set()
+        self._last_id: Optional[int] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pruned_at = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="request-events", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def notify(self):
+        """Poll now instead of at the next interval; call after committing an event"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.poll()
+                if time.monotonic() - self._pruned_at >= EVENT_PRUNE_INTERVAL:
+                    self.prune()
+            except Exception as e:
+                logger.error(f"Request event poll failed: {e}", exc_info=True)
+
+    def poll(self) -> int:
+        """Deliver rows committed since the last poll, returning how many were read"""
+        total = 0
+        with self._poll_lock:
+            while self._last_id is not None:
+                db = self.session_factory()
+                try:
+                    rows = db.query(RequestEventRecord).filter(
+                        RequestEventRecord.id > self._last_id
+                    ).order_by(RequestEventRecord.id).limit(EVENT_BATCH_SIZE).all()
+                    events = [RequestEvent.from_row(row) for row in rows]
+                finally:
+                    db.close()
+                if not events:
+                    break
+                self._fan_out(events)
+                self._last_id = events[-1].id
+                total += len(events)
+                if len(events) < EVENT_BATCH_SIZE:
+                    break
+        return total
+
+    def _fan_out(self, events: List[RequestEvent]):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            for event in events:
+                if event.id <= sub.cursor or not sub.wants(event):
+                    continue
+                try:
+                    sub.loop.call_soon_threadsafe(sub._deliver, event)
+                except RuntimeError:
+                    # Event loop already closed; the stream is going away
+                    self.unsubscribe(sub)
+                    break
+            sub.cursor = max(sub.cursor, events[-1].id)
+
+    def prune(self) -> int:
+        """Drop rows older than the newest ``history_size``"""
+        self._pruned_at = time.monotonic()
+        db = self.session_factory()
+        try:
+            newest = db.query(func.max(RequestEventRecord.id)).scalar()
+            if newest is None:
+                return 0
+            deleted = db.query(RequestEventRecord).filter(
+                RequestEventRecord.id <= newest - self.history_size
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def subscribe(self, user_id: str, see_all: bool, last_event_id: Optional[str],
+                  loop: asyncio.AbstractEventLoop) -> Subscription:
+        """Register a stream, filling its backlog with events missed since ``last_event_id``.
+
+        Reads the database, so call it from a worker thread.
+        """
+        sub = Subscription(user_id, see_all, loop)
+        with self._poll_lock:
+            db = self.session_factory()
+            try:
+                oldest, newest = db.query(
+                    func.min(RequestEventRecord.id), func.max(RequestEventRecord.id)
+                ).one()
+                sub.cursor = newest or 0
+                if last_event_id:
+                    sub.backlog = self._replay(db, sub, last_event_id, oldest, newest)
+            finally:
+                db.close()
+            with self._lock:
+                if not self._subscribers:
+                    # Nobody was listening, so the tailer starts from here
+                    self._last_id = sub.cursor
+                self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(sub)
+            if not self._subscribers:
+                self._last_id = None
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def _replay(self, db: Session, sub: Subscription, last_event_id: str,
+                oldest: Optional[int], newest: Optional[int]) -> List[RequestEvent]:
+        reset = [RequestEvent.reset(sub.cursor)]
+        if not last_event_id.isdigit():
+            return reset
+        last_id = int(last_event_id)
+        if last_id == (newest or 0):
+            return []
+        if newest is None or last_id > newest or last_id < oldest - 1:
+            logger.info(f"Event stream for {sub.user_id} resumed outside the event table; sending reset")
+            return reset
+        rows = db.query(RequestEventRecord).filter(
+            RequestEventRecord.id > last_id
+        ).order_by(RequestEventRecord.id).limit(self.history_size + 1).all()
+        if len(rows) > self.history_size:
+            return reset
+        events = [RequestEvent.from_row(row) for row in rows]
+        if events:
+            sub.cursor = events[-1].id
+        return [event for event in events if sub.wants(event)]
+
+
+event_hub = RequestEventHub()
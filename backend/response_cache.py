@@ -0,0 +1,470 @@
+"""
+Route-level response cache.
+
+``@cached_response(tables=..., scope=...)`` below a route decorator stores
+the serialized response body and headers, keyed by route, path and query
+string and the caller's scope:
+
+- ``public``: one entry for every caller (the route's own dependencies still
+  decide who may call it)
+- ``role``: one entry per role
+- ``user``: one entry per user
+
+An entry is only served while every table it depends on is still at the
+version it was computed at. Versions live in sync_versions as
+``table:<name>`` rows. A before_flush listener (ORM changes) and a
+do_orm_execute listener (bulk INSERT/UPDATE/DELETE statements run through a
+Session) note the tables a transaction writes, and before_commit bumps their
+versions in that same transaction. A version can therefore never become
+visible without the data it covers, and writes from other workers invalidate
+too. Bumping at commit rather than at the first write keeps the version
+row's lock short: on PostgreSQL, concurrent transactions writing the same
+table still take turns on that row, but only while committing. Only tables
+some cached route depends on are tracked. Writes made without a Session (raw
+SQL, other programs) are not seen; RESPONSE_CACHE_TTL bounds how stale those
+can make an entry.
+
+Versions are read with the route's own ``db`` session, so a cached request
+needs no second connection.
+
+Entries also expire after their TTL and are evicted least recently used.
+The backend is chosen with RESPONSE_CACHE_BACKEND: ``memory`` (per process,
+the default) or ``sqlite`` (a file at RESPONSE_CACHE_PATH shared by all
+workers on the host).
+
+With ``coalesce=True``, concurrent misses for the same key and table
+versions compute the response once (see single_flight); the others answer
+with the entry it stored and ``X-Cache: COALESCED``.
+
+Cached responses get an ETag, and If-None-Match is answered with 304 on hits
+and misses alike. Only 200 responses are stored. The route must return a
+Response or plain JSON data; a response_model is not applied to cached
+bodies, so use it on routes that return serializers.json_list or dicts.
+"""
+import asyncio
+import functools
+import hashlib
+import inspect
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import orjson
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from database import upsert_insert
+from logging_config import logger
+from metrics import record_cache
+from models import SyncVersion
+from single_flight import SingleFlight
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+RESPONSE_CACHE_PATH = os.getenv(
+    "RESPONSE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_cache.db")
+)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+VERSION_PREFIX = "table:"
+SCOPES = ("public", "role", "user")
+# Recomputed per response, or meaningless for a stored body
+SKIP_HEADERS = {"content-length", "x-process-time", "x-profile-id"}
+
+# Tables some cached route depends on; writes to others are not versioned
+_tracked_tables = set()
+
+
+# --- Table versions ---------------------------------------------------------
+
+def _note_written(session: Session, tables: Iterable[str]) -> None:
+    session.info.setdefault("response_cache_written", set()).update(tables)
+
+
+def _bump(session: Session, tables: Iterable[str]) -> None:
+    """Increment the version of each of ``tables`` once per transaction"""
+    bumped = session.info.setdefault("response_cache_bumped", set())
+    # Sorted so concurrent transactions lock the version rows in the same order
+    for table in sorted(set(tables) - bumped):
+        stmt = upsert_insert(SyncVersion.__table__).values(name=VERSION_PREFIX + table, value=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SyncVersion.name],
+            set_={"value": SyncVersion.__table__.c.value + 1}
+        )
+        session.connection().execute(stmt)
+        bumped.add(table)
+
+
+@event.listens_for(Session, "before_flush")
+def _version_flushed_tables(session, flush_context, instances):
+    if not _tracked_tables:
+        return
+    tables = set()
+    for obj in (*session.new, *session.deleted):
+        tables.update(table.name for table in _mapped_tables(obj))
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            tables.update(table.name for table in _mapped_tables(obj))
+    tables &= _tracked_tables
+    if tables:
+        _note_written(session, tables)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _version_bulk_statements(state):
+    if not _tracked_tables or not (state.is_insert or state.is_update or state.is_delete):
+        return
+    table = getattr(state.statement, "table", None)
+    name = getattr(table, "name", None)
+    if name in _tracked_tables:
+        _note_written(state.session, [name])
+
+
+@event.listens_for(Session, "before_commit")
+def _version_written_tables(session):
+    # Commit flushes after this event; flush now to see what it writes
+    session.flush()
+    written = session.info.get("response_cache_written")
+    if written:
+        _bump(session, written)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _end_transaction(session):
+    session.info.pop("response_cache_written", None)
+    session.info.pop("response_cache_bumped", None)
+
+
+def _mapped_tables(obj):
+    mapper = getattr(obj, "__mapper__", None)
+    return mapper.tables if mapper is not None else ()
+
+
+def table_versions(db: Session, tables: Iterable[str]) -> Dict[str, int]:
+    names = [VERSION_PREFIX + table for table in tables]
+    found = dict(db.query(SyncVersion.name, SyncVersion.value).filter(SyncVersion.name.in_(names)))
+    return {table: found.get(VERSION_PREFIX + table, 0) for table in tables}
+
+
+# --- Entries and backends ---------------------------------------------------
+
+class CacheEntry:
+    __slots__ = ("body", "headers", "versions", "etag", "expires_at")
+
+    def __init__(self, body: bytes, headers: list, versions: Dict[str, int], etag: str, expires_at: float):
+        self.body = body
+        self.headers = headers
+        self.versions = versions
+        self.etag = etag
+        self.expires_at = expires_at
+
+    def to_bytes(self) -> bytes:
+        meta = orjson.dumps({
+            "headers": self.headers, "versions": self.versions, "etag": self.etag, "expires_at": self.expires_at,
+        })
+        return struct.pack(">I", len(meta)) + meta + self.body
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CacheEntry":
+        (meta_length,) = struct.unpack_from(">I", data)
+        meta = orjson.loads(data[4:4 + meta_length])
+        return cls(data[4 + meta_length:], meta["headers"], meta["versions"], meta["etag"], meta["expires_at"])
+
+
+class MemoryBackend:
+    """Per-process LRU bounded by entry count and total body bytes"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(entry.body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry.body)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class SQLiteBackend:
+    """Entries in a SQLite file shared by every worker on the host.
+
+    Recency is only written when it is more than ``TOUCH_INTERVAL`` old, so
+    hits stay reads.
+    """
+
+    TOUCH_INTERVAL = 30
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_accessed ON response_cache (accessed_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, expires_at, accessed_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] <= now:
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+        if now - row[2] > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return CacheEntry.from_bytes(row[0])
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, entry.to_bytes(), entry.expires_at, now),
+        )
+        (count,) = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM response_cache WHERE key IN "
+                "(SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM response_cache")
+
+
+def make_backend(name: str = RESPONSE_CACHE_BACKEND):
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name != "memory":
+        logger.warning(f"Unknown RESPONSE_CACHE_BACKEND {name!r}; using memory")
+    return MemoryBackend()
+
+
+# --- The decorator ----------------------------------------------------------
+
+class ResponseCache:
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._backend_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        # Created on first use so importing route modules does not open files
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    self._backend = make_backend()
+        return self._backend
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def lookup(self, key: str, versions: Dict[str, int]) -> Optional[CacheEntry]:
+        entry = self.backend.get(key)
+        if entry is not None and entry.versions == versions:
+            return entry
+        return None
+
+    def store(self, key: str, response: Response, versions: Dict[str, int], ttl: float) -> Optional[CacheEntry]:
+        if response.status_code != 200 or not isinstance(getattr(response, "body", None), bytes):
+            return None
+        headers = [
+            (name.decode("latin-1"), value.decode("latin-1")) for name, value in response.raw_headers
+            if name.decode("latin-1").lower() not in SKIP_HEADERS
+        ]
+        etag = response.headers.get("etag")
+        if etag is None:
+            etag = f'W/"{hashlib.blake2b(response.body, digest_size=12).hexdigest()}"'
+            headers.append(("etag", etag))
+        entry = CacheEntry(response.body, headers, versions, etag, time.time() + ttl)
+        self.backend.set(key, entry)
+        return entry
+
+
+response_cache = ResponseCache()
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+def _respond(request: Request, entry: CacheEntry, outcome: str) -> Response:
+    if _etag_matches(request, entry.etag):
+        response = Response(status_code=304)
+    else:
+        response = Response(content=entry.body)
+    for name, value in entry.headers:
+        if response.status_code == 304 and name.lower() == "content-type":
+            continue
+        response.raw_headers.append((name.encode("latin-1"), value.encode("latin-1")))
+    response.headers["X-Cache"] = outcome
+    return response
+
+
+def cached_response(tables: Iterable[str], scope: str = "role", ttl: float = RESPONSE_CACHE_TTL,
+                    name: Optional[str] = None, coalesce: bool = False, cache: ResponseCache = response_cache):
+    """Cache a route's response until one of ``tables`` changes or ``ttl`` passes.
+
+    Put it between ``@router.get(...)`` and the function, which needs a
+    ``db`` session parameter. ``scope`` is ``public``, ``role`` or
+    ``user``; the last two need a ``current_user`` parameter. ``coalesce`` lets concurrent misses share one computation.
+    ``Cache-Control: no-cache`` on a request skips the lookup and is never
+    coalesced.
+    """
+    tables = tuple(sorted(tables))
+    if scope not in SCOPES:
+        raise ValueError(f"scope must be one of {SCOPES}")
+    _tracked_tables.update(tables)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        if scope != "public" and "current_user" not in signature.parameters:
+            raise TypeError(f"{func.__qualname__}: scope {scope!r} needs a current_user parameter")
+        if "db" not in signature.parameters:
+            raise TypeError(f"{func.__qualname__}: needs a db parameter to read table versions with")
+        route_name = name or f"{func.__module__}.{func.__qualname__}"
+        flight = SingleFlight(f"response:{route_name}") if coalesce else None
+        request_param = next(
+            (param.name for param in signature.parameters.values() if param.annotation is Request), None
+        )
+        response_param = next(
+            (param.name for param in signature.parameters.values() if param.annotation is Response), None
+        )
+        parameters = list(signature.parameters.values())
+        if request_param is None:
+            request_param = "_cache_request"
+            parameters.append(inspect.Parameter(request_param, inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+
+        def prepare(kwargs):
+            request = kwargs[request_param] if request_param in signature.parameters else kwargs.pop(request_param)
+            user = kwargs.get("current_user")
+            scope_key = {"public": "-", "role": getattr(user, "role", "-"), "user": getattr(user, "id", "-")}[scope]
+            query = "&".join(sorted(request.url.query.split("&"))) if request.url.query else ""
+            key = f"{route_name}|{scope_key}|{request.url.path}?{query}"
+            skip = "no-cache" in request.headers.get("cache-control", "")
+            return request, key, skip
+
+        def lookup(request, key, skip, db):
+            versions = table_versions(db, tables)
+            entry = None if skip else cache.lookup(key, versions)
+            record_cache(f"response:{route_name}", hit=entry is not None)
+            return versions, entry
+
+        def finish(request, key, versions, result, kwargs):
+            response = result if isinstance(result, Response) else ORJSONResponse(jsonable_encoder(result))
+            if response_param is not None and not isinstance(result, Response):
+                # Headers the route set on its injected Response
+                for header_name, value in kwargs[response_param].headers.items():
+                    if header_name not in ("content-length", "content-type"):
+                        response.headers[header_name] = value
+            entry = cache.store(key, response, versions, ttl)
+            if entry is None:
+                return None, response
+            return entry, _respond(request, entry, "MISS")
+
+        def flight_key(key, versions):
+            return key, tuple(sorted(versions.items()))
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request, key, skip = prepare(kwargs)
+                versions, entry = await run_in_threadpool(lookup, request, key, skip, kwargs["db"])
+                if entry is not None:
+                    return _respond(request, entry, "HIT")
+
+                async def compute():
+                    result = await func(*args, **kwargs)
+                    return await run_in_threadpool(finish, request, key, versions, result, kwargs)
+
+                if flight is None or skip:
+                    return (await compute())[1]
+                (entry, response), shared = await flight.do_async(flight_key(key, versions), compute)
+                if not shared:
+                    return response
+                if entry is not None:
+                    return _respond(request, entry, "COALESCED")
+                # Not stored (not a 200): the outcome may depend on this request's headers
+                return (await compute())[1]
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                request, key, skip = prepare(kwargs)
+                versions, entry = lookup(request, key, skip, kwargs["db"])
+                if entry is not None:
+                    return _respond(request, entry, "HIT")
+
+                def compute():
+                    return finish(request, key, versions, func(*args, **kwargs), kwargs)
+
+                if flight is None or skip:
+                    return compute()[1]
+                (entry, response), shared = flight.do(flight_key(key, versions), compute)
+                if not shared:
+                    return response
+                if entry is not None:
+                    return _respond(request, entry, "COALESCED")
+                # Not stored (not a 200): the outcome may depend on this request's headers
+                return compute()[1]
+
+        wrapper.__signature__ = signature.replace(parameters=parameters)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Retention of closed leave requests.
+
+Approved and rejected requests whose leave ended before the current academic
+year, and which are at least RETENTION_MIN_AGE_DAYS old, are moved from
+leave_requests into leave_requests_archive. Their images move out of the
+database into files under RETENTION_IMAGE_DIR. Lookups by id (the request
+itself, its image and its export) fall back to the archive, so old links keep
+working. Nothing else reads the archive: /requests/, /requests/me,
+/requests/history, /requests/history/count and /requests/search only cover
+leave_requests, so archived years drop out of them.
+
+Run it from cron, e.g. nightly:
+
+    python retention.py            # move eligible requests
+    python retention.py --dry-run  # only count them
+"""
+import os
+import sys
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session, selectinload
+
+from database import SessionLocal
+from logging_config import logger
+from models import ArchivedLeaveRequest, LeaveRequest
+
+RETENTION_MIN_AGE_DAYS = int(os.getenv("RETENTION_MIN_AGE_DAYS", "180"))
+# Month the academic year starts in (6 = June)
+ACADEMIC_YEAR_START_MONTH = int(os.getenv("ACADEMIC_YEAR_START_MONTH", "6"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "200"))
+RETENTION_IMAGE_DIR = os.getenv(
+    "RETENTION_IMAGE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive", "images")
+)
+
+CLOSED_STATUSES = ["approved", "rejected"]
+
+
+def academic_year_start(today: date) -> date:
+    """First day of the academic year ``today`` falls in"""
+    year = today.year if today.month >= ACADEMIC_YEAR_START_MONTH else today.year - 1
+    return date(year, ACADEMIC_YEAR_START_MONTH, 1)
+
+
+def _eligible(db: Session, today: date):
+    created_before = datetime.combine(today, datetime.min.time()) - timedelta(days=RETENTION_MIN_AGE_DAYS)
+    return db.query(LeaveRequest).filter(
+        LeaveRequest.status.in_(CLOSED_STATUSES),
+        LeaveRequest.end_date < academic_year_start(today),
+        LeaveRequest.created_at < created_before
+    )
+
+
+def _image_location(request_id: str):
+    """Return (relative path, absolute path) for an archived image"""
+    relative = os.path.join(request_id[:2], f"{request_id}.jpg")
+    return relative, os.path.join(RETENTION_IMAGE_DIR, relative)
+
+
+def _write_image(request_id: str, data: bytes) -> str:
+    relative, path = _image_location(request_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return relative
+
+
+def read_image(entry: ArchivedLeaveRequest) -> Optional[bytes]:
+    """Image bytes of an archived request, or None if it had none or the file is gone"""
+    if not entry.image_path:
+        return None
+    try:
+        with open(os.path.join(RETENTION_IMAGE_DIR, entry.image_path), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        logger.error(f"Archived image for request {entry.id} is missing: {entry.image_path}")
+        return None
+
+
+def count_eligible(db: Session, today: Optional[date] = None) -> int:
+    return _eligible(db, today or date.today()).count()
+
+
+def archive_closed_requests(db: Session, today: Optional[date] = None,
+                            batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """Move every eligible request to the archive, one transaction per batch.
+
+    Images are written before the batch commits, so a failed batch can leave
+    stray image files behind; the next run overwrites them.
+    """
+    today = today or date.today()
+    moved = 0
+    while True:
+        batch = _eligible(db, today).options(
+            selectinload(LeaveRequest.assigned_advisors)
+        ).order_by(LeaveRequest.id).limit(batch_size).all()
+        if not batch:
+            return moved
+
+        try:
+            for req in batch:
+                db.add(ArchivedLeaveRequest(
+                    id=req.id,
+                    student_id=req.student_id,
+                    start_date=req.start_date,
+                    end_date=req.end_date,
+                    reason=req.reason,
+                    status=req.status,
+                    approved_by=req.approved_by,
+                    advisor_ids=",".join(advisor.id for advisor in req.assigned_advisors) or None,
+                    image_path=_write_image(req.id, req.image_data) if req.image_data else None,
+                    created_at=req.created_at,
+                ))
+                # Also removes its request_advisors rows
+                db.delete(req)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        db.expunge_all()
+        moved += len(batch)
+        logger.info(f"Retention moved {moved} closed leave requests to the archive")
+
+
+def main(argv) -> bool:
+    db = SessionLocal()
+    try:
+        if "--dry-run" in argv:
+            print(f"✓ {count_eligible(db)} closed leave requests are due for archiving")
+            return True
+        moved = archive_closed_requests(db)
+        print(f"✅ Archived {moved} closed leave requests")
+        return True
+    except Exception as e:
+        print(f"❌ Retention failed: {e}")
+        return False
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from auth import require_admin
+from compression import compression_stats
+import profiling
+from slow_queries import slow_query_log
+from response_cache import response_cache
+import single_flight
+from startup_profile import startup
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+@router.get("/compression")
+def compression_report():
+    """Bytes in/out, ratio and CPU seconds per content coding since this worker started"""
+    return compression_stats.snapshot()
+
+@router.get("/single-flight")
+def single_flight_report():
+    """Per coalesced computation in this worker: executions, shared results (duplicates saved) and calls in flight"""
+    return single_flight.snapshot()
+
+@router.get("/startup")
+def startup_report():
+    """This worker's startup phases and time to first response (slowest imports with STARTUP_PROFILE_IMPORTS=1)"""
+    return startup.report()
+
+@router.get("/profiles")
+def list_profiles(limit: int = Query(50, ge=1, le=500)):
+    """Newest request profiles first (on-demand and sampled), from every worker sharing PROFILE_DIR, without their stacks"""
+    return profiling.list_reports(limit)
+
+@router.get("/profiles/{profile_id}")
+def get_profile(profile_id: str):
+    """One profile: duration, SQL time split and top functions"""
+    report = profiling.load_report(profile_id)
+    if report is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return report
+
+@router.get("/slow-queries")
+def slow_queries(limit: int = Query(50, ge=1, le=1000)):
+    """Statements over SLOW_QUERY_MS in this worker: shapes by total time with their plans, then the latest runs"""
+    return slow_query_log.snapshot(limit)
+
+@router.delete("/slow-queries", status_code=status.HTTP_204_NO_CONTENT)
+def clear_slow_queries():
+    """Start a fresh slow query log in this worker, e.g. after adding an index"""
+    slow_query_log.clear()
+
+@router.delete("/response-cache", status_code=status.HTTP_204_NO_CONTENT)
+def clear_response_cache():
+    """Drop every cached response; with the memory backend only this worker's (entries are otherwise invalidated by writes and TTL)"""
+    response_cache.clear()
@@ -1,7 +1,10 @@
 # attendance_routes/holidays.py
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
 from typing import List
+from datetime import datetime, timedelta
+import calendar
 import schemas
 from models import AttendanceRecord, User
 from auth import get_current_user_with_roles, get_db
@@ -42,9 +45,6 @@ def set_day_status(
     This will mark all students as having the specified status for that date.
     This operation is transactional.
     """
-    from datetime import datetime
-    from sqlalchemy.exc import SQLAlchemyError
-
     date_str = day_data.get("date")
     status_value = day_data.get("status")
     
@@ -122,8 +122,6 @@ def auto_mark_holidays(
 	Automatically mark Sundays and 1st & 3rd Saturdays as holidays for all students
 	Expected input: {"year": 2025, "month": 1}
 	"""
-	from datetime import datetime, timedelta
-	import calendar
 	try:
 		year = month_year_data.get("year")
 		month = month_year_data.get("month")
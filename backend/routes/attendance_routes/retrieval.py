@@ -1,11 +1,15 @@
 # attendance_routes/retrieval.py
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func
+from sqlalchemy.orm import Session
 from typing import List, Optional
 import schemas
+import serializers
 from models import AttendanceRecord, User
 from auth import get_current_user, get_db, get_current_user_with_roles
 from logging_config import logger
+from response_cache import cached_response
+from single_flight import SingleFlight
 from datetime import datetime
 
 router = APIRouter(prefix="/attendance", tags=["attendance"])
@@ -34,16 +38,13 @@ def get_student_attendance(
             detail="Student not found"
         )
     
-    records = db.query(AttendanceRecord).options(
-        selectinload(AttendanceRecord.student),
-        selectinload(AttendanceRecord.marker)
-    ).filter(
+    records = db.query(AttendanceRecord).filter(
         AttendanceRecord.student_id == student_id
     ).order_by(
         AttendanceRecord.date.desc()
     ).offset(skip).limit(limit).all()
     
-    return records
+    return serializers.json_list(serializers.ATTENDANCE_RECORDS, records)
 
 @router.get("/me", response_model=List[schemas.AttendanceRecordOut])
 def get_my_attendance(
@@ -51,48 +52,27 @@ def get_my_attendance(
     db: Session = Depends(get_db)
 ):
     """Get attendance records for the current logged-in student"""
-    records = db.query(AttendanceRecord).options(
-        selectinload(AttendanceRecord.student),
-        selectinload(AttendanceRecord.marker)
-    ).filter(
+    records = db.query(AttendanceRecord).filter(
         AttendanceRecord.student_id == current_user.id
     ).order_by(
         AttendanceRecord.date.desc()
     ).all()
 
-    return records
+    return serializers.json_list(serializers.ATTENDANCE_RECORDS, records)
 
-@router.get("/me/percentage")
-def get_my_attendance_percentage(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Get attendance percentage for the current logged-in student"""
-    records = db.query(AttendanceRecord).filter(
-        AttendanceRecord.student_id == current_user.id
-    ).all()
+# Concurrent requests from the same student (app start, pull-to-refresh, retries) share one computation
+percentage_flight = SingleFlight("attendance_percentage")
 
-    if not records:
-        return {
-            "percentage": 0.0,
-            "present_days": 0,
-            "total_days": 0
-        }
+def _attendance_percentage(db: Session, student_id: str) -> dict:
+    counts = db.query(AttendanceRecord.status, func.count()).filter(
+        AttendanceRecord.student_id == student_id
+    ).group_by(AttendanceRecord.status).all()
 
     # Exclude holidays from calculation
-    non_holiday_records = [r for r in records if r.status.lower() != 'holiday']
-
-    if not non_holiday_records:
-        return {
-            "percentage": 0.0,
-            "present_days": 0,
-            "total_days": 0
-        }
-
-    total_days = len(non_holiday_records)
+    total_days = sum(count for status_, count in counts if status_.lower() != 'holiday')
     # Count both 'present' and 'on_duty'/'on-duty' as present
-    present_days = sum(1 for r in non_holiday_records
-                      if r.status.lower() in ['present', 'on_duty', 'on-duty'])
+    present_days = sum(count for status_, count in counts
+                      if status_.lower() in ['present', 'on_duty', 'on-duty'])
 
     # Calculate percentage (0-100 range, not 0-1)
     percentage = (present_days * 100.0 / total_days) if total_days > 0 else 0.0
@@ -103,22 +83,30 @@ def get_my_attendance_percentage(
         "total_days": total_days
     }
 
+@router.get("/me/percentage")
+def get_my_attendance_percentage(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get attendance percentage for the current logged-in student"""
+    result, _ = percentage_flight.do(current_user.id, lambda: _attendance_percentage(db, current_user.id))
+    return result
+
 @router.get("/", response_model=List[schemas.AttendanceRecordOut])
+@cached_response(tables=["attendance_records"])
 def get_all_attendance_records(
 	skip: int = Query(0, ge=0, description="Number of records to skip"),
 	limit: int = Query(100, ge=1, le=500, description="Max records to return"),
 	current_user: User = Depends(get_current_user_with_roles(["admin", "advisor", "attendance_incharge"])),
 	db: Session = Depends(get_db)
 ):
-	records = db.query(AttendanceRecord).options(
-        selectinload(AttendanceRecord.student),
-        selectinload(AttendanceRecord.marker)
-    ).order_by(
+	records = db.query(AttendanceRecord).order_by(
         AttendanceRecord.date.desc()
     ).offset(skip).limit(limit).all()
-	return records
+	return serializers.json_list(serializers.ATTENDANCE_RECORDS, records)
 
 @router.get("/roster")
+@cached_response(tables=["users", "attendance_records"], coalesce=True)
 def get_attendance_roster(
     date: str = Query(..., description="Date in YYYY-MM-DD format"),
     current_user: User = Depends(get_current_user_with_roles(["admin", "advisor", "attendance_incharge"])),
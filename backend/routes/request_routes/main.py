@@ -1,19 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, selectinload
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import func, and_, or_, exists, type_coerce, String
+from sqlalchemy.orm import Session, selectinload, defer
+from typing import List, Optional
 import schemas
-from models import LeaveRequest, User, AttendanceRecord
+from models import LeaveRequest, ArchivedLeaveRequest, User, AttendanceRecord, ExportCatalog, request_advisors
+from database import SessionLocal, upsert_insert
+import archiver
+import request_events
+from advisor_routing import advisor_router, pending_counts
+from leave_search import search_query
+import retention
+from static_files import write_precompressed
+import serializers
 from auth import (
     get_current_user, get_db,
     get_current_user_with_roles,
-    require_student_data_access, require_roles
+    require_student_data_access, require_roles,
+    security, user_from_token, check_role
 )
 import os
 import json
 import base64
-from datetime import datetime
+import uuid
+import asyncio
+import heapq
+from datetime import date, datetime, timedelta
 
 router = APIRouter(prefix="/requests", tags=["leave_requests"])
+# Included without the app's get_current_user dependency: that (and require_roles)
+# holds a pooled connection via get_db until the response ends, i.e. for as long
+# as a stream stays open. Must be included before router, whose /{request_id}
+# would otherwise match /requests/stream.
+stream_router = APIRouter(prefix="/requests", tags=["leave_requests"])
 
 # Ensure archive directory exists
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
@@ -21,33 +42,191 @@ STATIC_DIR = os.path.join(BASE_DIR, 'static')
 ARCHIVE_DIR = os.path.join(STATIC_DIR, 'leave_requests')
 os.makedirs(ARCHIVE_DIR, exist_ok=True)
 
-def _serialize_request(req: LeaveRequest) -> dict:
-    # Convert binary image data back to Base64 for JSON serialization
-    image_data_str = None
-    if req.image_data:
-        try:
-            image_data_str = base64.b64encode(req.image_data).decode('utf-8')
-        except Exception:
-            image_data_str = None
-
-    return {
-        "id": req.id,
+def _export_location(request_id: str):
+    """Return (file path, public URL) for an export, sharded by the first two id characters"""
+    shard = request_id[:2]
+    file_path = os.path.join(ARCHIVE_DIR, shard, f"{request_id}.json")
+    return file_path, f"/static/leave_requests/{shard}/{request_id}.json"
+
+def _export_request_to_file(db: Session, req: LeaveRequest) -> ExportCatalog:
+    """Write the export file for ``req`` and record it in the export catalog"""
+    file_path, url = _export_location(req.id)
+    exported_at = datetime.utcnow()
+    data = archiver.serialize_request(req)
+    data["exported_at"] = exported_at.isoformat() + 'Z'
+    content = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as f:
+        f.write(content)
+    # Served from the .br/.gz variants by CachedStaticFiles
+    write_precompressed(file_path, content)
+    # Rewrites get a new URL, so clients may cache each one for STATIC_MAX_AGE
+    url = f"{url}?v={int(exported_at.timestamp() * 1000)}"
+
+    entry = {
+        "request_id": req.id,
         "student_id": req.student_id,
-        "start_date": req.start_date.isoformat() if req.start_date else None,
-        "end_date": req.end_date.isoformat() if req.end_date else None,
-        "reason": req.reason,
         "status": req.status,
-        "image_data": image_data_str,  # Base64 string for JSON compatibility
-        "created_at": req.created_at.isoformat() if req.created_at else None,
-        "exported_at": datetime.utcnow().isoformat() + 'Z',
+        "start_date": req.start_date,
+        "end_date": req.end_date,
+        "url": url,
+        "exported_at": exported_at,
     }
+    stmt = upsert_insert(ExportCatalog.__table__).values(**entry)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ExportCatalog.request_id],
+        set_={key: stmt.excluded[key] for key in entry if key != "request_id"}
+    )
+    db.execute(stmt)
+    db.commit()
+    return db.query(ExportCatalog).filter(ExportCatalog.request_id == req.id).one()
+
+def _query_exports(
+    db: Session,
+    student_id: Optional[str],
+    status_filter: Optional[str],
+    from_date: Optional[date],
+    to_date: Optional[date],
+    skip: int,
+    limit: int,
+) -> List[ExportCatalog]:
+    query = db.query(ExportCatalog)
+    if student_id:
+        query = query.filter(ExportCatalog.student_id == student_id)
+    if status_filter:
+        query = query.filter(ExportCatalog.status == status_filter)
+    # Date range matches any leave overlapping [from_date, to_date]
+    if from_date:
+        query = query.filter(ExportCatalog.end_date >= from_date)
+    if to_date:
+        query = query.filter(ExportCatalog.start_date <= to_date)
+    return query.order_by(
+        ExportCatalog.exported_at.desc(), ExportCatalog.request_id
+    ).offset(skip).limit(limit).all()
+
+def _mark_leave_on_duty(db: Session, req: LeaveRequest, marked_by: str) -> int:
+    """Reflect an approved leave as On-Duty attendance across its date range.
+
+    Known holidays (dates already marked "Holiday") are skipped, and every
+    remaining day is written with a single INSERT ... ON CONFLICT upsert
+    against the (student_id, date) unique index. Returns the number of days written.
+    """
+    holidays = {
+        row[0] for row in db.query(AttendanceRecord.date).filter(
+            AttendanceRecord.date >= req.start_date,
+            AttendanceRecord.date <= req.end_date,
+            func.lower(AttendanceRecord.status) == "holiday"
+        ).distinct()
+    }
+
+    days = (req.end_date - req.start_date).days + 1
+    rows = []
+    for offset in range(days):
+        day = req.start_date + timedelta(days=offset)
+        if day in holidays:
+            continue
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "student_id": req.student_id,
+            "date": day,
+            "status": "On-Duty",
+            "marked_by": marked_by,
+        })
+    if not rows:
+        return 0
+
+    stmt = upsert_insert(AttendanceRecord.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AttendanceRecord.student_id, AttendanceRecord.date],
+        set_={"status": stmt.excluded.status, "marked_by": stmt.excluded.marked_by}
+    )
+    db.execute(stmt)
+    return len(rows)
 
-def _archive_request_to_file(req: LeaveRequest) -> str:
-    data = _serialize_request(req)
-    file_path = os.path.join(ARCHIVE_DIR, f"{req.id}.json")
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    return file_path
+def _action_response(req: LeaveRequest, advisor_ids: Optional[List[str]] = None) -> schemas.LeaveRequestActionResponse:
+    # Response without image_data to avoid serialization issues
+    if advisor_ids is None:
+        advisor_ids = [advisor.id for advisor in req.assigned_advisors]
+    return schemas.LeaveRequestActionResponse(
+        id=req.id,
+        student_id=req.student_id,
+        start_date=req.start_date,
+        end_date=req.end_date,
+        reason=req.reason,
+        status=req.status,
+        advisor_ids=advisor_ids,
+        approved_by=req.approved_by,
+        created_at=req.created_at
+    )
+
+def _find_overlapping_requests(
+    db: Session, student_id: str, start_date: date, end_date: date, exclude_id: Optional[str] = None
+) -> List[LeaveRequest]:
+    """Pending or approved requests of ``student_id`` that share at least one day with the range"""
+    # Served by idx_leave_request_student_dates
+    query = db.query(LeaveRequest).filter(
+        LeaveRequest.student_id == student_id,
+        LeaveRequest.start_date <= end_date,
+        LeaveRequest.end_date >= start_date,
+        LeaveRequest.status.in_(["pending", "approved"])
+    )
+    if exclude_id:
+        query = query.filter(LeaveRequest.id != exclude_id)
+    return query.order_by(LeaveRequest.start_date).all()
+
+def _record_event(db: Session, event_type: str, req: LeaveRequest, advisor_ids: Optional[List[str]] = None) -> None:
+    # For advisor dashboards streaming /requests/stream, committed with the change
+    response = _action_response(req, advisor_ids)
+    request_events.enqueue(db, event_type, response.model_dump(mode="json"), response.advisor_ids or [])
+
+# Columns of LeaveRequestOut, selected without building ORM objects
+LEAVE_REQUEST_OUT_COLUMNS = (
+    LeaveRequest.id, LeaveRequest.student_id, LeaveRequest.start_date, LeaveRequest.end_date,
+    LeaveRequest.reason, LeaveRequest.status, LeaveRequest.approved_by, LeaveRequest.created_at,
+    LeaveRequest.image_data,
+)
+
+def _leave_request_rows(query) -> List[dict]:
+    """Run a LeaveRequest query as plain rows shaped like LeaveRequestOut.
+
+    Loading ORM objects plus their assigned_advisors dominated the list
+    endpoints; plain rows and one query on request_advisors are much cheaper.
+    """
+    rows = [row._asdict() for row in query.with_entities(*LEAVE_REQUEST_OUT_COLUMNS)]
+    advisor_ids = {}
+    request_ids = [row["id"] for row in rows]
+    for offset in range(0, len(request_ids), 500):
+        for request_id, advisor_id in query.session.query(
+            request_advisors.c.request_id, request_advisors.c.advisor_id
+        ).filter(request_advisors.c.request_id.in_(request_ids[offset:offset + 500])):
+            advisor_ids.setdefault(request_id, []).append(advisor_id)
+    for row in rows:
+        row["advisor_ids"] = advisor_ids.get(row["id"], [])
+    return rows
+
+def _find_request(db: Session, request_id: str):
+    """Look a request up in leave_requests, then in the retention archive"""
+    req = db.query(LeaveRequest).options(
+        selectinload(LeaveRequest.assigned_advisors)
+    ).filter(LeaveRequest.id == request_id).first()
+    if req is None:
+        req = db.query(ArchivedLeaveRequest).filter(ArchivedLeaveRequest.id == request_id).first()
+    if req is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Request not found")
+    return req
+
+def _assigned_advisor_ids(req) -> List[str]:
+    if isinstance(req, ArchivedLeaveRequest):
+        return req.advisor_id_list
+    return [advisor.id for advisor in req.assigned_advisors]
+
+def _can_view_request(current_user: User, req) -> bool:
+    # Admin/attendance_incharge can view any, advisors their assigned requests, students their own
+    if current_user.role in ["admin", "attendance_incharge"]:
+        return True
+    if current_user.role == "advisor":
+        return current_user.id in _assigned_advisor_ids(req)
+    return current_user.role == "student" and req.student_id == current_user.id
 
 @router.post("/", response_model=schemas.LeaveRequestOut)
 def create_leave_request(
@@ -55,6 +234,12 @@ def create_leave_request(
     current_user: User = Depends(get_current_user_with_roles(["student"])),
     db: Session = Depends(get_db)
 ):
+    if request.end_date < request.start_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_date must be on or after start_date"
+        )
+
     # Handle Base64 image data conversion
     image_bytes = None
     if request.image_data:
@@ -68,6 +253,12 @@ def create_leave_request(
                 detail=f"Invalid image data encoding: {str(e)}"
             )
 
+    # One submission per student at a time: on PostgreSQL lock the student's
+    # row (SQLite ignores FOR UPDATE; there the flush below takes the database
+    # write lock). Either way the overlap check after the flush sees every
+    # request committed before ours, and later ones wait and see ours.
+    db.query(User.id).filter(User.id == current_user.id).with_for_update().scalar()
+
     # Create database record with decoded image bytes
     db_request = LeaveRequest(
         student_id=current_user.id,
@@ -80,27 +271,48 @@ def create_leave_request(
     db.add(db_request)
     db.flush()  # Flush to get the ID before adding relationships
 
-    # Assign advisors if provided, otherwise assign to all advisors
+    overlapping = _find_overlapping_requests(
+        db, current_user.id, request.start_date, request.end_date, exclude_id=db_request.id
+    )
+    if overlapping:
+        conflicting = [
+            {
+                "id": req.id,
+                "start_date": req.start_date.isoformat(),
+                "end_date": req.end_date.isoformat(),
+                "status": req.status,
+            }
+            for req in overlapping
+        ]
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "Leave dates overlap an existing pending or approved request",
+                "conflicting_requests": conflicting,
+            }
+        )
+
+    # Assign advisors if provided, otherwise route by ADVISOR_ROUTING_POLICY
     if request.advisor_ids:
-        advisors = db.query(User).filter(
+        advisor_ids = [row[0] for row in db.query(User.id).filter(
             User.id.in_(request.advisor_ids),
             User.role == "advisor"
-        ).all()
-        db_request.assigned_advisors = advisors
+        )]
     else:
-        # If no advisors specified, assign to all advisors
-        all_advisors = db.query(User).filter(User.role == "advisor").all()
-        db_request.assigned_advisors = all_advisors
-
+        advisor_ids = advisor_router.route(db, current_user)
+    if advisor_ids:
+        db.execute(request_advisors.insert(), [
+            {"request_id": db_request.id, "advisor_id": advisor_id} for advisor_id in advisor_ids
+        ])
+
+    # Archived in the background, committed together with the request
+    archiver.enqueue(db, db_request, "created")
+    _record_event(db, "created", db_request, advisor_ids)
     db.commit()
     db.refresh(db_request)
-
-    # Archive request to file (non-fatal if fails)
-    try:
-        _archive_request_to_file(db_request)
-    except Exception:
-        # Non-fatal - log but don't fail the request
-        pass
+    archiver.archive_worker.notify()
+    request_events.event_hub.notify()
 
     # Manually construct response to handle image_data serialization
     image_data_str = None
@@ -110,8 +322,6 @@ def create_leave_request(
         except Exception:
             pass
 
-    advisor_ids = [advisor.id for advisor in db_request.assigned_advisors]
-
     return schemas.LeaveRequestOut(
         id=db_request.id,
         student_id=db_request.student_id,
@@ -130,51 +340,18 @@ def get_my_requests(
     current_user: User = Depends(get_current_user_with_roles(["student"])),
     db: Session = Depends(get_db)
 ):
-    requests = db.query(LeaveRequest).options(
-        selectinload(LeaveRequest.student),
-        selectinload(LeaveRequest.assigned_advisors)
-    ).filter(
+    query = db.query(LeaveRequest).filter(
         LeaveRequest.student_id == current_user.id
-    ).all()
-
-    # Manually construct response for each request
-    result = []
-    for req in requests:
-        image_data_str = None
-        if req.image_data:
-            try:
-                image_data_str = base64.b64encode(req.image_data).decode('utf-8')
-            except Exception:
-                pass
-
-        advisor_ids = [advisor.id for advisor in req.assigned_advisors]
+    )
 
-        req_data = schemas.LeaveRequestOut(
-            id=req.id,
-            student_id=req.student_id,
-            start_date=req.start_date,
-            end_date=req.end_date,
-            reason=req.reason,
-            status=req.status,
-            advisor_ids=advisor_ids,
-            approved_by=req.approved_by,
-            created_at=req.created_at,
-            image_data=image_data_str
-        )
-        result.append(req_data)
-
-    return result
+    return serializers.json_list(serializers.LEAVE_REQUESTS, _leave_request_rows(query))
 
 @router.get("/pending", response_model=List[schemas.LeaveRequestOut])
 def get_pending_requests(
     current_user: User = Depends(require_roles(["admin", "advisor"])),
     db: Session = Depends(get_db)
 ):
-    # Build base query with eager loading
-    query = db.query(LeaveRequest).options(
-        selectinload(LeaveRequest.student),
-        selectinload(LeaveRequest.assigned_advisors)
-    ).filter(
+    query = db.query(LeaveRequest).filter(
         LeaveRequest.status == "pending"
     )
 
@@ -188,36 +365,174 @@ def get_pending_requests(
             User.id == current_user.id
         )
 
-    requests = query.all()
+    return serializers.json_list(serializers.LEAVE_REQUESTS, _leave_request_rows(query))
 
-    # Manually construct response for each request to handle image_data serialization
-    result = []
-    for req in requests:
-        # Convert image_data bytes to Base64 if present
-        image_data_str = None
-        if req.image_data:
-            try:
-                image_data_str = base64.b64encode(req.image_data).decode('utf-8')
-            except Exception:
-                pass
+def _stream_user(token: str):
+    """(id, role) of an admin or advisor, from a session closed before streaming starts"""
+    db = SessionLocal()
+    try:
+        user = user_from_token(token, db)
+        check_role(user, ["admin", "advisor"])
+        return user.id, user.role
+    finally:
+        db.close()
+
+@stream_router.get("/stream")
+async def stream_request_events(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Server-sent events for the pending queue: created, approved and rejected.
+    Advisors receive events for requests assigned to them, admins receive all.
+    Reconnect with the Last-Event-ID header to resume without missing events;
+    a "reset" event means the client should reload /requests/pending.
+    """
+    user_id, role = await run_in_threadpool(_stream_user, credentials.credentials)
+    subscription = await run_in_threadpool(
+        request_events.event_hub.subscribe,
+        user_id,
+        see_all=role == "admin",
+        last_event_id=request.headers.get("last-event-id"),
+        loop=asyncio.get_running_loop(),
+    )
 
-        advisor_ids = [advisor.id for advisor in req.assigned_advisors]
+    async def event_stream():
+        try:
+            yield b"retry: 3000\n\n"
+            for event in subscription.backlog:
+                yield event.encoded
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield event.encoded
+        finally:
+            request_events.event_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Keep reverse proxies from buffering the stream; CompressionMiddleware
+            # already skips text/event-stream
+            "X-Accel-Buffering": "no",
+        },
+    )
 
-        req_data = schemas.LeaveRequestOut(
-            id=req.id,
-            student_id=req.student_id,
-            start_date=req.start_date,
-            end_date=req.end_date,
-            reason=req.reason,
-            status=req.status,
-            advisor_ids=advisor_ids,
-            approved_by=req.approved_by,
-            created_at=req.created_at,
-            image_data=image_data_str
+@router.get("/search", response_model=List[schemas.LeaveRequestSearchResult])
+def search_requests(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to find in the reason; end a word with * for prefix search"),
+    status_filter: Optional[str] = Query(None, alias="status", description="Only requests with this status"),
+    from_date: Optional[date] = Query(None, description="Only leaves ending on or after this date"),
+    to_date: Optional[date] = Query(None, description="Only leaves starting on or before this date"),
+    department: Optional[str] = Query(None, description="Only students of this department"),
+    skip: int = Query(0, ge=0, description="Number of results to skip"),
+    limit: int = Query(50, ge=1, le=200, description="Max results to return"),
+    current_user: User = Depends(require_roles(["admin"])),
+    db: Session = Depends(get_db)
+):
+    """
+    Full-text search over leave request reasons, best matches first.
+    Results never include image data; use /requests/{id}/image for that.
+    Requests archived by retention.py are not searched.
+    """
+    query = search_query(db, q)
+    if query is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Search query must contain at least one word"
         )
-        result.append(req_data)
 
-    return result
+    if status_filter:
+        query = query.filter(LeaveRequest.status == status_filter)
+    if from_date:
+        query = query.filter(LeaveRequest.end_date >= from_date)
+    if to_date:
+        query = query.filter(LeaveRequest.start_date <= to_date)
+    if department:
+        query = query.join(User, User.id == LeaveRequest.student_id).filter(User.department == department)
+
+    rows = query.options(
+        defer(LeaveRequest.image_data),
+        selectinload(LeaveRequest.assigned_advisors)
+    ).offset(skip).limit(limit).all()
+
+    return [
+        schemas.LeaveRequestSearchResult(**_action_response(req).model_dump(), rank=rank)
+        for req, rank in rows
+    ]
+
+@router.get("/conflicts")
+def get_overlap_conflicts(
+    student_id: Optional[str] = Query(None, description="Only check this student's requests"),
+    limit: int = Query(500, ge=1, le=5000, description="Max overlapping pairs to return"),
+    current_user: User = Depends(require_roles(["admin"])),
+    db: Session = Depends(get_db)
+):
+    """
+    Report every pair of pending/approved requests of the same student whose dates overlap.
+    One sweep over the requests ordered by (student_id, start_date) keeps a min-heap of
+    the ranges still open, so the cost is O(n log n + pairs) instead of comparing every pair.
+    """
+    query = db.query(
+        LeaveRequest.id, LeaveRequest.student_id, LeaveRequest.start_date,
+        LeaveRequest.end_date, LeaveRequest.status
+    ).filter(LeaveRequest.status.in_(["pending", "approved"]))
+    if student_id:
+        query = query.filter(LeaveRequest.student_id == student_id)
+    rows = query.order_by(LeaveRequest.student_id, LeaveRequest.start_date, LeaveRequest.id)
+
+    conflicts = []
+    current_student = None
+    open_ranges = []  # heap of (end_date, id, row) for the current student
+    for row in rows:
+        if row.student_id != current_student:
+            current_student = row.student_id
+            open_ranges = []
+        while open_ranges and open_ranges[0][0] < row.start_date:
+            heapq.heappop(open_ranges)
+        for _, _, other in open_ranges:
+            conflicts.append({
+                "student_id": row.student_id,
+                "overlap_start": row.start_date.isoformat(),
+                "overlap_end": min(row.end_date, other.end_date).isoformat(),
+                "requests": [
+                    {"id": req.id, "start_date": req.start_date.isoformat(),
+                     "end_date": req.end_date.isoformat(), "status": req.status}
+                    for req in (other, row)
+                ],
+            })
+            if len(conflicts) >= limit:
+                return {"count": len(conflicts), "truncated": True, "conflicts": conflicts}
+        heapq.heappush(open_ranges, (row.end_date, row.id, row))
+
+    return {"count": len(conflicts), "truncated": False, "conflicts": conflicts}
+
+@router.get("/queue-metrics")
+def get_queue_metrics(
+    current_user: User = Depends(require_roles(["admin"])),
+    db: Session = Depends(get_db)
+):
+    """Pending queue length per advisor and the active routing policy"""
+    counts = pending_counts(db)
+    names = dict(db.query(User.id, User.name).filter(User.id.in_(list(counts))).all())
+    queues = sorted(
+        ({"advisor_id": advisor_id, "name": names.get(advisor_id), "pending": pending}
+         for advisor_id, pending in counts.items()),
+        key=lambda queue: queue["pending"], reverse=True
+    )
+    total = sum(counts.values())
+    return {
+        "policy": advisor_router.policy,
+        "advisors": queues,
+        "total_pending_assignments": total,
+        "max_queue_length": queues[0]["pending"] if queues else 0,
+        "mean_queue_length": round(total / len(queues), 2) if queues else 0.0,
+    }
 
 @router.post("/{request_id}/approve", response_model=schemas.LeaveRequestActionResponse)
 def approve_request(
@@ -233,41 +548,27 @@ def approve_request(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Request not found"
         )
+    if request.status != "pending":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Request already {request.status}"
+        )
 
     # Update request status
     request.status = "approved"
     request.approved_by = current_user.id
 
-    # When a leave is approved, reflect as On-Duty across the requested date range
-    from datetime import timedelta
     try:
-        current_date = request.start_date
-        while current_date <= request.end_date:
-            existing = db.query(AttendanceRecord).filter(
-                AttendanceRecord.student_id == request.student_id,
-                AttendanceRecord.date == current_date
-            ).first()
-            if existing:
-                existing.status = "On-Duty"
-                existing.marked_by = current_user.id
-            else:
-                db.add(AttendanceRecord(
-                    student_id=request.student_id,
-                    date=current_date,
-                    status="On-Duty",
-                    marked_by=current_user.id,
-                ))
-            current_date += timedelta(days=1)
+        # When a leave is approved, reflect as On-Duty across the requested date range
+        _mark_leave_on_duty(db, request, current_user.id)
+        archiver.enqueue(db, request, "approved")
+        _record_event(db, "approved", request)
 
         # Commit all changes together
         db.commit()
         db.refresh(request)
-
-        # Archive to file
-        try:
-            _archive_request_to_file(request)
-        except Exception:
-            pass
+        archiver.archive_worker.notify()
+        request_events.event_hub.notify()
 
     except Exception as e:
         db.rollback()
@@ -276,19 +577,68 @@ def approve_request(
             detail=f"Failed to approve request: {str(e)}"
         )
 
-    # Return response without image_data to avoid serialization issues
-    advisor_ids = [advisor.id for advisor in request.assigned_advisors]
+    return _action_response(request)
 
-    return schemas.LeaveRequestActionResponse(
-        id=request.id,
-        student_id=request.student_id,
-        start_date=request.start_date,
-        end_date=request.end_date,
-        reason=request.reason,
-        status=request.status,
-        advisor_ids=advisor_ids,
-        approved_by=request.approved_by,
-        created_at=request.created_at
+@router.post("/approve-batch", response_model=schemas.LeaveRequestBatchApproveResponse)
+def approve_requests_batch(
+    batch: schemas.LeaveRequestBatchApprove,
+    current_user: User = Depends(get_current_user_with_roles(["admin", "advisor"])),
+    db: Session = Depends(get_db)
+):
+    """
+    Approve many pending leave requests in a single transaction.
+    Each requested ID gets its own result: approved, skipped (no longer pending)
+    or not_found. Either every approval is committed or none is.
+    """
+    request_ids = list(dict.fromkeys(batch.request_ids))
+    requests = db.query(LeaveRequest).options(
+        selectinload(LeaveRequest.assigned_advisors)
+    ).filter(LeaveRequest.id.in_(request_ids)).all()
+    requests_by_id = {req.id: req for req in requests}
+
+    approved = []
+    results = {}
+    try:
+        for request_id in request_ids:
+            request = requests_by_id.get(request_id)
+            if request is None:
+                results[request_id] = schemas.LeaveRequestBatchItemResult(
+                    request_id=request_id, result="not_found", detail="Request not found"
+                )
+                continue
+            if request.status != "pending":
+                results[request_id] = schemas.LeaveRequestBatchItemResult(
+                    request_id=request_id, result="skipped", detail=f"Request already {request.status}"
+                )
+                continue
+
+            request.status = "approved"
+            request.approved_by = current_user.id
+            _mark_leave_on_duty(db, request, current_user.id)
+            archiver.enqueue(db, request, "approved")
+            _record_event(db, "approved", request)
+            approved.append(request)
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to approve requests: {str(e)}"
+        )
+
+    if approved:
+        archiver.archive_worker.notify()
+        request_events.event_hub.notify()
+    for request in approved:
+        db.refresh(request)
+        results[request.id] = schemas.LeaveRequestBatchItemResult(
+            request_id=request.id, result="approved", request=_action_response(request)
+        )
+
+    return schemas.LeaveRequestBatchApproveResponse(
+        approved=len(approved),
+        results=[results[request_id] for request_id in request_ids]
     )
 
 @router.post("/{request_id}/reject", response_model=schemas.LeaveRequestActionResponse)
@@ -309,14 +659,12 @@ def reject_request(
     try:
         request.status = "rejected"
         request.approved_by = current_user.id
+        archiver.enqueue(db, request, "rejected")
+        _record_event(db, "rejected", request)
         db.commit()
         db.refresh(request)
-
-        # Archive to file
-        try:
-            _archive_request_to_file(request)
-        except Exception:
-            pass
+        archiver.archive_worker.notify()
+        request_events.event_hub.notify()
 
     except Exception as e:
         db.rollback()
@@ -325,113 +673,128 @@ def reject_request(
             detail=f"Failed to reject request: {str(e)}"
         )
 
-    # Return response without image_data to avoid serialization issues
-    advisor_ids = [advisor.id for advisor in request.assigned_advisors]
-
-    return schemas.LeaveRequestActionResponse(
-        id=request.id,
-        student_id=request.student_id,
-        start_date=request.start_date,
-        end_date=request.end_date,
-        reason=request.reason,
-        status=request.status,
-        advisor_ids=advisor_ids,
-        approved_by=request.approved_by,
-        created_at=request.created_at
-    )
+    return _action_response(request)
 
 @router.get("/", response_model=List[schemas.LeaveRequestOut])
 def get_all_requests(
     current_user: User = Depends(require_student_data_access),
     db: Session = Depends(get_db)
 ):
-    requests = db.query(LeaveRequest).options(
-        selectinload(LeaveRequest.student),
-        selectinload(LeaveRequest.assigned_advisors)
-    ).all()
-
-    # Manually construct response for each request
-    result = []
-    for req in requests:
-        image_data_str = None
-        if req.image_data:
-            try:
-                image_data_str = base64.b64encode(req.image_data).decode('utf-8')
-            except Exception:
-                pass
-
-        advisor_ids = [advisor.id for advisor in req.assigned_advisors]
+    return serializers.json_list(serializers.LEAVE_REQUESTS, _leave_request_rows(db.query(LeaveRequest)))
+
+HISTORY_STATUSES = ["approved", "rejected"]
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+def _encode_history_cursor(db: Session, request_id: str) -> str:
+    # Use created_at exactly as the database stores it: SQLite compares the
+    # text, and a re-formatted datetime would not sort against it correctly
+    created_at = db.query(type_coerce(LeaveRequest.created_at, String)).filter(
+        LeaveRequest.id == request_id
+    ).scalar()
+    raw = f"{created_at}|{request_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def _decode_history_cursor(cursor: str):
+    try:
+        created_at, request_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        return created_at, request_id
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
 
-        req_data = schemas.LeaveRequestOut(
-            id=req.id,
-            student_id=req.student_id,
-            start_date=req.start_date,
-            end_date=req.end_date,
-            reason=req.reason,
-            status=req.status,
-            advisor_ids=advisor_ids,
-            approved_by=req.approved_by,
-            created_at=req.created_at,
-            image_data=image_data_str
+def _history_query(
+    db: Session,
+    current_user: User,
+    status_filter: Optional[str] = None,
+    advisor_id: Optional[str] = None,
+):
+    statuses = [status_filter] if status_filter else HISTORY_STATUSES
+    if any(value not in HISTORY_STATUSES for value in statuses):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"status must be one of: {', '.join(HISTORY_STATUSES)}"
         )
-        result.append(req_data)
+    query = db.query(LeaveRequest).filter(LeaveRequest.status.in_(statuses))
 
-    return result
+    # Advisors only ever see requests assigned to them
+    if current_user.role == "advisor":
+        advisor_id = current_user.id
+    if advisor_id:
+        query = query.filter(exists().where(
+            request_advisors.c.request_id == LeaveRequest.id,
+            request_advisors.c.advisor_id == advisor_id
+        ))
+    return query
 
 @router.get("/history", response_model=List[schemas.LeaveRequestOut])
 def get_request_history(
+    status_filter: Optional[str] = Query(None, alias="status", description="approved or rejected"),
+    from_date: Optional[date] = Query(None, description="Only leaves ending on or after this date"),
+    to_date: Optional[date] = Query(None, description="Only leaves starting on or before this date"),
+    student_id: Optional[str] = Query(None, description="Only this student's requests"),
+    approved_by: Optional[str] = Query(None, description="Only requests approved/rejected by this user"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE, description="Max requests to return"),
     current_user: User = Depends(require_roles(["admin", "advisor"])),
     db: Session = Depends(get_db)
 ):
     """
-    Get all processed (approved/rejected) leave requests.
+    Get processed (approved/rejected) leave requests, newest first.
     For advisors: returns only their assigned requests.
     For admins: returns all processed requests.
-    """
-    # Build base query with eager loading
-    query = db.query(LeaveRequest).options(
-        selectinload(LeaveRequest.student),
-        selectinload(LeaveRequest.assigned_advisors)
-    ).filter(
-        LeaveRequest.status.in_(["approved", "rejected"])
-    )
 
-    # If advisor, filter to only show requests assigned to them
-    if current_user.role == "advisor":
-        query = query.join(
-            LeaveRequest.assigned_advisors
-        ).filter(
-            User.id == current_user.id
-        )
-
-    requests = query.all()
-
-    # Manually construct response for each request
-    result = []
-    for req in requests:
-        image_data_str = None
-        if req.image_data:
-            try:
-                image_data_str = base64.b64encode(req.image_data).decode('utf-8')
-            except Exception:
-                pass
-
-        advisor_ids = [advisor.id for advisor in req.assigned_advisors]
-
-        req_data = schemas.LeaveRequestOut(
-            id=req.id,
-            student_id=req.student_id,
-            start_date=req.start_date,
-            end_date=req.end_date,
-            reason=req.reason,
-            status=req.status,
-            advisor_ids=advisor_ids,
-            approved_by=req.approved_by,
-            created_at=req.created_at,
-            image_data=image_data_str
-        )
-        result.append(req_data)
+    Pages are keyset-paginated on (created_at, id), served by
+    idx_leave_request_status_created. When more results exist, the
+    X-Next-Cursor response header holds the cursor for the next page;
+    callers that want the whole history follow it until it is absent.
+    Requests archived by retention.py are not included; look them up by id.
+    """
+    query = _history_query(db, current_user, status_filter)
+    if from_date:
+        query = query.filter(LeaveRequest.end_date >= from_date)
+    if to_date:
+        query = query.filter(LeaveRequest.start_date <= to_date)
+    if student_id:
+        query = query.filter(LeaveRequest.student_id == student_id)
+    if approved_by:
+        query = query.filter(LeaveRequest.approved_by == approved_by)
+    if cursor:
+        cursor_created_at, cursor_id = _decode_history_cursor(cursor)
+        cursor_created_at = type_coerce(cursor_created_at, String)
+        query = query.filter(or_(
+            LeaveRequest.created_at < cursor_created_at,
+            and_(LeaveRequest.created_at == cursor_created_at, LeaveRequest.id < cursor_id)
+        ))
+
+    query = query.order_by(LeaveRequest.created_at.desc(), LeaveRequest.id.desc())
+    requests = _leave_request_rows(query.limit(limit + 1))
+
+    headers = {}
+    if len(requests) > limit:
+        requests = requests[:limit]
+        headers["X-Next-Cursor"] = _encode_history_cursor(db, requests[-1]["id"])
+
+    return serializers.json_list(serializers.LEAVE_REQUESTS, requests, headers=headers)
+
+@router.get("/history/count")
+def get_request_history_count(
+    advisor_id: Optional[str] = Query(None, description="Admins: count only this advisor's requests"),
+    current_user: User = Depends(require_roles(["admin", "advisor"])),
+    db: Session = Depends(get_db)
+):
+    """Number of processed requests per status, for the caller (advisors) or any advisor (admins).
 
+    A COUNT over the status index, plus one request_advisors probe per processed
+    request when scoped to an advisor: index-only, but linear in the history.
+    """
+    counts = dict(
+        _history_query(db, current_user, advisor_id=advisor_id)
+        .with_entities(LeaveRequest.status, func.count())
+        .group_by(LeaveRequest.status)
+        .all()
+    )
+    result = {value: counts.get(value, 0) for value in HISTORY_STATUSES}
+    result["total"] = sum(result.values())
     return result
 
 @router.get("/{request_id}/image")
@@ -444,45 +807,18 @@ def get_request_image(
     Get the image data for a specific leave request.
     Returns the raw image bytes as a response.
     """
-    from fastapi.responses import Response
-
-    request = db.query(LeaveRequest).filter(LeaveRequest.id == request_id).first()
-    if not request:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Request not found"
-        )
-
-    # Access control:
-    # - Admin/attendance_incharge can view any
-    # - Advisors can view requests assigned to them
-    # - Students can view their own
-    allowed = False
-
-    if current_user.role in ["admin", "attendance_incharge"]:
-        allowed = True
-    elif current_user.role == "advisor":
-        # Check if this advisor is assigned to this request
-        # Need to load the assigned_advisors relationship
-        from sqlalchemy.orm import selectinload
-        request = db.query(LeaveRequest).options(
-            selectinload(LeaveRequest.assigned_advisors)
-        ).filter(LeaveRequest.id == request_id).first()
-
-        # Check if current advisor is in the assigned list
-        if any(advisor.id == current_user.id for advisor in request.assigned_advisors):
-            allowed = True
-    elif current_user.role == "student":
-        if request.student_id == current_user.id:
-            allowed = True
-
-    if not allowed:
+    request = _find_request(db, request_id)
+    if not _can_view_request(current_user, request):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to view this image"
         )
 
-    if not request.image_data:
+    if isinstance(request, ArchivedLeaveRequest):
+        image_data = retention.read_image(request)
+    else:
+        image_data = request.image_data
+    if not image_data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No image attached to this request"
@@ -490,7 +826,7 @@ def get_request_image(
 
     # Return raw image bytes
     return Response(
-        content=request.image_data,
+        content=image_data,
         media_type="image/jpeg"
     )
 
@@ -500,55 +836,59 @@ def export_request_file(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    req = db.query(LeaveRequest).filter(LeaveRequest.id == request_id).first()
-    if not req:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Request not found")
+    req = _find_request(db, request_id)
 
     # Access control: admin/advisor can view any; student only own
     if current_user.role not in ["admin", "advisor"] and req.student_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
 
-    file_path = os.path.join(ARCHIVE_DIR, f"{request_id}.json")
-    # If missing, regenerate
-    if not os.path.exists(file_path):
+    # Exports are written on demand and rewritten only when the status changed
+    entry = db.query(ExportCatalog).filter(ExportCatalog.request_id == request_id).first()
+    if not entry or entry.status != req.status or not os.path.exists(_export_location(request_id)[0]):
         try:
-            _archive_request_to_file(req)
+            entry = _export_request_to_file(db, req)
         except Exception:
+            db.rollback()
             raise HTTPException(status_code=500, detail="Could not generate export")
 
     # Return a JSON with public URL (served under /static)
-    public_url = f"/static/leave_requests/{request_id}.json"
-    return {"request_id": request_id, "url": public_url}
+    return {"request_id": request_id, "url": entry.url}
 
-@router.get("/export-list")
+@router.get("/export-list", response_model=List[schemas.ExportEntry])
 def export_list(
+    student_id: Optional[str] = Query(None, description="Only exports for this student"),
+    status_filter: Optional[str] = Query(None, alias="status", description="Only exports with this request status"),
+    from_date: Optional[date] = Query(None, description="Only leaves ending on or after this date"),
+    to_date: Optional[date] = Query(None, description="Only leaves starting on or before this date"),
+    skip: int = Query(0, ge=0, description="Number of exports to skip"),
+    limit: int = Query(100, ge=1, le=500, description="Max exports to return"),
     current_user: User = Depends(require_roles(["admin", "advisor"])),
     db: Session = Depends(get_db)
 ):
-    entries = []
-    for fname in os.listdir(ARCHIVE_DIR):
-        if fname.endswith('.json'):
-            rid = fname[:-5]
-            entries.append({
-                "request_id": rid,
-                "url": f"/static/leave_requests/{fname}",
-            })
-    return entries
+    return _query_exports(db, student_id, status_filter, from_date, to_date, skip, limit)
 
-@router.get("/export-list/me")
+@router.get("/export-list/me", response_model=List[schemas.ExportEntry])
 def export_list_me(
+    status_filter: Optional[str] = Query(None, alias="status", description="Only exports with this request status"),
+    from_date: Optional[date] = Query(None, description="Only leaves ending on or after this date"),
+    to_date: Optional[date] = Query(None, description="Only leaves starting on or before this date"),
+    skip: int = Query(0, ge=0, description="Number of exports to skip"),
+    limit: int = Query(100, ge=1, le=500, description="Max exports to return"),
     current_user: User = Depends(get_current_user_with_roles(["student"])),
     db: Session = Depends(get_db)
 ):
     # Return exports only for current student
-    results = db.query(LeaveRequest.id).filter(LeaveRequest.student_id == current_user.id).all()
-    ids = {row[0] for row in results}
-    entries = []
-    for rid in ids:
-        path = os.path.join(ARCHIVE_DIR, f"{rid}.json")
-        if os.path.exists(path):
-            entries.append({
-                "request_id": rid,
-                "url": f"/static/leave_requests/{rid}.json",
-            })
-    return entries
+    return _query_exports(db, current_user.id, status_filter, from_date, to_date, skip, limit)
+
+# Declared last so that /requests/me, /requests/pending, ... take precedence
+@router.get("/{request_id}", response_model=schemas.LeaveRequestActionResponse)
+def get_request(
+    request_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get one leave request without its image, including requests moved to the archive"""
+    req = _find_request(db, request_id)
+    if not _can_view_request(current_user, req):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    return _action_response(req, _assigned_advisor_ids(req))
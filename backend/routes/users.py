@@ -1,21 +1,70 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, UploadFile, File, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from typing import List
+from typing import List, Optional, Tuple
+from functools import lru_cache
+from pydantic import ConfigDict, TypeAdapter, create_model
 import schemas
-from models import User
+from models import AttendanceRecord, User
 from auth import (
     get_current_user, get_db, get_password_hash, verify_password,
     require_admin, require_student_data_access,
     get_current_user_with_roles, require_student
 )
 import uuid
-import os
-from datetime import datetime
 from logging_config import logger
+from advisor_routing import advisor_directory
+import user_sync
+from user_search import user_index
+import profile_pictures
+import serializers
+from metrics import record_cache
+from response_cache import cached_response
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+# UserOut fields that are real columns and can be selected on their own
+SPARSE_USER_FIELDS = [name for name in schemas.UserOut.model_fields if name in User.__table__.columns]
+FIELDS_DESCRIPTION = f"Comma-separated subset of: {', '.join(SPARSE_USER_FIELDS)} (id is always included)"
+
+def _parse_user_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(SPARSE_USER_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}. {FIELDS_DESCRIPTION}"
+        )
+    requested.add("id")
+    # Canonical order, so equal sets share one cached serializer
+    return tuple(name for name in SPARSE_USER_FIELDS if name in requested)
+
+@lru_cache(maxsize=64)
+def _user_list_serializer(fields: Tuple[str, ...]) -> TypeAdapter:
+    model = create_model(
+        "UserOut_" + "_".join(fields),
+        __config__=ConfigDict(from_attributes=True),
+        **{name: (schemas.UserOut.model_fields[name].annotation, ...) for name in fields}
+    )
+    return TypeAdapter(List[model])
+
+def _list_users(db: Session, fields: Optional[str], *criteria, skip: int = 0, limit: Optional[int] = None):
+    """Query users matching ``criteria``; with ``fields``, select and serialize only those columns"""
+    selected = _parse_user_fields(fields)
+    if selected is None:
+        query = db.query(User)
+    else:
+        query = db.query(*[getattr(User, name) for name in selected])
+    query = query.filter(*criteria).offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = query.all()
+    if selected is None:
+        return serializers.json_list(serializers.USERS, rows)
+    return serializers.json_list(_user_list_serializer(selected), rows)
+
 @router.post("/", response_model=schemas.UserOut)
 def create_user(
     user: schemas.UserCreate,
@@ -53,6 +102,8 @@ def create_user(
         db.add(db_user)
         db.commit()
         db.refresh(db_user)
+        advisor_directory.invalidate()
+        user_index.upsert(db_user)
         
         return db_user
         
@@ -74,11 +125,11 @@ def create_user(
 def get_users(
     skip: int = Query(0, ge=0, description="Number of users to skip"),
     limit: int = Query(100, ge=1, le=500, description="Max users to return"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     current_user: User = Depends(get_current_user_with_roles(["admin", "advisor", "attendance_incharge"])),
     db: Session = Depends(get_db)
 ):
-    users = db.query(User).offset(skip).limit(limit).all()
-    return users
+    return _list_users(db, fields, skip=skip, limit=limit)
 
 @router.get("/me", response_model=schemas.UserOut)
 def get_current_user_info(current_user: User = Depends(get_current_user)):
@@ -88,37 +139,78 @@ def get_current_user_info(current_user: User = Depends(get_current_user)):
 def get_students(
     skip: int = Query(0, ge=0, description="Number of students to skip"),
     limit: int = Query(100, ge=1, le=500, description="Max students to return"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     current_user: User = Depends(get_current_user_with_roles(["admin", "advisor", "attendance_incharge"])),
     db: Session = Depends(get_db)
 ):
-    students = db.query(User).filter(User.role == "student").offset(skip).limit(limit).all()
-    return students
+    return _list_users(db, fields, User.role == "student", skip=skip, limit=limit)
 
 @router.get("/advisors", response_model=List[schemas.UserOut])
+@cached_response(tables=["users"], scope="public")
 def get_advisors(
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get list of all advisors for assignment/selection"""
-    advisors = db.query(User).filter(User.role == "advisor").all()
-    return advisors
+    return _list_users(db, fields, User.role == "advisor")
 
 @router.get("/lookup")
+@cached_response(tables=["users"], scope="public", coalesce=True)
 def get_user_lookup(
+    request: Request,
+    response: Response,
+    since: Optional[int] = Query(None, ge=0, description="X-Users-Version the client already has"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Get a map of user IDs to user names for efficient name resolution.
     Returns: {user_id: user_name, ...}
+
+    The X-Users-Version header carries the directory version of the map, and
+    the ETag lets clients revalidate it with If-None-Match (304 when unchanged).
+    With ``since``, returns only the changes after that version instead:
+    {"version": n, "changed": {user_id: user_name}, "deleted": [user_id], "reset": false}.
+    "reset" is true when ``since`` is unknown to the server (e.g. after a
+    database reset); "changed" then holds the whole map and the cache should be replaced.
+    """
+    # Read the version first: changes committed after it are resent next time
+    version = user_sync.current_version(db)
+    headers = {"ETag": f'"users-{version}"', "X-Users-Version": str(version)}
+
+    if since is not None:
+        response.headers.update(headers)
+        if since > version:
+            record_cache("users_lookup", hit=False)
+            return {"version": version, "changed": user_sync.lookup_map(db), "deleted": [], "reset": True}
+        record_cache("users_lookup", hit=True)
+        changed, deleted = user_sync.lookup_delta(db, since)
+        return {"version": version, "changed": changed, "deleted": deleted, "reset": False}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        record_cache("users_lookup", hit=True)
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    record_cache("users_lookup", hit=False)
+    response.headers.update(headers)
+    return user_sync.lookup_map(db)
+
+@router.get("/search", response_model=List[schemas.UserSearchResult])
+def search_users(
+    q: str = Query(..., min_length=1, max_length=100, description="Prefix of a name, username or roll number"),
+    role: Optional[str] = Query(None, description="Only users with this role, e.g. student"),
+    limit: int = Query(20, ge=1, le=100, description="Max users to return"),
+    current_user: User = Depends(get_current_user_with_roles(["admin", "advisor", "attendance_incharge"])),
+    db: Session = Depends(get_db)
+):
     """
-    users = db.query(User.id, User.name, User.username).all()
-    lookup = {}
-    for user_id, name, username in users:
-        # Use name if available, otherwise fall back to username
-        display_name = name if name else username
-        lookup[user_id] = display_name
-    return lookup
+    Typeahead search over name, username and roll number, best match first.
+    Every word of ``q`` must prefix-match one of them. Served from the
+    in-memory index in user_search.py.
+    """
+    return user_index.refresh_if_stale(db).search(q, role=role, limit=limit)
 
 @router.put("/{user_id}", response_model=schemas.UserOut)
 def update_user(
@@ -181,6 +273,8 @@ def update_user(
     
     db.commit()
     db.refresh(db_user)
+    advisor_directory.invalidate()
+    user_index.upsert(db_user)
     return db_user
 
 @router.delete("/{user_id}")
@@ -206,17 +300,20 @@ def delete_user(
     
     db.delete(db_user)
     db.commit()
+    advisor_directory.invalidate()
+    user_index.remove(user_id)
     return {"message": "User deleted successfully"}
 
 @router.post("/{user_id}/upload-picture", response_model=schemas.UserOut)
 def upload_profile_picture(
     user_id: str,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user_with_roles(["admin", "student", "advisor", "attendance_incharge"])),
     db: Session = Depends(get_db)
 ):
     """Upload a profile picture and set profile_picture_url on the user.
-    Saves to backend/static/uploads and returns updated user object.
+    See profile_pictures.py for how the image is processed and stored.
     """
     # Only allow self or admin to upload
     if current_user.role != "admin" and current_user.id != user_id:
@@ -226,20 +323,25 @@ def upload_profile_picture(
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    uploads_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static", "uploads")
-    os.makedirs(uploads_dir, exist_ok=True)
-    timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    filename = f"{user_id}_{timestamp}_{file.filename}"
-    filepath = os.path.join(uploads_dir, filename)
+    previous = profile_pictures.save_profile_picture(db, db_user, file)
+    background_tasks.add_task(profile_pictures.delete_if_orphaned, previous)
+    return db_user
 
-    with open(filepath, "wb") as f:
-        f.write(file.file.read())
+@router.post("/me/upload-profile-picture")
+def upload_my_profile_picture(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Upload the current user's profile picture; returns {"profile_picture_url": ...}"""
+    db_user = db.query(User).filter(User.id == current_user.id).first()
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    # For simplicity, serve via relative path; in production, use proper static hosting
-    db_user.profile_picture_url = f"/static/uploads/{filename}"
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    previous = profile_pictures.save_profile_picture(db, db_user, file)
+    background_tasks.add_task(profile_pictures.delete_if_orphaned, previous)
+    return {"profile_picture_url": db_user.profile_picture_url}
 
 @router.put("/me/profile", response_model=schemas.UserOut)
 def update_my_profile(
@@ -275,6 +377,8 @@ def update_my_profile(
         
         db.commit()
         db.refresh(current_user)
+        advisor_directory.invalidate()
+        user_index.upsert(current_user)
         return current_user
         
     except Exception as e:
@@ -323,14 +427,8 @@ def get_my_attendance(
     db: Session = Depends(get_db)
 ):
     """Allow students to view their own attendance records"""
-    from models import AttendanceRecord
-    from sqlalchemy.orm import selectinload
-    
-    records = db.query(AttendanceRecord).options(
-        selectinload(AttendanceRecord.student),
-        selectinload(AttendanceRecord.marker)
-    ).filter(
+    records = db.query(AttendanceRecord).filter(
         AttendanceRecord.student_id == current_user.id
     ).order_by(AttendanceRecord.date.desc()).all()
     
-    return records
+    return serializers.json_list(serializers.ATTENDANCE_RECORDS, records)
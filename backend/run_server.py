@@ -2,6 +2,10 @@
 """
 Run the FastAPI server with automatic .env loading
 Usage: python run_server.py [--host HOST] [--port PORT] [--no-reload]
+       python run_server.py --workers auto [--max-requests N] [--max-requests-jitter N]
+
+With --workers (or WEB_CONCURRENCY, or ENVIRONMENT=production) the app is
+preloaded once and served by that many forked workers; see prefork.py.
 """
 import os
 import sys
@@ -35,6 +39,13 @@ parser.add_argument("--host", default=None, help="Host to bind (default: from .e
 parser.add_argument("--port", type=int, default=None, help="Port to bind (default: from .env or 8000)")
 parser.add_argument("--no-reload", action="store_true", help="Disable auto-reload")
 parser.add_argument("--log-level", default="info", help="Log level (debug, info, warning, error)")
+parser.add_argument("--workers", default=None,
+                    help="Pre-fork worker processes, a number or 'auto' (one per CPU); "
+                         "default: WEB_CONCURRENCY, or auto with ENVIRONMENT=production")
+parser.add_argument("--max-requests", type=int, default=None,
+                    help="Replace a worker after this many requests (default: MAX_REQUESTS or 0, never)")
+parser.add_argument("--max-requests-jitter", type=int, default=None,
+                    help="Add up to this many requests to each worker's limit (default: MAX_REQUESTS_JITTER or 0)")
 args = parser.parse_args()
 
 # Load .env file before importing main
@@ -50,10 +61,18 @@ if not os.getenv("SECRET_KEY"):
 # Get configuration from env or args
 host = args.host or os.getenv("HOST", "0.0.0.0")
 port = args.port or int(os.getenv("PORT", "8000"))
-reload = not args.no_reload and os.getenv("RELOAD", "true").lower() in ("true", "1", "yes")
+production = os.getenv("ENVIRONMENT") == "production"
+workers = args.workers or os.getenv("WEB_CONCURRENCY") or ("auto" if production else None)
+reload_default = "false" if production or workers else "true"
+reload = not args.no_reload and os.getenv("RELOAD", reload_default).lower() in ("true", "1", "yes")
+if reload and workers:
+    print("⚠️  Auto-reload does not work with --workers; it is disabled", file=sys.stderr)
+    reload = False
 
 print(f"🚀 Starting server at http://{host}:{port}", file=sys.stderr)
 print(f"🔄 Auto-reload: {'enabled' if reload else 'disabled'}", file=sys.stderr)
+if workers:
+    print(f"👷 Workers: {workers} (pre-fork; SIGHUP for a rolling restart)", file=sys.stderr)
 print(f"📊 Log level: {args.log_level}", file=sys.stderr)
 print(f"🌍 Environment: {os.getenv('ENVIRONMENT', 'development')}", file=sys.stderr)
 print("=" * 60, file=sys.stderr)
@@ -62,6 +81,14 @@ print("=" * 60, file=sys.stderr)
 import uvicorn
 
 if __name__ == "__main__":
+    if workers:
+        import prefork
+        sys.exit(prefork.serve(
+            host, port, prefork.worker_count(workers), log_level=args.log_level,
+            max_requests=prefork.MAX_REQUESTS if args.max_requests is None else args.max_requests,
+            max_requests_jitter=(prefork.MAX_REQUESTS_JITTER if args.max_requests_jitter is None
+                                 else args.max_requests_jitter),
+        ))
     try:
         uvicorn.run(
             "main:app",
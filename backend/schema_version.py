@@ -0,0 +1,58 @@
+"""
+Skip ``Base.metadata.create_all`` at startup when the schema is in place.
+
+create_all inspects every table on each start. Instead, a fingerprint of the
+declared models (tables, columns, types, indexes) is kept in sync_versions
+under "schema". When it matches, the database was already created or checked
+against exactly these models and create_all is skipped. It runs again when a
+model changes or the row is missing (a new database, or one recreated by the
+reset scripts, which drop sync_versions with everything else).
+
+create_all only ever adds missing tables, so nothing changes for
+migrations: new columns on existing tables still need the migrate_*.py
+scripts.
+"""
+import hashlib
+
+from sqlalchemy import MetaData, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import upsert_insert
+from models import SyncVersion
+
+SCHEMA_COUNTER = "schema"
+
+
+def schema_fingerprint(metadata: MetaData) -> int:
+    parts = []
+    for table in metadata.sorted_tables:
+        parts.append(f"table {table.name}")
+        for column in table.columns:
+            parts.append(f"column {column.name} {column.type!r} {column.nullable} {column.primary_key}")
+        for index in sorted(table.indexes, key=lambda index: index.name or ""):
+            parts.append(f"index {index.name} {[column.name for column in index.columns]} {index.unique}")
+    digest = hashlib.blake2b("\n".join(parts).encode(), digest_size=4).digest()
+    # 31 bits: sync_versions.value is a 32-bit INTEGER on PostgreSQL
+    return int.from_bytes(digest, "big") >> 1
+
+
+def ensure_schema(engine, metadata: MetaData) -> bool:
+    """Run create_all unless the stored fingerprint matches; True if it ran"""
+    fingerprint = schema_fingerprint(metadata)
+    try:
+        with engine.connect() as conn:
+            stored = conn.execute(
+                select(SyncVersion.value).where(SyncVersion.name == SCHEMA_COUNTER)
+            ).scalar()
+    except SQLAlchemyError:
+        # No sync_versions table yet
+        stored = None
+    if stored == fingerprint:
+        return False
+
+    metadata.create_all(bind=engine)
+    stmt = upsert_insert(SyncVersion.__table__).values(name=SCHEMA_COUNTER, value=fingerprint)
+    stmt = stmt.on_conflict_do_update(index_elements=[SyncVersion.name], set_={"value": fingerprint})
+    with engine.begin() as conn:
+        conn.execute(stmt)
+    return True
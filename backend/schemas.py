@@ -1,4 +1,4 @@
-from pydantic import BaseModel, field_serializer
+from pydantic import BaseModel, Field, field_serializer, field_validator
 from typing import Optional, List
 from datetime import date, datetime
 from enum import Enum
@@ -52,6 +52,17 @@ class UserOut(UserBase):
     class Config:
         from_attributes = True
 
+class UserSearchResult(BaseModel):
+    id: str
+    name: Optional[str] = None
+    username: str
+    roll_no: Optional[str] = None
+    role: str
+    section: Optional[str] = None
+    year: Optional[int] = None
+    department: Optional[str] = None
+    score: int
+
 class UserProfileUpdate(BaseModel):
     roll_no: Optional[str] = None
     name: Optional[str] = None
@@ -95,6 +106,14 @@ class LeaveRequestOut(LeaveRequestBase):
     created_at: datetime
     image_data: Optional[str] = None  # Override to ensure it's always a string in output
 
+    @field_validator('image_data', mode='before')
+    @classmethod
+    def encode_image_data(cls, value):
+        """Accept the raw bytes of LeaveRequest.image_data when validating ORM objects"""
+        if isinstance(value, bytes):
+            return base64.b64encode(value).decode('utf-8')
+        return value
+
     @field_serializer('image_data')
     def serialize_image_data(self, value, _info):
         """Convert binary image data to Base64 string for JSON serialization"""
@@ -131,6 +150,35 @@ class LeaveRequestActionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class LeaveRequestSearchResult(LeaveRequestActionResponse):
+    rank: float
+
+class LeaveRequestBatchApprove(BaseModel):
+    request_ids: List[str] = Field(..., min_length=1, max_length=100)
+
+class LeaveRequestBatchItemResult(BaseModel):
+    """Outcome of a single request within a batch approval"""
+    request_id: str
+    result: str  # approved, skipped, not_found
+    detail: Optional[str] = None
+    request: Optional[LeaveRequestActionResponse] = None
+
+class LeaveRequestBatchApproveResponse(BaseModel):
+    approved: int
+    results: List[LeaveRequestBatchItemResult]
+
+class ExportEntry(BaseModel):
+    request_id: str
+    url: str
+    student_id: str
+    status: str
+    start_date: date
+    end_date: date
+    exported_at: datetime
+
+    class Config:
+        from_attributes = True
+
 class AttendanceRecordBase(BaseModel):
     student_id: str
     date: date
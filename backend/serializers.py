@@ -0,0 +1,25 @@
+"""
+Precompiled serializers for list responses.
+
+Each TypeAdapter is built once at import. ``json_list`` validates ORM rows in
+one pass and dumps them straight to JSON bytes inside pydantic-core, skipping
+FastAPI's second validation against response_model, jsonable_encoder and the
+JSON encoder of the response class. Routes keep ``response_model`` for the
+OpenAPI schema; FastAPI does not touch a returned Response.
+"""
+from typing import List, Mapping, Optional
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+import schemas
+
+ATTENDANCE_RECORDS = TypeAdapter(List[schemas.AttendanceRecordOut])
+LEAVE_REQUESTS = TypeAdapter(List[schemas.LeaveRequestOut])
+USERS = TypeAdapter(List[schemas.UserOut])
+
+
+def json_list(adapter: TypeAdapter, items, headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Serialize ORM objects (or dicts) with ``adapter`` into a JSON response"""
+    content = adapter.dump_json(adapter.validate_python(items, from_attributes=True))
+    return Response(content=content, media_type="application/json", headers=headers)
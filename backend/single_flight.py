@@ -0,0 +1,114 @@
+"""
+Single-flight coalescing of identical concurrent computations.
+
+``flight.do(key, fn)`` runs ``fn`` unless a call with the same key is
+already running, in which case it waits for that call and returns (or
+raises) its outcome instead. Nothing is kept once the call finishes: the
+next call with the key runs ``fn`` again. It is not a cache, only a way for
+a burst of identical requests (every marking tablet loading the roster when
+a period starts) to cost one computation.
+
+Keys must include everything the result depends on, including who may see
+it. Results are handed to every waiter as the same object, so they must not
+be modified afterwards.
+
+Each flight counts executions and shared results (duplicate executions
+saved), in single_flight_calls_total on /metrics and per process in
+GET /admin/single-flight.
+"""
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+from metrics import record_flight
+
+T = TypeVar("T")
+
+_flights: Dict[str, "SingleFlight"] = {}
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        if name in _flights:
+            raise ValueError(f"Single flight {name!r} already exists")
+        self.name = name
+        self.executed = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        _flights[name] = self
+
+    def _count(self, shared: bool) -> None:
+        # Called with self._lock held
+        if shared:
+            self.shared += 1
+        else:
+            self.executed += 1
+        record_flight(self.name, shared)
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """Run ``fn`` or join the running call for ``key``; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None
+            if not shared:
+                call = self._calls[key] = _Call()
+            self._count(shared)
+
+        if shared:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """``do`` for coroutines. The call runs as its own task, so a caller
+        that is cancelled (client gone) does not cancel it for the others."""
+        with self._lock:
+            task = self._tasks.get(key)
+            shared = task is not None
+            if not shared:
+                task = self._tasks[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda done: self._forget(key, done))
+            self._count(shared)
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.executed + self.shared
+            return {
+                "executed": self.executed,
+                "shared": self.shared,
+                "shared_ratio": round(self.shared / total, 3) if total else None,
+                "in_flight": len(self._calls) + len(self._tasks),
+            }
+
+
+def snapshot() -> dict:
+    return {name: flight.snapshot() for name, flight in sorted(_flights.items())}
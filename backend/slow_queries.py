@@ -0,0 +1,192 @@
+"""
+Slow query log.
+
+Every statement on the engine is timed. Those taking at least SLOW_QUERY_MS
+go into a ring buffer of the last SLOW_QUERY_BUFFER entries, with their
+parameters and duration, and are aggregated per statement shape (the SQL
+with IN lists and whitespace collapsed).
+
+The first time a shape turns up, its plan is captured on a background
+thread with its own connection, so the request that ran it does not wait:
+``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` on PostgreSQL. Plans showing a
+full table scan (SQLite ``SCAN <table>`` without an index, PostgreSQL
+``Seq Scan``) or a temporary sort are flagged. GET /admin/slow-queries shows
+all of it.
+
+Entries are per process; with several workers each keeps its own log.
+"""
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import event
+
+from logging_config import logger
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER", "200"))
+SLOW_QUERY_SHAPES = 500
+STATEMENT_PREVIEW = 2000
+PARAMETER_PREVIEW = 200
+
+EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+# Writes to these columns are logged without their parameters
+SENSITIVE_COLUMNS = ("hashed_password",)
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\([^)]+\)s|%s)(?:\s*,\s*(?:\?|%\([^)]+\)s|%s))+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_SQLITE_FULL_SCAN = re.compile(r"^SCAN (\S+)$")
+_POSTGRES_FULL_SCAN = re.compile(r"Seq Scan on (\S+)")
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with IN lists of any length and all whitespace runs made equal"""
+    return _IN_LIST.sub("(?, ...)", _WHITESPACE.sub(" ", statement).strip())
+
+
+def _preview_parameters(statement: str, parameters):
+    # Reads merely select the column; the parameters of a write are the secret itself
+    if statement.lstrip().upper().startswith(("INSERT", "UPDATE")) and any(
+        column in statement for column in SENSITIVE_COLUMNS
+    ):
+        return "<redacted>"
+    if isinstance(parameters, dict):
+        return {key: repr(value)[:PARAMETER_PREVIEW] for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [repr(value)[:PARAMETER_PREVIEW] for value in parameters]
+    return repr(parameters)[:PARAMETER_PREVIEW]
+
+
+def analyze_plan(dialect: str, rows) -> dict:
+    """Plan lines plus the tables read by full scan and whether a temporary sort is used"""
+    if dialect == "sqlite":
+        # (id, parent, notused, detail)
+        lines = [row[-1] for row in rows]
+        full_scans = [match.group(1) for line in lines if (match := _SQLITE_FULL_SCAN.match(line))]
+        temp_sort = any("USE TEMP B-TREE" in line for line in lines)
+    else:
+        lines = [row[0] for row in rows]
+        full_scans = [match.group(1) for line in lines if (match := _POSTGRES_FULL_SCAN.search(line))]
+        temp_sort = any(line.strip().startswith("Sort ") or "-> Sort " in line for line in lines)
+    return {"plan": lines, "full_scans": full_scans, "temp_sort": temp_sort}
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, size: int = SLOW_QUERY_BUFFER):
+        self.threshold = threshold_ms / 1000
+        self._recent = deque(maxlen=size)
+        self._shapes = OrderedDict()
+        self._lock = threading.Lock()
+        self._engine = None
+        self._explain_queue = queue.Queue(maxsize=100)
+        self._explain_thread = None
+
+    def instrument(self, engine) -> None:
+        """Time every statement on ``engine`` and explain new slow shapes with it"""
+        self._engine = engine
+
+        # The start time lives on the statement's execution context, so a statement
+        # that fails (no after_cursor_execute) leaves nothing behind on the connection
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if context is not None:
+                context._slow_query_start = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = getattr(context, "_slow_query_start", None)
+            if started is None:
+                return
+            duration = time.perf_counter() - started
+            if duration >= self.threshold:
+                self.record(statement, parameters, duration, executemany)
+
+    def record(self, statement: str, parameters, duration: float, executemany: bool = False) -> None:
+        if statement.lstrip().upper().startswith("EXPLAIN"):
+            return
+        shape = statement_shape(statement)
+        duration_ms = round(duration * 1000, 2)
+        with self._lock:
+            self._recent.append({
+                "at": datetime.now(timezone.utc).isoformat(),
+                "duration_ms": duration_ms,
+                "statement": statement[:STATEMENT_PREVIEW],
+                "parameters": _preview_parameters(statement, parameters),
+                "executemany": executemany,
+            })
+            entry = self._shapes.get(shape)
+            new_shape = entry is None
+            if new_shape:
+                entry = self._shapes[shape] = {
+                    "shape": shape[:STATEMENT_PREVIEW], "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "plan": None, "full_scans": [], "temp_sort": False,
+                }
+                if len(self._shapes) > SLOW_QUERY_SHAPES:
+                    self._shapes.popitem(last=False)
+            else:
+                self._shapes.move_to_end(shape)
+            entry["count"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + duration_ms, 2)
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+        logger.warning(f"Slow query ({duration_ms}ms): {shape[:300]}")
+
+        if new_shape and statement.lstrip().upper().startswith(EXPLAINABLE):
+            if executemany and isinstance(parameters, (list, tuple)) and parameters:
+                parameters = parameters[0]
+            try:
+                self._explain_queue.put_nowait((shape, statement, parameters))
+            except queue.Full:
+                return
+            self._ensure_explainer()
+
+    def _ensure_explainer(self):
+        with self._lock:
+            if self._explain_thread is None or not self._explain_thread.is_alive():
+                self._explain_thread = threading.Thread(target=self._explain_loop, name="slow-query-explain", daemon=True)
+                self._explain_thread.start()
+
+    def _explain_loop(self):
+        while True:
+            shape, statement, parameters = self._explain_queue.get()
+            try:
+                result = self.explain(statement, parameters)
+            except Exception as e:
+                result = {"plan": [f"EXPLAIN failed: {e}"], "full_scans": [], "temp_sort": False}
+            with self._lock:
+                entry = self._shapes.get(shape)
+                if entry is not None:
+                    entry.update(result)
+            if result["full_scans"]:
+                logger.warning(f"Slow query does a full scan of {', '.join(result['full_scans'])}: {shape[:300]}")
+
+    def explain(self, statement: str, parameters) -> dict:
+        dialect = self._engine.dialect.name
+        prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+        with self._engine.connect() as conn:
+            rows = conn.exec_driver_sql(prefix + statement, parameters or ()).fetchall()
+        return analyze_plan(dialect, rows)
+
+    def snapshot(self, limit: Optional[int] = None) -> dict:
+        with self._lock:
+            recent = list(reversed(self._recent))[:limit]
+            shapes = sorted((dict(entry) for entry in self._shapes.values()),
+                            key=lambda entry: entry["total_ms"], reverse=True)[:limit]
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "full_scan_shapes": sum(1 for entry in shapes if entry["full_scans"]),
+            "shapes": shapes,
+            "recent": recent,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._recent.clear()
+            self._shapes.clear()
+
+
+slow_query_log = SlowQueryLog()
@@ -49,6 +49,11 @@ echo "===================================="
 echo ""
 
 # Start the server
+if [ "$ENVIRONMENT" = "production" ]; then
+    # Pre-fork workers (one per CPU) with rolling restarts on SIGHUP; see prefork.py
+    echo "Starting production server..."
+    exec python run_server.py --host 0.0.0.0 --port 8000
+fi
 echo "Starting Uvicorn server..."
 uvicorn main:app --host 0.0.0.0 --port 8000 --reload
 
@@ -9,8 +9,8 @@ echo "🚀 Starting College Attendance Marker Backend..."
 echo ""
 
 # Set environment variables
-export SECRET_KEY="dev_secret_key_for_testing_only_change_in_production_12345"
-export ALLOWED_ORIGINS="*"
+export SECRET_KEY=${SECRET_KEY:-"dev_secret_key_for_testing_only_change_in_production_12345"}
+export ALLOWED_ORIGINS=${ALLOWED_ORIGINS:-"*"}
 
 # Check if virtual environment exists
 if [ ! -d "venv" ]; then
@@ -27,9 +27,11 @@ source venv/bin/activate
 echo "📚 Installing dependencies..."
 pip install -q -r requirements.txt
 
-# Run database seeding
-echo "🌱 Seeding database..."
-python reset_and_seed_db.py
+# Run database seeding (it wipes the database, so never in production)
+if [ "$ENVIRONMENT" != "production" ]; then
+    echo "🌱 Seeding database..."
+    python reset_and_seed_db.py
+fi
 
 echo ""
 echo "✅ Backend is ready!"
@@ -44,5 +46,9 @@ echo "🚀 Starting server..."
 echo ""
 
 # Start the server
+if [ "$ENVIRONMENT" = "production" ]; then
+    # Pre-fork workers (one per CPU) with rolling restarts on SIGHUP; see prefork.py
+    exec python run_server.py --host 0.0.0.0 --port 8000
+fi
 uvicorn main:app --reload --host 0.0.0.0 --port 8000
 
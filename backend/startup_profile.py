@@ -0,0 +1,169 @@
+"""
+Where the time goes between starting the process and the first response.
+
+``main`` imports this module first, so the profile covers:
+
+- ``interpreter``: from process start until ``main`` starts importing
+  (Python itself, uvicorn or run_server.py); read from /proc, Linux only
+- ``import``: importing ``main`` with every route, model and library it
+  pulls in. With STARTUP_PROFILE_IMPORTS=1 the slowest modules by own
+  import time are listed too (like ``python -X importtime``; it wraps every
+  module loader, so leave it off normally)
+- one entry per lifespan step wrapped in ``startup.phase(...)``
+- ``first_request``: from the end of the lifespan until the first response
+  has been sent
+
+The profile is logged once the first response is sent and served at
+GET /admin/startup. Phases need not add up: steps in between that are not
+wrapped (uvicorn's own startup) only show in the total. A worker forked by
+prefork.py starts a profile of its own at fork(); its import happened in
+the master.
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+STARTUP_PROFILE_IMPORTS = os.getenv("STARTUP_PROFILE_IMPORTS", "").lower() in ("1", "true", "yes")
+SLOWEST_IMPORTS = 20
+
+
+def process_age() -> Optional[float]:
+    """Seconds since this process started (None where /proc is unavailable)"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the parenthesised command name
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+
+
+class _TimedLoader:
+    """Delegates to a module's real loader and times exec_module"""
+
+    def __init__(self, loader, name: str, timer: "ImportTimer"):
+        self._loader = loader
+        self._name = name
+        self._timer = timer
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._timer.enter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.leave(self._name)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class ImportTimer:
+    """Meta path finder recording the own and cumulative import time of each module"""
+
+    def __init__(self):
+        # [started, time spent in nested imports]
+        self._stack: List[list] = []
+        self.times: Dict[str, tuple] = {}
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, name, self)
+        return spec
+
+    def enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def leave(self, name: str):
+        started, nested = self._stack.pop()
+        cumulative = time.perf_counter() - started
+        self.times[name] = (cumulative - nested, cumulative)
+        if self._stack:
+            self._stack[-1][1] += cumulative
+
+    def slowest(self, limit: int) -> list:
+        ranked = sorted(self.times.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [
+            {"module": name, "self_ms": round(own * 1000, 1), "cumulative_ms": round(cumulative * 1000, 1)}
+            for name, (own, cumulative) in ranked
+        ]
+
+
+class StartupProfile:
+    def __init__(self, profile_imports: bool = STARTUP_PROFILE_IMPORTS):
+        self._started = time.perf_counter()
+        age = process_age()
+        self._process_start = self._started - (age or 0.0)
+        self.phases: List[tuple] = [("interpreter", age)] if age is not None else []
+        self.forked = False
+        self.imports = None
+        self._import_timer = None
+        self._lifespan_done = None
+        self.first_response_at = None
+        if profile_imports:
+            self._import_timer = ImportTimer()
+            sys.meta_path.insert(0, self._import_timer)
+
+    def imported(self) -> None:
+        """Called at the end of ``main``"""
+        self.phases.append(("import", time.perf_counter() - self._started))
+        if self._import_timer is not None:
+            sys.meta_path.remove(self._import_timer)
+            self.imports = self._import_timer.slowest(SLOWEST_IMPORTS)
+            self._import_timer = None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def lifespan_done(self) -> None:
+        self._lifespan_done = time.perf_counter()
+
+    def response_sent(self) -> None:
+        """Called by TimingMiddleware after every response; only the first one counts"""
+        if self.first_response_at is not None or self._lifespan_done is None:
+            return
+        self.first_response_at = time.perf_counter()
+        self.phases.append(("first_request", self.first_response_at - self._lifespan_done))
+        from logging_config import logger
+        logger.info(f"Startup: first response {self.total():.2f}s after process start ("
+                    + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases) + ")")
+
+    def total(self) -> float:
+        return self.first_response_at - self._process_start
+
+    def after_fork(self) -> None:
+        self._process_start = time.perf_counter()
+        self.phases = []
+        self.forked = True
+        self._lifespan_done = self.first_response_at = None
+
+    def report(self) -> dict:
+        return {
+            "forked_worker": self.forked,
+            "phases": [{"phase": name, "seconds": round(seconds, 4)} for name, seconds in self.phases],
+            "time_to_first_response": round(self.total(), 4) if self.first_response_at is not None else None,
+            "slowest_imports": self.imports,
+        }
+
+
+startup = StartupProfile()
+os.register_at_fork(after_in_child=startup.after_fork)
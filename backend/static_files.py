@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Static file serving for /static.
+
+CachedStaticFiles adds a Cache-Control header to every file (ETag and
+Last-Modified come from Starlette) and, when the client accepts it, serves a
+pre-built ``<file>.br`` or ``<file>.gz`` next to the original instead of
+letting CompressionMiddleware compress the same JSON on every request. A
+variant is only used while it is at least as new as the original. Images and
+other already-compressed types are sent as-is.
+
+Files can be sent with the ASGI ``http.response.pathsend`` extension, letting
+the server use sendfile(), by setting STATIC_PATHSEND=true. It is only used
+when the server advertises the extension (uvicorn does not). Every middleware
+in main.py passes pathsend through, so keep it that way: BaseHTTPMiddleware
+and ``@app.middleware`` reject it.
+
+Run this file to build missing variants for existing leave request exports.
+"""
+import gzip
+import os
+import sys
+from mimetypes import guess_type
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from compression import accepted_encodings
+from metrics import record_cache
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only .gz variants are built
+    brotli = None
+
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "86400"))
+STATIC_PATHSEND = os.getenv("STATIC_PATHSEND", "false").lower() == "true"
+
+# Preferred order when the client accepts several
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+INCOMPRESSIBLE_PREFIXES = ("image/", "audio/", "video/")
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_precompressed(path: str, data: bytes) -> None:
+    """Write the .gz (and, with brotli installed, .br) variants of ``path``.
+
+    Call after writing ``path`` itself so the variants are the newer files.
+    """
+    _write_atomic(f"{path}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write_atomic(f"{path}.br", brotli.compress(data, quality=11))
+
+
+class StaticFileResponse(FileResponse):
+    async def __call__(self, scope, receive, send):
+        if STATIC_PATHSEND and not self.send_header_only \
+                and "http.response.pathsend" in scope.get("extensions", {}):
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+            if self.background is not None:
+                await self.background()
+            return
+        await super().__call__(scope, receive, send)
+
+
+class CachedStaticFiles(StaticFiles):
+    def __init__(self, *args, cache_control: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control or f"public, max-age={STATIC_MAX_AGE}"
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        media_type = guess_type(str(full_path))[0] or "text/plain"
+        headers = {"cache-control": self.cache_control}
+
+        # Images, audio and video are already compressed: no variants, and
+        # CompressionMiddleware skips these media types too
+        if not media_type.startswith(INCOMPRESSIBLE_PREFIXES):
+            headers["vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding, suffix in PRECOMPRESSED:
+                if encoding not in accepted:
+                    continue
+                try:
+                    variant_stat = os.stat(f"{full_path}{suffix}")
+                except OSError:
+                    continue
+                if variant_stat.st_mtime >= stat_result.st_mtime:
+                    full_path, stat_result = f"{full_path}{suffix}", variant_stat
+                    headers["content-encoding"] = encoding
+                    break
+            if any(encoding in accepted for encoding, _ in PRECOMPRESSED):
+                record_cache("static_precompressed", hit="content-encoding" in headers)
+
+        response = StaticFileResponse(
+            full_path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=stat_result,
+            method=scope["method"],
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def precompress_tree(root: str) -> int:
+    """Build missing or stale variants for every JSON file under ``root``"""
+    built = 0
+    for dirpath, _dirs, files in os.walk(root):
+        for name in files:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(dirpath, name)
+            source_mtime = os.path.getmtime(path)
+            variants = [f"{path}.gz"] + ([f"{path}.br"] if brotli is not None else [])
+            if all(os.path.exists(v) and os.path.getmtime(v) >= source_mtime for v in variants):
+                continue
+            with open(path, "rb") as f:
+                write_precompressed(path, f.read())
+            built += 1
+    return built
+
+
+if __name__ == "__main__":
+    exports_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "leave_requests")
+    try:
+        print(f"✅ Precompressed {precompress_tree(exports_dir)} exports")
+    except Exception as e:
+        print(f"❌ Precompression failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,79 @@
+"""
+Shared fixtures for the pytest suite.
+
+The backend reads its configuration when modules are imported, so the
+environment is set here, before anything from the backend is imported: a
+throwaway SQLite database, a fixed SECRET_KEY and the in-process response
+cache. The app is started once per session; every test starts from empty
+tables.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_DIR}/test.db"
+os.environ["SECRET_KEY"] = "test-secret-key"
+os.environ["RESPONSE_CACHE_BACKEND"] = "memory"
+os.environ.pop("ENVIRONMENT", None)
+sys.path.insert(0, BACKEND_DIR)
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from auth import create_access_token
+from database import Base, SessionLocal, engine
+from models import User
+from response_cache import response_cache
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+    engine.dispose()
+    shutil.rmtree(DATABASE_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def db(client):
+    # Depends on the app so its startup has created the schema
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture(autouse=True)
+def empty_tables(request):
+    yield
+    # Tests that never start the app have no schema to empty
+    if "client" not in request.fixturenames:
+        return
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+    response_cache.clear()
+
+
+@pytest.fixture
+def make_user(db):
+    """Create a user and return it; usernames default to the role plus a counter"""
+    created = []
+
+    def make(role: str = "student", **fields) -> User:
+        fields.setdefault("username", f"{role}{len(created) + 1}")
+        fields.setdefault("name", fields["username"].title())
+        user = User(role=role, hashed_password="-", **fields)
+        db.add(user)
+        db.commit()
+        created.append(user)
+        return user
+
+    return make
+
+
+def auth_headers(user: User) -> dict:
+    return {"Authorization": f"Bearer {create_access_token({'sub': user.username})}"}
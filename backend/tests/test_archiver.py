@@ -0,0 +1,96 @@
+import gzip
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import archiver
+from models import ArchiveOutbox, LeaveRequest
+
+
+@pytest.fixture
+def worker(tmp_path):
+    """A worker of our own, with the app's worker paused so it cannot drain our rows"""
+    running = archiver.archive_worker._thread is not None
+    archiver.archive_worker.stop()
+    yield archiver.ArchiveWorker(segment_dir=str(tmp_path))
+    if running:
+        archiver.archive_worker.start()
+
+
+def enqueue_requests(db, make_user, count):
+    student = make_user("student")
+    for day in range(1, count + 1):
+        req = LeaveRequest(student_id=student.id, start_date=date(2030, 1, day), end_date=date(2030, 1, day), reason="Leave")
+        db.add(req)
+        db.flush()
+        archiver.enqueue(db, req, "created")
+    db.commit()
+
+
+def fail(rows):
+    raise OSError("disk full")
+
+
+def archived_lines(worker):
+    lines = []
+    for segment in sorted(os.listdir(worker.segment_dir)):
+        with gzip.open(os.path.join(worker.segment_dir, segment), "rt", encoding="utf-8") as f:
+            lines += [json.loads(line) for line in f]
+    return lines
+
+
+def test_rolled_back_changes_are_not_queued(db, make_user):
+    student = make_user("student")
+    req = LeaveRequest(student_id=student.id, start_date=date(2030, 1, 1), end_date=date(2030, 1, 1), reason="Leave")
+    db.add(req)
+    db.flush()
+    archiver.enqueue(db, req, "created")
+    db.rollback()
+
+    assert db.query(ArchiveOutbox).count() == 0
+
+
+def test_failed_batch_is_retried_with_backoff(db, make_user, worker, monkeypatch):
+    enqueue_requests(db, make_user, 2)
+
+    monkeypatch.setattr(worker, "_append", fail)
+    assert worker.drain() == 0
+
+    db.expire_all()
+    rows = db.query(ArchiveOutbox).order_by(ArchiveOutbox.id).all()
+    assert [(row.attempts, row.lease, row.last_error) for row in rows] == [(1, None, "disk full")] * 2
+    assert all(row.next_attempt_at > datetime.utcnow() for row in rows)
+
+    # Not due yet: nothing is claimed, even once writing works again
+    monkeypatch.undo()
+    assert worker.drain() == 0
+
+    outbox_ids = [row.id for row in rows]
+    for row in rows:
+        row.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    assert worker.drain() == 2
+
+    assert db.query(ArchiveOutbox).count() == 0
+    lines = archived_lines(worker)
+    assert [line["event"] for line in lines] == ["created", "created"]
+    assert [line["outbox_id"] for line in lines] == outbox_ids
+
+
+def test_backoff_doubles_per_attempt(db, make_user, worker, monkeypatch):
+    enqueue_requests(db, make_user, 1)
+    monkeypatch.setattr(worker, "_append", fail)
+
+    delays = []
+    for _ in range(3):
+        row = db.query(ArchiveOutbox).one()
+        row.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+        worker.drain()
+        db.expire_all()
+        row = db.query(ArchiveOutbox).one()
+        delays.append(round((row.next_attempt_at - datetime.utcnow()).total_seconds()))
+
+    assert delays == [2, 4, 8]
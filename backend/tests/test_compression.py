@@ -0,0 +1,127 @@
+import gzip
+import json
+
+import brotli
+import pytest
+import zstandard
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+import compression
+from compression import CompressionMiddleware, CompressionStats, choose_encoding
+
+BODY = json.dumps([{"id": index, "reason": "Medical leave"} for index in range(200)]).encode()
+DECODERS = {
+    "zstd": lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+    "br": brotli.decompress,
+    "gzip": gzip.decompress,
+}
+
+
+@pytest.fixture
+def stats():
+    return CompressionStats()
+
+
+@pytest.fixture
+def app_client(stats):
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, stats=stats)
+
+    @app.get("/large")
+    def large():
+        return PlainTextResponse(BODY, media_type="application/json")
+
+    @app.get("/small")
+    def small():
+        return PlainTextResponse(b'{"ok": true}', media_type="application/json")
+
+    @app.get("/events")
+    def events():
+        return StreamingResponse(iter([b"data: 1\n\n"] * 100), media_type="text/event-stream")
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(iter([BODY[:1000], BODY[1000:]]), media_type="application/json")
+
+    return TestClient(app)
+
+
+def fetch(client, path, accept_encoding):
+    """Status, headers and the body exactly as sent (not decoded by the client)"""
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response.status_code, response.headers, b"".join(response.iter_raw())
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, br, zstd", "zstd"),
+    ("gzip, br", "br"),
+    ("gzip", "gzip"),
+    ("*", "zstd"),
+    ("GZIP", "gzip"),
+    # The highest q-value wins; preference only breaks ties
+    ("zstd;q=0.5, br;q=0.8, gzip;q=0.8", "br"),
+    ("zstd;q=0.1, gzip", "gzip"),
+    ("*;q=0.5, gzip", "gzip"),
+    # q=0 means "not acceptable", also against a wildcard
+    ("zstd;q=0, br;q=0, *", "gzip"),
+    ("gzip;q=0", None),
+    ("*;q=0", None),
+    ("identity", None),
+    ("", None),
+    ("gzip;q=oops", None),
+])
+def test_negotiation(accept_encoding, expected):
+    assert choose_encoding(accept_encoding) == expected
+
+
+def test_codings_without_their_package_are_not_offered(monkeypatch):
+    monkeypatch.setattr(compression, "zstandard", None)
+    assert choose_encoding("zstd, br, gzip") == "br"
+    monkeypatch.setattr(compression, "brotli", None)
+    assert choose_encoding("zstd, br, gzip") == "gzip"
+    assert choose_encoding("zstd, br") is None
+
+
+@pytest.mark.parametrize("encoding", ["zstd", "br", "gzip"])
+def test_large_bodies_are_compressed_with_the_chosen_coding(app_client, stats, encoding):
+    status, headers, body = fetch(app_client, "/large", f"{encoding}, identity;q=0.1")
+
+    assert status == 200
+    assert headers["content-encoding"] == encoding
+    assert "accept-encoding" in headers["vary"].lower()
+    assert int(headers["content-length"]) == len(body) < len(BODY)
+    assert DECODERS[encoding](body) == BODY
+    assert stats.snapshot()[encoding]["bytes_in"] == len(BODY)
+
+
+def test_nothing_acceptable_sends_identity(app_client):
+    status, headers, body = fetch(app_client, "/large", "gzip;q=0")
+
+    assert status == 200
+    assert "content-encoding" not in headers
+    assert body == BODY
+
+
+def test_small_bodies_are_not_compressed(app_client, stats):
+    _, headers, body = fetch(app_client, "/small", "gzip")
+
+    assert "content-encoding" not in headers
+    assert body == b'{"ok": true}'
+    assert stats.snapshot() == {}
+
+
+def test_event_streams_are_passed_through(app_client):
+    _, headers, body = fetch(app_client, "/events", "zstd, br, gzip")
+
+    assert "content-encoding" not in headers
+    assert body == b"data: 1\n\n" * 100
+
+
+def test_streams_of_unknown_length_are_compressed_in_chunks(app_client):
+    _, headers, body = fetch(app_client, "/stream", "br")
+
+    assert headers["content-encoding"] == "br"
+    assert "content-length" not in headers
+    assert brotli.decompress(body) == BODY
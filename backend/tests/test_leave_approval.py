@@ -0,0 +1,79 @@
+from datetime import date
+
+from sqlalchemy import event
+
+from conftest import auth_headers
+from database import engine
+from models import AttendanceRecord, LeaveRequest
+
+
+def add_request(db, student, start, end, status="pending"):
+    req = LeaveRequest(student_id=student.id, start_date=start, end_date=end, reason="Leave", status=status)
+    db.add(req)
+    db.commit()
+    return req.id
+
+
+def attendance(db, student):
+    db.expire_all()
+    return {
+        record.date: record.status
+        for record in db.query(AttendanceRecord).filter(AttendanceRecord.student_id == student.id)
+    }
+
+
+def test_approval_upserts_every_day_in_one_statement(client, db, make_user):
+    admin, student, other = make_user("admin"), make_user("student"), make_user("student")
+    # An existing mark is overwritten; a holiday (marked for anyone) is skipped
+    db.add_all([
+        AttendanceRecord(student_id=student.id, date=date(2030, 3, 2), status="Absent", marked_by=admin.id),
+        AttendanceRecord(student_id=other.id, date=date(2030, 3, 3), status="Holiday", marked_by=admin.id),
+    ])
+    db.commit()
+    request_id = add_request(db, student, date(2030, 3, 1), date(2030, 3, 4))
+
+    inserts = []
+    def count_inserts(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO attendance_records"):
+            inserts.append(executemany)
+    event.listen(engine, "before_cursor_execute", count_inserts)
+    try:
+        response = client.post(f"/requests/{request_id}/approve", headers=auth_headers(admin))
+    finally:
+        event.remove(engine, "before_cursor_execute", count_inserts)
+
+    assert response.status_code == 200
+    assert inserts == [False]
+    assert attendance(db, student) == {
+        date(2030, 3, 1): "On-Duty",
+        date(2030, 3, 2): "On-Duty",
+        date(2030, 3, 4): "On-Duty",
+    }
+
+
+def test_approving_twice_is_a_conflict(client, db, make_user):
+    admin, student = make_user("admin"), make_user("student")
+    request_id = add_request(db, student, date(2030, 3, 1), date(2030, 3, 1))
+
+    assert client.post(f"/requests/{request_id}/approve", headers=auth_headers(admin)).status_code == 200
+    response = client.post(f"/requests/{request_id}/approve", headers=auth_headers(admin))
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Request already approved"
+
+
+def test_batch_approval_reports_each_request(client, db, make_user):
+    admin, student = make_user("admin"), make_user("student")
+    pending = add_request(db, student, date(2030, 4, 1), date(2030, 4, 2))
+    rejected = add_request(db, student, date(2030, 5, 1), date(2030, 5, 1), status="rejected")
+
+    response = client.post("/requests/approve-batch", headers=auth_headers(admin), json={
+        "request_ids": [pending, rejected, "missing", pending],
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["approved"] == 1
+    assert [(item["request_id"], item["result"]) for item in body["results"]] == [
+        (pending, "approved"), (rejected, "skipped"), ("missing", "not_found"),
+    ]
+    assert attendance(db, student) == {date(2030, 4, 1): "On-Duty", date(2030, 4, 2): "On-Duty"}
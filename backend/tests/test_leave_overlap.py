@@ -0,0 +1,60 @@
+import threading
+
+from conftest import auth_headers
+from models import LeaveRequest
+
+
+def submit(client, student, start, end, headers=None):
+    return client.post("/requests/", headers=headers or auth_headers(student), json={
+        "start_date": start, "end_date": end, "reason": "Leave",
+    })
+
+
+def test_overlapping_request_is_rejected_with_the_conflicts(client, make_user):
+    student = make_user("student")
+    first = submit(client, student, "2030-09-10", "2030-09-12").json()
+
+    response = submit(client, student, "2030-09-12", "2030-09-15")
+
+    assert response.status_code == 409
+    assert response.json()["detail"]["conflicting_requests"] == [{
+        "id": first["id"], "start_date": "2030-09-10", "end_date": "2030-09-12", "status": "pending",
+    }]
+
+
+def test_adjacent_days_and_other_students_do_not_overlap(client, make_user):
+    student, classmate = make_user("student"), make_user("student")
+    assert submit(client, student, "2030-09-10", "2030-09-12").status_code == 200
+
+    assert submit(client, student, "2030-09-13", "2030-09-14").status_code == 200
+    assert submit(client, student, "2030-09-08", "2030-09-09").status_code == 200
+    assert submit(client, classmate, "2030-09-10", "2030-09-12").status_code == 200
+
+
+def test_rejected_requests_do_not_block_new_ones(client, db, make_user):
+    student, admin = make_user("student"), make_user("admin")
+    first = submit(client, student, "2030-09-10", "2030-09-12").json()
+    assert client.post(f"/requests/{first['id']}/reject", headers=auth_headers(admin)).status_code == 200
+
+    assert submit(client, student, "2030-09-11", "2030-09-11").status_code == 200
+
+
+def test_concurrent_submissions_accept_exactly_one(client, db, make_user):
+    student = make_user("student")
+    # Built up front: the test session must not be used from several threads
+    headers = auth_headers(student)
+    barrier = threading.Barrier(6)
+    codes = []
+
+    def race():
+        barrier.wait()
+        codes.append(submit(client, student, "2030-10-01", "2030-10-03", headers).status_code)
+
+    threads = [threading.Thread(target=race) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(codes) == [200] + [409] * 5
+    assert db.query(LeaveRequest).filter(LeaveRequest.student_id == student.id).count() == 1
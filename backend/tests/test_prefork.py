@@ -0,0 +1,164 @@
+import asyncio
+import io
+import os
+import signal
+
+import pytest
+import uvicorn
+
+import prefork
+from prefork import READY, RECYCLE, Master, Worker, WorkerServer
+
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    yield read_fd, write_fd
+    for fd in (read_fd, write_fd):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+@pytest.fixture
+def master():
+    master = Master(uvicorn.Config("main:app"), workers=2, max_requests=100, max_requests_jitter=20)
+    yield master
+    for worker in master.workers.values():
+        master._close(worker)
+    master._selector.close()
+
+
+def cgroup_files(monkeypatch, files):
+    """Serve ``files`` (path -> content) to prefork's open(); other paths do not exist"""
+    def fake_open(path, *args, **kwargs):
+        if path not in files:
+            raise FileNotFoundError(path)
+        return io.StringIO(files[path])
+    monkeypatch.setattr(prefork, "open", fake_open, raising=False)
+
+
+@pytest.mark.parametrize("value, expected", [("auto", 3), ("AUTO", 3), ("4", 4), (2, 2), ("0", 1), ("-3", 1)])
+def test_worker_count(monkeypatch, value, expected):
+    monkeypatch.setattr(prefork, "usable_cpus", lambda: 3)
+    assert prefork.worker_count(value) == expected
+
+
+def test_worker_count_rejects_garbage():
+    with pytest.raises(ValueError):
+        prefork.worker_count("many")
+
+
+@pytest.mark.parametrize("files, expected", [
+    ({"/sys/fs/cgroup/cpu.max": "150000 100000\n"}, 2),
+    ({"/sys/fs/cgroup/cpu.max": "max 100000\n"}, None),
+    ({"/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "300000\n", "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000\n"}, 3),
+    ({"/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "-1\n", "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000\n"}, None),
+    ({}, None),
+])
+def test_cgroup_cpu_limit(monkeypatch, files, expected):
+    cgroup_files(monkeypatch, files)
+    assert prefork._cgroup_cpu_limit() == expected
+
+
+def test_usable_cpus_honours_affinity_and_quota(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0, 1, 2, 3, 4, 5})
+    monkeypatch.setattr(prefork, "_cgroup_cpu_limit", lambda: None)
+    assert prefork.usable_cpus() == 6
+    monkeypatch.setattr(prefork, "_cgroup_cpu_limit", lambda: 2)
+    assert prefork.usable_cpus() == 2
+
+
+def test_workers_recycle_once_after_their_request_limit(pipe):
+    read_fd, write_fd = pipe
+    server = WorkerServer(uvicorn.Config("main:app"), write_fd, max_requests=3)
+
+    server.server_state.total_requests = 2
+    assert asyncio.run(server.on_tick(1)) is False
+    server.server_state.total_requests = 3
+    assert asyncio.run(server.on_tick(2)) is False
+    server.server_state.total_requests = 4
+    asyncio.run(server.on_tick(3))
+
+    # Asked once, and it keeps serving until the master retires it
+    assert os.read(read_fd, 64) == RECYCLE
+    assert server.recycle_requested and not server.should_exit
+
+
+def test_workers_without_a_master_stop_at_their_limit(pipe):
+    read_fd, write_fd = pipe
+    os.close(read_fd)
+    server = WorkerServer(uvicorn.Config("main:app"), write_fd, max_requests=1)
+    server.server_state.total_requests = 1
+
+    assert asyncio.run(server.on_tick(1)) is True
+
+
+def test_no_request_limit_never_recycles(pipe):
+    read_fd, write_fd = pipe
+    server = WorkerServer(uvicorn.Config("main:app"), write_fd, max_requests=0)
+    server.server_state.total_requests = 10 ** 6
+
+    assert asyncio.run(server.on_tick(1)) is False
+    with pytest.raises(BlockingIOError):
+        os.read(read_fd, 64)
+
+
+class WorkerExit(Exception):
+    pass
+
+
+def test_request_limits_are_jittered_per_worker(master, monkeypatch):
+    limits = []
+
+    def run_worker(notify_fd, max_requests):
+        os.close(notify_fd)
+        limits.append(max_requests)
+        # The real one never returns (os._exit)
+        raise WorkerExit
+
+    # Take the child's side of the fork without forking
+    monkeypatch.setattr(os, "fork", lambda: 0)
+    monkeypatch.setattr(master, "_run_worker", run_worker)
+    for _ in range(50):
+        with pytest.raises(WorkerExit):
+            master.spawn()
+
+    assert all(100 <= limit <= 120 for limit in limits)
+    assert len(set(limits)) > 1
+
+    master.max_requests = 0
+    with pytest.raises(WorkerExit):
+        master.spawn()
+    assert limits[-1] == 0
+
+
+def test_master_reads_ready_and_recycle_messages(master, pipe):
+    read_fd, write_fd = pipe
+    worker = Worker(1234, read_fd)
+    master.crashes = 2
+
+    os.write(write_fd, READY)
+    master._read(worker)
+    assert worker.ready and master.crashes == 0
+    os.write(write_fd, RECYCLE)
+    master._read(worker)
+    assert master._recycle == [worker]
+
+
+@pytest.mark.parametrize("comes_up", [True, False])
+def test_replacement_must_be_up_before_the_old_worker_drains(master, monkeypatch, comes_up):
+    old, new = Worker(1, None), Worker(2, None)
+    killed = []
+    monkeypatch.setattr(master, "spawn", lambda: new)
+    monkeypatch.setattr(master, "wait_ready", lambda worker, deadline: comes_up)
+    monkeypatch.setattr(master, "_kill", lambda pid, signum: killed.append((pid, signum)))
+
+    assert master.replace(old) is comes_up
+
+    if comes_up:
+        assert old.retiring and killed == [(1, signal.SIGTERM)]
+    else:
+        assert not old.retiring and killed == [(2, signal.SIGKILL)]
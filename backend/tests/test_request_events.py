@@ -0,0 +1,108 @@
+import asyncio
+import json
+from datetime import date
+
+import pytest
+
+from conftest import auth_headers
+from models import LeaveRequest, RequestEventRecord
+from request_events import RequestEventHub
+
+
+@pytest.fixture
+def hub():
+    """A second hub on the same database, standing in for another worker"""
+    other = RequestEventHub(poll_interval=0.05)
+    other.start()
+    yield other
+    other.stop()
+
+
+def submit(client, student, advisor, day):
+    response = client.post("/requests/", headers=auth_headers(student), json={
+        "start_date": day.isoformat(), "end_date": day.isoformat(), "reason": "Leave",
+        "advisor_ids": [advisor.id],
+    })
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+async def subscribe(hub, user, last_event_id=None):
+    return await asyncio.to_thread(hub.subscribe, user.id, False, last_event_id, asyncio.get_running_loop())
+
+
+def resume(hub, user, last_event_id):
+    """Backlog a stream reconnecting with ``last_event_id`` starts with"""
+    async def run():
+        subscription = await subscribe(hub, user, last_event_id)
+        hub.unsubscribe(subscription)
+        return subscription.backlog
+    return asyncio.run(run())
+
+
+async def next_event(subscription):
+    return await asyncio.wait_for(subscription.queue.get(), timeout=2)
+
+
+def test_events_reach_streams_on_other_workers(client, make_user, hub):
+    student, advisor, other_advisor = make_user("student"), make_user("advisor"), make_user("advisor")
+
+    async def run():
+        mine = await subscribe(hub, advisor)
+        theirs = await subscribe(hub, other_advisor)
+        request_id = submit(client, student, advisor, date(2030, 6, 1))
+
+        event = await next_event(mine)
+        assert event.type == "created"
+        assert json.loads(event.encoded.decode().split("data: ", 1)[1])["id"] == request_id
+        assert event.encoded.startswith(f"id: {event.id}\n".encode())
+        # Not assigned to the other advisor
+        assert theirs.queue.empty()
+        hub.unsubscribe(mine)
+        hub.unsubscribe(theirs)
+
+    asyncio.run(run())
+
+
+def test_resume_replays_missed_events_in_order(client, db, make_user, hub):
+    student, advisor, admin = make_user("student"), make_user("advisor"), make_user("admin")
+    first = submit(client, student, advisor, date(2030, 6, 1))
+    seen = db.query(RequestEventRecord.id).scalar()
+    second = submit(client, student, advisor, date(2030, 6, 2))
+    assert client.post(f"/requests/{second}/reject", headers=auth_headers(admin)).status_code == 200
+
+    backlog = resume(hub, advisor, str(seen))
+    assert [event.type for event in backlog] == ["created", "rejected"]
+    assert [event.id for event in backlog] == [seen + 1, seen + 2]
+    assert first not in b"".join(event.encoded for event in backlog).decode()
+
+
+@pytest.mark.parametrize("last_event_id", ["not-a-number", "999999"])
+def test_unknown_event_ids_get_a_reset(client, make_user, hub, last_event_id):
+    student, advisor = make_user("student"), make_user("advisor")
+    submit(client, student, advisor, date(2030, 6, 1))
+
+    assert [event.type for event in resume(hub, advisor, last_event_id)] == ["reset"]
+
+
+def test_resuming_past_pruned_events_gets_a_reset(client, make_user, hub):
+    student, advisor = make_user("student"), make_user("advisor")
+    for day in (1, 2, 3):
+        submit(client, student, advisor, date(2030, 6, day))
+    hub.history_size = 1
+    assert hub.prune() == 2
+
+    assert [event.type for event in resume(hub, advisor, "1")] == ["reset"]
+
+
+def test_failed_changes_publish_nothing(client, db, make_user):
+    student, advisor = make_user("student"), make_user("advisor")
+    submit(client, student, advisor, date(2030, 6, 1))
+    # Overlaps the first request: rolled back with a 409
+    response = client.post("/requests/", headers=auth_headers(student), json={
+        "start_date": "2030-06-01", "end_date": "2030-06-01", "reason": "Again",
+    })
+
+    assert response.status_code == 409
+    assert db.query(LeaveRequest).count() == 1
+    assert [row.type for row in db.query(RequestEventRecord)] == ["created"]
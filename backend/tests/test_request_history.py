@@ -0,0 +1,85 @@
+from datetime import date, datetime, timedelta
+
+from conftest import auth_headers
+from models import LeaveRequest, request_advisors
+
+
+def add_processed(db, student, count, status="approved", advisor=None):
+    """``count`` processed requests, three per created_at second so pages split ties"""
+    start = datetime(2030, 1, 1, 9, 0, 0)
+    ids = []
+    for index in range(count):
+        req = LeaveRequest(
+            student_id=student.id, start_date=date(2030, 1, 1), end_date=date(2030, 1, 1),
+            reason="Leave", status=status, created_at=start + timedelta(seconds=index // 3),
+        )
+        db.add(req)
+        db.flush()
+        if advisor is not None:
+            db.execute(request_advisors.insert().values(request_id=req.id, advisor_id=advisor.id))
+        ids.append(req.id)
+    db.commit()
+    return ids
+
+
+def newest_first(db, ids):
+    rows = db.query(LeaveRequest.id, LeaveRequest.created_at).filter(LeaveRequest.id.in_(ids))
+    return [row.id for row in sorted(rows, key=lambda row: (row.created_at, row.id), reverse=True)]
+
+
+def walk(client, headers, **params):
+    """Follow X-Next-Cursor to the end, returning every page's ids"""
+    pages = []
+    while True:
+        response = client.get("/requests/history", headers=headers, params=params)
+        assert response.status_code == 200
+        pages.append([row["id"] for row in response.json()])
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return pages
+        params["cursor"] = cursor
+
+
+def test_cursors_walk_every_request_once_newest_first(client, db, make_user):
+    admin, student = make_user("admin"), make_user("student")
+    ids = add_processed(db, student, 20)
+
+    pages = walk(client, auth_headers(admin), limit=7)
+
+    assert [len(page) for page in pages] == [7, 7, 6]
+    assert [request_id for page in pages for request_id in page] == newest_first(db, ids)
+
+
+def test_default_page_size_and_limits(client, db, make_user):
+    admin, student = make_user("admin"), make_user("student")
+    add_processed(db, student, 55)
+    headers = auth_headers(admin)
+
+    first = client.get("/requests/history", headers=headers)
+    assert len(first.json()) == 50
+    assert first.headers.get("x-next-cursor")
+
+    assert client.get("/requests/history", headers=headers, params={"limit": 501}).status_code == 422
+    assert client.get("/requests/history", headers=headers, params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_filters_apply_on_every_page(client, db, make_user):
+    admin, student = make_user("admin"), make_user("student")
+    add_processed(db, student, 5, status="approved")
+    rejected = add_processed(db, student, 5, status="rejected")
+
+    pages = walk(client, auth_headers(admin), status="rejected", limit=2)
+
+    assert [request_id for page in pages for request_id in page] == newest_first(db, rejected)
+
+
+def test_advisors_page_through_their_own_requests(client, db, make_user):
+    advisor, other, student = make_user("advisor"), make_user("advisor"), make_user("student")
+    mine = add_processed(db, student, 4, advisor=advisor)
+    add_processed(db, student, 4, advisor=other)
+
+    pages = walk(client, auth_headers(advisor), limit=3)
+
+    assert [request_id for page in pages for request_id in page] == newest_first(db, mine)
+    count = client.get("/requests/history/count", headers=auth_headers(advisor)).json()
+    assert count == {"approved": 4, "rejected": 0, "total": 4}
@@ -0,0 +1,79 @@
+from conftest import auth_headers
+
+
+def lookup(client, user, since=None):
+    params = {} if since is None else {"since": since}
+    response = client.get("/users/lookup", headers=auth_headers(user), params=params)
+    assert response.status_code == 200
+    return response
+
+
+def test_delta_holds_changes_and_tombstones_since_the_version(client, make_user):
+    admin, renamed, removed, untouched = (make_user(role) for role in ("admin", "student", "student", "student"))
+    full = lookup(client, admin)
+    version = int(full.headers["x-users-version"])
+    assert full.json()[renamed.id] == renamed.name
+    # Read before the deletion expires them
+    headers, removed_id, untouched_id = auth_headers(admin), removed.id, untouched.id
+
+    assert client.put(f"/users/{renamed.id}", headers=headers, json={"name": "New Name"}).status_code == 200
+    assert client.delete(f"/users/{removed_id}", headers=headers).status_code == 200
+    added = make_user("advisor")
+
+    delta = lookup(client, admin, since=version)
+    body = delta.json()
+    assert body["version"] == int(delta.headers["x-users-version"]) > version
+    assert body["changed"] == {renamed.id: "New Name", added.id: added.name}
+    assert body["deleted"] == [removed_id]
+    assert body["reset"] is False
+    assert untouched_id not in body["changed"]
+
+    # Up to date: an empty delta at the same version
+    caught_up = lookup(client, admin, since=body["version"]).json()
+    assert caught_up == {"version": body["version"], "changed": {}, "deleted": [], "reset": False}
+
+
+def test_only_lookup_and_search_fields_bump_the_version(client, db, make_user):
+    admin, student = make_user("admin"), make_user("student")
+    headers = auth_headers(admin)
+    version = int(lookup(client, admin).headers["x-users-version"])
+
+    assert client.put(f"/users/{student.id}", headers=headers, json={"cgpa": 9.1, "age": 20}).status_code == 200
+    assert int(lookup(client, admin).headers["x-users-version"]) == version
+
+    for field, value in (("section", "B"), ("year", 3), ("roll_no", "R-42")):
+        assert client.put(f"/users/{student.id}", headers=headers, json={field: value}).status_code == 200
+        delta = lookup(client, admin, since=version).json()
+        assert delta["version"] > version, field
+        assert list(delta["changed"]) == [student.id], field
+        version = delta["version"]
+
+    # Not editable through the API; the listener covers every session
+    db.refresh(student)
+    student.department = "Physics"
+    db.commit()
+    delta = lookup(client, admin, since=version).json()
+    assert delta["version"] > version
+    assert list(delta["changed"]) == [student.id]
+
+
+def test_unknown_version_resets_to_the_full_map(client, make_user):
+    admin, student = make_user("admin"), make_user("student")
+    version = int(lookup(client, admin).headers["x-users-version"])
+
+    body = lookup(client, admin, since=version + 100).json()
+
+    assert body["reset"] is True
+    assert body["version"] == version
+    assert body["changed"] == {admin.id: admin.name, student.id: student.name}
+
+
+def test_full_map_revalidates_with_its_etag(client, make_user):
+    admin = make_user("admin")
+    etag = lookup(client, admin).headers["etag"]
+
+    response = client.get("/users/lookup", headers={**auth_headers(admin), "If-None-Match": etag})
+    assert response.status_code == 304
+
+    make_user("student")
+    assert client.get("/users/lookup", headers={**auth_headers(admin), "If-None-Match": etag}).status_code == 200
@@ -0,0 +1,147 @@
+"""
+In-memory prefix index for user typeahead (/users/search).
+
+Every user is indexed under their roll number, username, full name and each
+word of their name. The keys live in one sorted list, so a prefix lookup is
+a binary search followed by a short scan. The index is built at startup and
+kept current by the user routes (``upsert``/``remove``). Changes made by other
+processes are picked up through the user directory version from user_sync,
+which is checked at most every USER_SEARCH_TTL seconds.
+"""
+import bisect
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import user_sync
+from logging_config import logger
+from metrics import record_cache
+from models import User
+
+USER_SEARCH_TTL = float(os.getenv("USER_SEARCH_TTL", "60"))
+
+# Weight of a match on each kind of key; exact matches get one extra point
+ID_WEIGHT = 3       # roll_no, username
+NAME_WEIGHT = 2     # full name
+WORD_WEIGHT = 1     # any later word of the name
+
+RECORD_FIELDS = ("id", "name", "username", "roll_no", "role", "section", "year", "department")
+
+
+def normalize(value: str) -> str:
+    return " ".join(value.casefold().split())
+
+
+def _keys_for(user) -> List[Tuple[str, int]]:
+    keys = []
+    for value in (user.roll_no, user.username):
+        if value:
+            keys.append((normalize(value), ID_WEIGHT))
+    if user.name:
+        name = normalize(user.name)
+        keys.append((name, NAME_WEIGHT))
+        # The first word is already covered by the full-name key
+        keys.extend((word, WORD_WEIGHT) for word in name.split()[1:])
+    return keys
+
+
+class UserSearchIndex:
+    def __init__(self, ttl: float = USER_SEARCH_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: List[Tuple[str, str, int]] = []  # (key, user_id, weight), sorted
+        self._records: Dict[str, dict] = {}
+        self._keys: Dict[str, List[Tuple[str, int]]] = {}
+        self._version = None
+        self._checked_at = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def rebuild(self, db: Session) -> "UserSearchIndex":
+        version = user_sync.current_version(db)
+        users = db.query(*[getattr(User, field) for field in RECORD_FIELDS]).all()
+        entries, records, keys = [], {}, {}
+        for user in users:
+            records[user.id] = {field: getattr(user, field) for field in RECORD_FIELDS}
+            keys[user.id] = _keys_for(user)
+            entries.extend((key, user.id, weight) for key, weight in keys[user.id])
+        entries.sort()
+
+        with self._lock:
+            self._entries, self._records, self._keys = entries, records, keys
+            self._version = version
+            self._checked_at = time.monotonic()
+        logger.info(f"User search index built with {len(records)} users")
+        return self
+
+    def refresh_if_stale(self, db: Session) -> "UserSearchIndex":
+        """Rebuild if another process changed users; costs one query per TTL"""
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl:
+            record_cache("user_search_index", hit=True)
+            return self
+        if self._version is None or user_sync.current_version(db) != self._version:
+            record_cache("user_search_index", hit=False)
+            return self.rebuild(db)
+        record_cache("user_search_index", hit=True)
+        self._checked_at = time.monotonic()
+        return self
+
+    def upsert(self, user: User) -> None:
+        with self._lock:
+            self._remove_locked(user.id)
+            self._records[user.id] = {field: getattr(user, field) for field in RECORD_FIELDS}
+            self._keys[user.id] = _keys_for(user)
+            for key, weight in self._keys[user.id]:
+                bisect.insort(self._entries, (key, user.id, weight))
+
+    def remove(self, user_id: str) -> None:
+        with self._lock:
+            self._remove_locked(user_id)
+
+    def _remove_locked(self, user_id: str):
+        self._records.pop(user_id, None)
+        for key, weight in self._keys.pop(user_id, []):
+            i = bisect.bisect_left(self._entries, (key, user_id, weight))
+            if i < len(self._entries) and self._entries[i] == (key, user_id, weight):
+                del self._entries[i]
+
+    def _match_prefix(self, prefix: str) -> Dict[str, int]:
+        """Best score per user with a key starting with ``prefix``"""
+        scores = {}
+        i = bisect.bisect_left(self._entries, (prefix,))
+        while i < len(self._entries) and self._entries[i][0].startswith(prefix):
+            key, user_id, weight = self._entries[i]
+            score = weight * 2 + (1 if key == prefix else 0)
+            if score > scores.get(user_id, 0):
+                scores[user_id] = score
+            i += 1
+        return scores
+
+    def search(self, q: str, role: Optional[str] = None, limit: int = 20) -> List[dict]:
+        """Users matching every word of ``q`` as a prefix, best first"""
+        terms = normalize(q).split()
+        if not terms:
+            return []
+        with self._lock:
+            scores = None
+            for term in terms:
+                matches = self._match_prefix(term)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {user_id: score + matches[user_id] for user_id, score in scores.items() if user_id in matches}
+                if not scores:
+                    return []
+            records = [
+                dict(self._records[user_id], score=score) for user_id, score in scores.items()
+                if role is None or self._records[user_id]["role"] == role
+            ]
+        records.sort(key=lambda record: (-record["score"], normalize(record["name"] or record["username"])))
+        return records[:limit]
+
+
+user_index = UserSearchIndex()
@@ -0,0 +1,81 @@
+"""
+Versioning of the user directory behind /users/lookup.
+
+Every flush that creates or deletes a user, or changes a field the lookup
+map or the /users/search index holds (LOOKUP_FIELDS), bumps the "users"
+counter in sync_versions and stamps the changed rows with it (deleted
+users get a row in user_tombstones). The counter row is updated
+inside the same transaction, so concurrent writers take turns on it and a
+version is never visible before every change it covers is committed.
+
+Clients keep the map from /users/lookup together with its X-Users-Version
+header and later ask for /users/lookup?since=<version> to get only what
+changed. Importing this module registers the listener for every Session.
+"""
+from typing import Dict, List
+
+from sqlalchemy import event, exists, inspect
+from sqlalchemy.orm import Session
+
+from counters import next_value
+from models import SyncVersion, User, UserTombstone
+
+USERS_COUNTER = "users"
+# Columns that feed the lookup map and the search index (user_search's
+# RECORD_FIELDS); other profile edits do not bump the version
+LOOKUP_FIELDS = ("name", "username", "roll_no", "role", "section", "year", "department")
+
+
+def current_version(db: Session) -> int:
+    value = db.query(SyncVersion.value).filter(SyncVersion.name == USERS_COUNTER).scalar()
+    return value or 0
+
+
+def display_name(name, username) -> str:
+    # Use name if available, otherwise fall back to username
+    return name if name else username
+
+
+def lookup_map(db: Session) -> Dict[str, str]:
+    return {
+        user_id: display_name(name, username)
+        for user_id, name, username in db.query(User.id, User.name, User.username)
+    }
+
+
+def lookup_delta(db: Session, since: int):
+    """Return (changed map, deleted ids) for changes after version ``since``"""
+    changed = {
+        user_id: display_name(name, username)
+        for user_id, name, username in db.query(User.id, User.name, User.username).filter(User.version > since)
+    }
+    deleted: List[str] = [
+        user_id for (user_id,) in db.query(UserTombstone.user_id).filter(
+            UserTombstone.version > since,
+            ~exists().where(User.id == UserTombstone.user_id)
+        )
+    ]
+    return changed, deleted
+
+
+def _lookup_fields_changed(user: User) -> bool:
+    attrs = inspect(user).attrs
+    return any(attrs[field].history.has_changes() for field in LOOKUP_FIELDS)
+
+
+@event.listens_for(Session, "before_flush")
+def _version_user_changes(session, flush_context, instances):
+    stamped = [obj for obj in session.new if isinstance(obj, User)]
+    stamped += [
+        obj for obj in session.dirty
+        if isinstance(obj, User) and _lookup_fields_changed(obj)
+    ]
+    deleted = [obj for obj in session.deleted if isinstance(obj, User)]
+    if not stamped and not deleted:
+        return
+
+    version = next_value(session, USERS_COUNTER)
+    for user in stamped:
+        user.version = version
+    for user in deleted:
+        session.merge(UserTombstone(user_id=user.id, version=version))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Response Cache Invalidation Check
+Every write that changes a cached response must turn the next request into a
+MISS; reads and rolled-back writes must not. Runs the app in-process against
+a temporary SQLite database, so no server is needed:
+
+    python verify_response_cache.py
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date
+
+DATABASE_DIR = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_DIR}/verify_cache.db"
+os.environ.setdefault("SECRET_KEY", "verify-response-cache")
+os.environ["RESPONSE_CACHE_BACKEND"] = "memory"
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+from auth import create_access_token
+from database import SessionLocal, engine
+from models import AttendanceRecord, LeaveRequest, User
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+TODAY = date.today().isoformat()
+ROSTER = f"/attendance/roster?date={TODAY}"
+failures = []
+
+
+def print_section(title):
+    print(f"\n{'='*60}")
+    print(f"  {title}")
+    print(f"{'='*60}\n")
+
+
+def expect(client, headers, path, outcome, what):
+    response = client.get(path, headers=headers)
+    actual = response.headers.get("x-cache")
+    if response.status_code == 200 and actual == outcome:
+        print(f"✅ {what}: {outcome}")
+    else:
+        print(f"❌ {what}: expected {outcome}, got {response.status_code} {actual}")
+        failures.append(what)
+    return response
+
+
+def seed():
+    db = SessionLocal()
+    admin = User(username="verify_admin", hashed_password="-", role="admin", name="Admin")
+    student = User(username="verify_student", hashed_password="-", role="student", name="Student", section="A")
+    db.add_all([admin, student])
+    db.flush()
+    leave = LeaveRequest(student_id=student.id, start_date=date.today(), end_date=date.today(), reason="Verify")
+    db.add(leave)
+    db.commit()
+    ids = admin.id, student.id, leave.id
+    db.close()
+    return ids
+
+
+def run():
+    with TestClient(main.app) as client:
+        admin_id, student_id, leave_id = seed()
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': 'verify_admin'})}"}
+
+        print_section("Roster: repeated reads")
+        expect(client, headers, ROSTER, "MISS", "First roster read")
+        etag = expect(client, headers, ROSTER, "HIT", "Second roster read").headers.get("etag")
+        not_modified = client.get(ROSTER, headers={**headers, "If-None-Match": etag})
+        if not_modified.status_code == 304:
+            print("✅ If-None-Match with the current ETag: 304")
+        else:
+            print(f"❌ If-None-Match with the current ETag: {not_modified.status_code}")
+            failures.append("If-None-Match")
+
+        print_section("Roster: one connection per cached request")
+        checkouts = []
+        listener = lambda *args: checkouts.append(1)
+        event.listen(engine, "checkout", listener)
+        expect(client, headers, ROSTER, "HIT", "Roster read while counting checkouts")
+        event.remove(engine, "checkout", listener)
+        if len(checkouts) == 1:
+            print("✅ Pool checkouts for a hit: 1")
+        else:
+            print(f"❌ Pool checkouts for a hit: {len(checkouts)}")
+            failures.append("Connections per request")
+
+        print_section("Roster: writes invalidate")
+        response = client.post(f"/requests/{leave_id}/approve", headers=headers)
+        print(f"   Approve leave request: {response.status_code}")
+        expect(client, headers, ROSTER, "MISS", "Roster after approval (bulk upsert)")
+        expect(client, headers, ROSTER, "HIT", "Roster read again")
+
+        response = client.post("/attendance/mark", headers=headers, json={
+            "records": [{"student_id": student_id, "date": TODAY, "status": "present"}]
+        })
+        print(f"   Mark attendance: {response.status_code}")
+        expect(client, headers, ROSTER, "MISS", "Roster after marking (ORM update)")
+        expect(client, headers, ROSTER, "HIT", "Roster read again")
+
+        # Another worker: a separate session, nothing shared in memory
+        db = SessionLocal()
+        db.query(User).filter(User.id == student_id).first().name = "Renamed"
+        db.commit()
+        db.close()
+        expect(client, headers, ROSTER, "MISS", "Roster after a user edit in another session")
+
+        print_section("Roster: rolled-back writes do not invalidate")
+        expect(client, headers, ROSTER, "HIT", "Roster read")
+        db = SessionLocal()
+        db.add(AttendanceRecord(student_id=student_id, date=date(2000, 1, 1), status="absent", marked_by=admin_id))
+        db.flush()
+        db.rollback()
+        db.close()
+        expect(client, headers, ROSTER, "HIT", "Roster after a rolled-back insert")
+
+        print_section("User lookup")
+        expect(client, headers, "/users/lookup", "MISS", "First lookup")
+        expect(client, headers, "/users/lookup", "HIT", "Second lookup")
+        db = SessionLocal()
+        db.add(User(username="verify_new", hashed_password="-", role="student", name="New"))
+        db.commit()
+        db.close()
+        response = expect(client, headers, "/users/lookup", "MISS", "Lookup after creating a user")
+        if "New" not in response.json().values():
+            print("❌ New user missing from the lookup map")
+            failures.append("Lookup content")
+
+
+if __name__ == "__main__":
+    try:
+        run()
+    finally:
+        engine.dispose()
+        shutil.rmtree(DATABASE_DIR, ignore_errors=True)
+    print_section("RESULT")
+    if failures:
+        print(f"❌ {len(failures)} check(s) failed: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ Every write invalidated the cached responses it changes")
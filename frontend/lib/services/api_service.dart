@@ -462,14 +462,23 @@ class ApiService {
     }
   }
 
-  // Get request history (processed requests)
+  // Get request history (processed requests), following X-Next-Cursor page by page
   Future<List<dynamic>> getRequestHistory() async {
     try {
-      final response = await _dio.get('/requests/history');
-      if (response.statusCode == 200) {
-        return response.data as List;
-      }
-      return [];
+      final history = <dynamic>[];
+      String? cursor;
+      do {
+        final response = await _dio.get('/requests/history', queryParameters: {
+          'limit': 500,
+          if (cursor != null) 'cursor': cursor,
+        });
+        if (response.statusCode != 200) {
+          return [];
+        }
+        history.addAll(response.data as List);
+        cursor = response.headers.value('x-next-cursor');
+      } while (cursor != null);
+      return history;
     } catch (e) {
       debugPrint('Get request history error: $e');
       return [];